@@ -11,14 +11,18 @@
 from __future__ import division
 from __future__ import print_function
 import argparse
+import copy
 import ctypes
 import fcntl
 import hashlib
+import itertools
 import json
 import logging
+import multiprocessing
 import os
 import pickle
 import re
+import select
 import signal
 import socket
 import sre_constants
@@ -27,7 +31,10 @@ import subprocess
 import sys
 import tarfile
 import textwrap
+import threading
 import time
+import zlib
+from collections import OrderedDict
 
 
 try:
@@ -39,13 +46,13 @@ except ImportError:
 class Config(object):
     def __init__(self):
         # type: () -> None
-        self.log_level = "" # set by argparse
+        self.log_level = logging.ERROR # set by argparse, default is for Config used without it. See collect
 
         self.output_view = "system"
         self.output_order_general = {
                     "system": ["Dev", "Desc", "PN", "PSID", "SN", "FW", "Driver", "PCI_addr", "RDMA", "Net", "Port", "Numa", "LnkStat",
                                "IpStat", "Link", "Rate", "SRIOV", "Parent_addr", "Tempr", "LnkCapWidth", "LnkStaWidth",
-                               "HCA_Type", "Bond", "BondState", "BondMiiStat"],
+                               "HCA_Type", "Bond", "BondState", "BondMiiStat", "BondAggId", "BondLnkFail", "LacpPartner"],
                     "ib": ["Dev", "Desc", "PN", "PSID", "SN", "FW", "Driver", "RDMA", "Port", "Net", "Numa", "LnkStat", "IpStat",
                            "VrtHCA", "PLid", "PGuid", "IbNetPref"],
                     "roce": ["Dev", "Desc", "PN", "PSID", "SN", "FW", "Driver", "PCI_addr", "RDMA", "Net", "Port", "Numa", "LnkStat",
@@ -56,7 +63,14 @@ class Config(object):
                     "lldp": ["Dev", "Desc", "PN", "PSID", "SN", "FW", "Driver", "PCI_addr", "RDMA", "Net", "Port", "Numa", "LnkStat",
                              "IpStat", "LLDPportId", "LLDPsysName", "LLDPmgmtAddr", "LLDPsysDescr"],
                     "dpu": ["Dev", "Desc", "PN", "PSID", "SN", "FW", "Driver", "PCI_addr", "RDMA", "Port", "Net", "DPUmode",
-                            "BFBver", "RshimDev", "OvsBrdg", "LnkStat", "IpStat", "UplnkRepr", "PfRepr", "VfRepr", "SRIOV"]
+                            "BFBver", "RshimDev", "OvsBrdg", "OvsOfport", "OvsAdmStat", "LnkStat", "IpStat", "UplnkRepr", "PfRepr",
+                            "VfRepr", "SRIOV"],
+                    "sf": ["Dev", "Desc", "PN", "FW", "Driver", "PCI_addr", "RDMA", "Net", "SFnum", "SFctrl", "SFstate", "HwAddr",
+                           "LnkStat", "IpStat"],
+                    "counters": ["Dev", "Desc", "PN", "FW", "Driver", "PCI_addr", "RDMA", "Port", "Net", "CntrSet", "Counter",
+                                 "Total", "Delta", "PerSec"],
+                    "ethstats": ["Dev", "Desc", "PN", "FW", "Driver", "PCI_addr", "RDMA", "Net", "Port", "LnkStat", "RoCEstat",
+                                 "RxBps", "TxBps", "PrioRxBps", "PrioTxBps", "PrioPause", "RxDiscPhy", "QDrops", "PauseStorm"]
         }
         self.output_order = self.output_order_general[self.output_view]
         self.show_warnings_and_errors = True
@@ -69,9 +83,24 @@ class Config(object):
 
         self.record_data_for_debug = False
         self.record_dir = "/tmp/lshca"
-        self.record_tar_file = None
+        self.record_format = "lshrec"
+        self.record_file = None
 
-        self.ver = "3.9"
+        self.fs_root = ""
+        self.mft_by_bdf = False
+        # Seconds between 2 counter samples of counters and ethstats views
+        self.counters_interval = 1.0
+        self.counters_nonzero = False
+
+        # Seconds cached DataSource output stays valid between runs of resident lshca (daemon, collect on a reused
+        # DataSource), None - never expires. Single run never expires its cache. See DataSourceCache for classes
+        self.cache_ttl = {"static": None, "slow": 600, "volatile": 30}
+        self.cache_max_entries = 4096
+
+        self.profile = False
+        self.trace_file = None
+
+        self.ver = "3.10.dev0"
 
         self.output_format = "human_readable"
         self.output_format_elastic = None
@@ -90,6 +119,34 @@ class Config(object):
         # based on https://docs.mellanox.com/pages/viewpage.action?pageId=43714202#LinkLayerDiscoveryProtocol(LLDP)-lldptimer
         self.lldp_capture_timeout = 35 # seconds. Based on default 30s value in Mellanox Onyx OS
 
+        # Celsius. Used when HCA hwmon sensor doesn't report max/crit thresholds
+        self.tempr_warning_threshold = 80
+        self.tempr_error_threshold = 90
+
+        self.sa_smp_query_workers = 16 # IB ports queried concurrently
+
+        self.ovsdb_socket = "/var/run/openvswitch/db.sock"
+
+        # Fleet aggregation of lshca JSON snapshots, see FleetAggregate
+        self.aggregate_paths = []
+        self.aggregate_group_by = []
+        self.aggregate_workers = 0 # 0 - worker process per CPU
+        self.aggregate_max_distinct = 32 # distinct values kept per field and group, the rest are counted as other
+
+        # Snapshot diff against earlier lshca -j output, see SnapshotDiff
+        self.baseline_file = None
+        # Values of these fields change all the time, comparing them to baseline is noise
+        self.diff_ignored_fields = ["Dev", "Tempr", "TX_bps", "RX_bps", "PktSeqErr", "RxBps", "TxBps", "PrioRxBps",
+                                    "PrioTxBps", "PrioPause", "RxDiscPhy", "QDrops", "PauseStorm", "Total", "Delta",
+                                    "PerSec"]
+
+        # Resident daemon and its clients, see LshcaDaemon
+        self.daemon = False
+        self.daemon_client = False
+        self.daemon_socket = "/var/run/lshca.sock"
+        self.daemon_timeout = 60 # seconds. Cold collection of slow views, i.e. lldp, takes long
+        self.daemon_view_idle_time = 600 # seconds. Views not queried for this long aren't refreshed anymore
+
     def parse_arguments(self, user_args):
         # type: (list) -> None
         parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter,
@@ -105,6 +162,9 @@ class Config(object):
                      examples:
                          lshca -j -s mst -o \"-SN\"
                          lshca -o \"Dev,Port,Net,PN,Desc,RDMA\" -ow \"RDMA=mlx5_[48]\"
+                         lshca --aggregate snapshots/ --group-by PN -o FW
+                         lshca --aggregate snapshots.ndjson -o Node -ow \"LnkStaWidth=x8\"
+                         lshca -j > before.json; <maintenance>; lshca --baseline before.json --diff
 
                         '''))
 
@@ -121,7 +181,38 @@ class Config(object):
                               normal - list HCAs
                               record - record all data for debug and lists HCAs\
                             '''))
-        parser.add_argument('-w', choices=['system', 'ib', 'roce', 'cable', 'traffic', 'lldp', 'dpu', 'all'], default='system', dest="view",
+        parser.add_argument('--record-format', choices=["lshrec", "tar"], default="lshrec", dest="record_format",
+                            help=textwrap.dedent('''\
+                            format of the recorded data file (default: %(default)s):
+                              lshrec - indexed, compressed and deduplicated recording
+                              tar    - legacy tar of pickled files\
+                            '''))
+        parser.add_argument('--fs-root', dest="fs_root", default="",
+                            help=textwrap.dedent('''\
+                            read sysfs, procfs and /dev under FS_ROOT instead of /.
+                            Executables in FS_ROOT/bin take precedence over system ones.
+                            The tree is only read: mst service isn't started, netlink and ioctl queries of the
+                            running host are skipped. Root privileges aren't required, unless with --daemon.
+                            Used to run on synthetic hosts, see regression/lshca_synthetic_host.py
+                            '''))
+        parser.add_argument('--mft-by-bdf', action='store_true', dest="mft_by_bdf",
+                            help=textwrap.dedent('''\
+                            address mlxlink, mlxconfig, mlxprivhost and cable access by PCI BDF.
+                            mst service isn't started nor stopped. Requires recent MFT
+                            '''))
+        parser.add_argument('--profile', action='store_true', dest="profile",
+                            help=textwrap.dedent('''\
+                            print time spent per data source, command, BDF and output phase to stderr.
+                            With -j the report is JSON
+                            '''))
+        parser.add_argument('--trace', dest="trace_file", metavar="FILE",
+                            help=textwrap.dedent('''\
+                            write timeline of data collection and output phases to FILE
+                            in Chrome trace event format. Open in chrome://tracing or ui.perfetto.dev
+                            '''))
+        parser.add_argument('-w', choices=['system', 'ib', 'roce', 'cable', 'traffic', 'lldp', 'dpu', 'sf', 'counters',
+                                           'ethstats', 'all'],
+                            default='system', dest="view",
                             help=textwrap.dedent('''\
                             show output view (default: %(default)s):
                               system  - (default). Show system oriented HCA info
@@ -132,10 +223,58 @@ class Config(object):
                               traffic - Show port traffic
                               lldp    - Show lldp information.
                               dpu     - Shou DPU (blueField) information
-                              all     - Show all available HCA info. Aggregates all above views + MST data source.
+                              sf      - Show scalable functions (SFs) only
+                              counters - Show all port counters and their rates. Line per counter, see --interval and --nonzero
+                              ethstats - Show Ethernet driver statistics rates, per priority and aggregated per queue. See --interval
+                              all     - Show all available HCA info. Aggregates all above views, except counters and ethstats
+                                        + MST data source.
                               Note: all human readable output views are elastic. See extended help for more info.
                             ''')
                             )
+        parser.add_argument('--interval', type=float, default=1.0, dest="counters_interval", metavar="SECONDS",
+                            help="counters and ethstats views sampling interval in seconds (default: %(default)s)")
+        parser.add_argument('--nonzero', action='store_true', dest="counters_nonzero",
+                            help="counters view shows only counters that changed during sampling interval")
+        parser.add_argument('--aggregate', dest="aggregate_paths", nargs="+", metavar="PATH",
+                            help=textwrap.dedent('''\
+                            aggregate lshca -j snapshots of many nodes instead of listing local HCAs.
+                            PATH is a file or a directory of files:
+                              *.ndjson, *.jsonl - line per node. Line is lshca -j output or {"node": name, "hcas": lshca -j output}
+                              other files       - lshca -j output of single node, named after the file
+                            Shows count, distinct values, min and max per field. Fields and filters as with -o, -onot
+                            and -ow, "Node" field added to every snapshot. See --group-by
+                            '''))
+        parser.add_argument('--group-by', dest="aggregate_group_by", nargs="+", metavar="FIELD", default=[],
+                            help="--aggregate output grouped by values of FIELDs (comma delimited list)")
+        parser.add_argument('--aggregate-workers', type=int, default=0, dest="aggregate_workers", metavar="N",
+                            help="--aggregate worker processes, 0 - one per CPU (default: %(default)s)")
+        parser.add_argument('--max-distinct', type=int, default=32, dest="aggregate_max_distinct",
+                            help=textwrap.dedent('''\
+                            --aggregate distinct values kept per field, rest are counted as other (default: %(default)s)
+                            Keeps memory bounded regardless of number of nodes
+                            '''))
+        parser.add_argument('--baseline', dest="baseline_file", metavar="FILE",
+                            help="earlier lshca -j output of this host, used by --diff")
+        parser.add_argument('--diff', action='store_true', dest="diff",
+                            help=textwrap.dedent('''\
+                            show only what changed since --baseline: changed, added and removed fields and BDFs.
+                            HCAs are matched by SN, BDFs by PCI_addr and Port. Fields and filters as with -o, -onot
+                            and -ow. Fields that always change (i.e. Tempr, traffic rates) aren't compared
+                            '''))
+        parser.add_argument('--daemon', action='store_true', dest="daemon",
+                            help=textwrap.dedent('''\
+                            run as resident daemon, serving collected data over unix socket, see --socket.
+                            Collected data is kept and refreshed by its cache class schedule, see extended help.
+                            lshca runs query the daemon with --use-daemon only
+                            '''))
+        parser.add_argument('--socket', dest="daemon_socket", default="/var/run/lshca.sock", metavar="PATH",
+                            help="unix socket of lshca daemon (default: %(default)s)")
+        parser.add_argument('--use-daemon', action='store_true', dest="daemon_client",
+                            help=textwrap.dedent('''\
+                            query lshca daemon instead of collecting data directly, falling back to direct collection
+                            if the daemon isn't running. Served data is up to 2 volatile refresh periods old and it's
+                            collected with root privileges, see extended help
+                            '''))
         parser.add_argument('--non-elastic', action='store_false', dest="elastic",
                             help="Set human readable output as non elastic")
         parser.add_argument('--no-colour', '--no-color', action='store_false', dest="colour",
@@ -163,12 +302,30 @@ class Config(object):
                 cust_user_args.append(member)
 
         args = parser.parse_args(cust_user_args)
+        if args.diff != bool(args.baseline_file):
+            parser.error("--diff and --baseline are used together")
         self.process_arguments(args)
 
     def process_arguments(self, args):
         # type: (argparse.Namespace) -> None
         if args.mode == "record":
             self.record_data_for_debug = True
+        self.record_format = args.record_format
+        self.fs_root = args.fs_root.rstrip("/")
+        self.mft_by_bdf = args.mft_by_bdf
+        self.counters_interval = args.counters_interval
+        self.counters_nonzero = args.counters_nonzero
+        self.aggregate_paths = args.aggregate_paths or []
+        self.aggregate_group_by = remove_duplicates(args.aggregate_group_by)
+        self.aggregate_workers = args.aggregate_workers
+        self.aggregate_max_distinct = max(args.aggregate_max_distinct, 1)
+        self.profile = args.profile
+        self.trace_file = args.trace_file
+        self.daemon = args.daemon
+        self.daemon_socket = args.daemon_socket
+        # Daemon serves data of its host with its own settings, local collection settings need local collection
+        self.daemon_client = args.daemon_client and not args.daemon and self.record_data_for_debug is False and \
+            not self.fs_root and not self.profile and not self.trace_file
 
         self.log_level = getattr(logging, args.log_level)
 
@@ -186,26 +343,26 @@ class Config(object):
             self.output_view = "lldp"
         elif args.view == "dpu":
             self.output_view = "dpu"
+        elif args.view == "sf":
+            self.output_view = "sf"
+        elif args.view == "counters":
+            self.output_view = "counters"
+        elif args.view == "ethstats":
+            self.output_view = "ethstats"
         elif args.view == "all":
             self.output_view = "all"
 
-        if self.output_view != "all":
-            self.output_order = self.output_order_general[self.output_view]
-        else:
-            i = 0
-            for view in self.output_order_general:
-                if i == 0:
-                    self.output_order = self.output_order_general[view]
-                else:
-                    for key in self.output_order_general[view]:
-                        if key not in self.output_order:
-                            self.output_order.append(key)
-                i += 1
+        self.set_output_order()
 
         if args.json:
             self.output_format = "json"
             self.show_warnings_and_errors = False
 
+        if args.diff:
+            self.baseline_file = args.baseline_file
+            # baseline is JSON output, warning signs would show as changes
+            self.show_warnings_and_errors = False
+
         if args.output_fields_filter_positive:
             self.output_fields_filter_positive = remove_duplicates(args.output_fields_filter_positive)
 
@@ -215,6 +372,10 @@ class Config(object):
         if args.output_fields_value_filter:
             self.where_output_filter = args.output_fields_value_filter
 
+        # SRIOV isn't part of sf view, but still can filter
+        if self.output_view == "sf":
+            self.where_output_filter = [r"SRIOV=\s*SF$"] + list(self.where_output_filter)
+
         if args.extended_help:
             self.extended_help()
 
@@ -222,6 +383,26 @@ class Config(object):
 
         self.colour_warnings_and_errors = args.colour
 
+    def set_output_order(self):
+        # type: () -> None
+        # Lists are copied, views of output_order_general stay intact for following runs. See LshcaDaemon
+        if self.output_view != "all":
+            self.output_order = list(self.output_order_general[self.output_view])
+        else:
+            i = 0
+            for view in self.output_order_general:
+                # counters view has line per counter, it doesn't fit the rest
+                # ethstats view samples over --interval, all view shouldn't wait for it
+                if view in ("counters", "ethstats"):
+                    continue
+                if i == 0:
+                    self.output_order = list(self.output_order_general[view])
+                else:
+                    for key in self.output_order_general[view]:
+                        if key not in self.output_order:
+                            self.output_order.append(key)
+                i += 1
+
     def extended_help(self):
         # type: () -> None
         extended_help = textwrap.dedent("""
@@ -235,8 +416,10 @@ class Config(object):
           PN     - HCA part number including revision
           SN     - HCA serial number
           PSID   - HCA PSID number (Parameter Set ID)
-          Driver - Driver source (mlnx_ofed/inbox) and it version
-          Tempr  - HCA temperature. Based on mget_temp utility from MFT
+          Driver - Driver source (mlnx_ofed/inbox) and it version. Based on ofed_info and mlx5_core module in sysfs,
+                   modinfo if both are missing
+          Tempr  - HCA temperature. Based on mlx5 hwmon sensor, mget_temp utility from MFT on older kernels.
+                   Warning/error sign is shown above sensor max/crit threshold, if reported, or 80/90C
 
         BDF devices:
          Generic
@@ -279,6 +462,18 @@ class Config(object):
                           On master interface - bonding policy appended by xmit hash policy if relevant
                           Search for bonding.txt in kernel.org for detailed information
           BondMiiStat   - Interface mii status in a bond. Search for bonding.txt in kernel.org for detailed information
+          BondAggId     - 802.3ad aggregator ID. Source /proc/net/bonding
+                          On slave interface - aggregator the slave belongs to, marked if it isn't the active one
+                          On master interface - active aggregator
+          BondLnkFail   - Slave link failure count since bond creation. Source /proc/net/bonding
+          LacpPartner   - LACP partner system MAC address. Source /proc/net/bonding
+                          Marked if no LACPDU was received from the partner
+
+         SF view
+          SFnum         - SF number, as it was set by SF creator (devlink port add ... sfnum N)
+          SFctrl        - Controller (host) number of the SF. Source devlink, requires eswitch manager (i.e. DPU)
+          SFstate       - SF operational state. Source devlink, otherwise attached/detached by driver binding
+          HwAddr        - SF netdev hardware address
 
          IB view
           IbNetPref     - IB network preffix
@@ -293,10 +488,10 @@ class Config(object):
                             NA   - IB link - not supported with mlx4 driver OR non IB link
 
          Cable view   (use source utils for more info)
-          MST_device    - MST device name. Source mst
-          CblPN         - Part number of the connected cable. Source mlxcable
-          CblSN         - Serial number of the connected cable. Source mlxcable
-          CblLng        - Length of the connected cable. Source mlxcable
+          MST_device    - MST device name. Source mst. PCI BDF with --mft-by-bdf
+          CblPN         - Part number of the connected cable. Source mlxcable, mlxlink with --mft-by-bdf
+          CblSN         - Serial number of the connected cable. Source mlxcable, mlxlink with --mft-by-bdf
+          CblLng        - Length of the connected cable. Source mlxcable, mlxlink with --mft-by-bdf
           PhyAnalisys   - If something goes wrong, some analisys will be shown to assist in issue resolution. Source mlxlink
           PhyLinkStat   - Status of the physical link. May differ from its logical state. Source mlxlink
           PhyLnkSpd     - Speed of the physical link. I.e protocol used for communication. Source mlxlink
@@ -318,6 +513,38 @@ class Config(object):
           PktSeqErr - The number of received NAK sequence error packets (counts how many times there was a sequence number gap)
                       Based on packet_seq_err counter
 
+         Counters view (line per counter of every port)
+          CntrSet   - Counters directory of the port: counters (IB spec port counters) or hw_counters (HCA counters)
+          Counter   - Counter name, as it appears in sysfs
+          Total     - Counter value at the end of sampling interval
+          Delta     - Counter change during sampling interval, see --interval
+          PerSec    - Counter change per second. Counter units, i.e. port_xmit_data counts 4 octets words
+                      Use --nonzero to show only counters that changed, JSON output has raw integer values
+
+         Ethstats view (K, M ,G used for human readability. Rates are per second over --interval)
+             Based on driver statistics, same as "ethtool -S" shows. Per queue statistics are summed over all queues
+          RoCEstat   - Same as in RoCE view
+          RxBps      - Received traffic in bit/sec. Based on rx_bytes_phy, rx_bytes if the driver has no phy statistics
+          TxBps      - Transmitted traffic in bit/sec. Based on tx_bytes_phy, tx_bytes if the driver has no phy statistics
+          PrioRxBps  - Received traffic in bit/sec per priority, as priority:rate. Only priorities with traffic are shown
+          PrioTxBps  - Transmitted traffic in bit/sec per priority, as priority:rate
+          PrioPause  - Pause frames per priority, as priority:received/transmitted pause frames per sec
+                       Transmitted pause frames mean the port can't keep up with received traffic
+          RxDiscPhy  - Received packets discarded by the port per sec, due to lack of buffers. Based on rx_discards_phy
+          QDrops     - Packets dropped by driver queues per sec, all per queue drop statistics summed
+          PauseStorm - Pause storm error events. Port stopped sending pause frames, as receive side was stuck
+
+         Daemon (--daemon)
+             Data sources are cached by classes, each class is refreshed on its own schedule:
+              static   - VPD, firmware and driver versions. Read once
+              slow     - mlxconfig, cable info, QoS settings. Refreshed every """ + str(self.cache_ttl["slow"]) + """ sec
+              volatile - link state, counters, temperature. Refreshed every """ + str(self.cache_ttl["volatile"]) + """ sec
+             Every view queried during last """ + str(self.daemon_view_idle_time) + """ sec is collected again on volatile schedule,
+             so queries are answered right away. Selection, filters and output format are applied by the querying lshca.
+             Only lshca runs with --use-daemon query the daemon. Served data is up to """ + str(2 * self.cache_ttl["volatile"]) + """ sec old,
+             it's collected by root, so any user with access to the socket gets it
+             counters and ethstats views sample the counters when asked, they are never served by the daemon
+
          LLDP view
              This view relies on:
               * LLDP information been sent by the connected switch (if not NoLldpRcvd error msg will be received)
@@ -340,11 +567,14 @@ class Config(object):
                 Separated - network function is assigned to both the Arm cores and the x86 host cores. Traffic reaches both of them
                 Undefined - Failed to identify DPU operation mode
           BFBver    - version of DPU BFB image. Works ONLY within the DPU os
-          RshimDev  - /dev/rshimN device for this DPU, requires loaded rhsim driver
+          RshimDev  - /dev/rshimN device for this DPU, requires loaded rhsim driver.
+                      Warning sign if rshim driver is in drop mode (released the device)
           UplnkRepr - Uplink representor
           PfRepr    - PF representors
           VfRepr    - VF representors
           OvsBrdg   - OVS bridge see link [representors] for more information
+          OvsOfport - OpenFlow port number of the interface in OVS bridge
+          OvsAdmStat - OVS administrative state of the interface
           [representors] - https://docs.nvidia.com/networking/display/BlueFieldDPUOSLatest/Kernel+Representors+Model
 
         --== Elastic output rules ==--
@@ -358,9 +588,16 @@ class Config(object):
         IpStat       - if all LnkStat valuse are "down"
         Bond, BondState, BondMiiStat
                      - if no bond device configured
+        BondAggId, LacpPartner
+                     - if there is no value, i.e. no 802.3ad bond
+        BondLnkFail  - if no slave link failures
         PhyAnalisys  - if no issue detected
         DPUmode      - if it has no value
         BFBver       - if it has no value
+        OvsOfport, OvsAdmStat
+                     - if there is no value, i.e. ovsdb-server socket isn't accessible
+        SFnum, SFctrl, SFstate, HwAddr
+                     - if there is no value, i.e. no SFs
         LLDPportId, LLDPsysName, LLDPmgmtAddr, LLDPsysDescr
                      - if the interface is not Ethernet
         Whole BDF    - if it part of DPU and LnkStat is nop (unused BDFs)
@@ -377,9 +614,14 @@ class HCAManager(object):
         self._config = config
         self._data_source = data_source
         self.mlnxHCAs = [] # type: list[MlnxHCA]
+        # Host wide data indexed once per run and shared by all devices, i.e. parsed "mst status -v"
+        # Built anew on every run, as DataSource may be reused by several runs. See collect
+        self._run_index = {}
 
     def get_data(self):
         # type: () -> None
+        self._run_index = {}
+
         mlnx_bdf_list = []
         # Same lspci cmd used in MST source in order to benefit from cache
         data = self._data_source.exec_shell_cmd("lspci -vvvDnnd 15b3:", use_cache=True)
@@ -390,18 +632,34 @@ class HCAManager(object):
             if bdf != "=N/A=":
                 mlnx_bdf_list.append(bdf)
 
+        sf_index = self.index_sfs()
+
         mlnx_bdf_devices = [] # type: list[MlnxBDFDevice]
         for bdf in mlnx_bdf_list:
             port_count = 1
 
             while True:
-                bdf_dev = MlnxBDFDevice(bdf, self._data_source, self._config, port_count)
-                bdf_dev.get_data()
+                bdf_dev = MlnxBDFDevice(bdf, self._data_source, self._config, port_count, run_index=self._run_index)
+                with self._data_source.profiler.span("bdf", self._bdf_label(bdf, port_count), bdf=bdf) as span:
+                    bdf_dev.get_data()
+                    span.tag(rdma=bdf_dev.rdma, net=bdf_dev.net)
                 mlnx_bdf_devices.append(bdf_dev)
 
-                for sf in bdf_dev.sf_list:
-                    sf_dev = MlnxBDFDevice(bdf, self._data_source, self._config, port_count, sf=sf)
-                    sf_dev.get_data()
+                # SFs belong to the PF, not to its ports
+                if port_count == 1 and sf_index is not None:
+                    sf_list = sf_index.get(bdf, [])
+                elif port_count == 1:
+                    sf_list = [{"sf": sf} for sf in self._list_pf_sfs(bdf)]
+                else:
+                    sf_list = []
+
+                for sf_info in sf_list:
+                    sf = sf_info["sf"]
+                    sf_dev = MlnxBDFDevice(bdf, self._data_source, self._config, port_count, sf=sf, pf_device=bdf_dev,
+                                           sf_info=sf_info if sf_index is not None else None, run_index=self._run_index)
+                    with self._data_source.profiler.span("bdf", self._bdf_label(bdf, port_count, sf), bdf=bdf) as span:
+                        sf_dev.get_data()
+                        span.tag(rdma=sf_dev.rdma, net=sf_dev.net)
                     mlnx_bdf_devices.append(sf_dev)
 
 
@@ -410,14 +668,40 @@ class HCAManager(object):
 
                 port_count += 1
 
+        sa_smp_query_manager = SaSmpQueryManager(self._data_source, self._config)
+        sa_smp_query_manager.get_data(mlnx_bdf_devices)
+
+        if self._config.output_view == "counters":
+            self.sample_counters(mlnx_bdf_devices)
+        if self._config.output_view == "ethstats":
+            self.sample_ethtool_stats(mlnx_bdf_devices)
+
+        # RoCE status of every port is based on DCB data, it's fetched for all interfaces in one pass
+        if self._config.output_view in ("roce", "ethstats", "all"):
+            self._data_source.get_dcb_data(remove_duplicates([bdf_dev.net for bdf_dev in mlnx_bdf_devices
+                                                              if bdf_dev.net and bdf_dev.link_layer != "IB"]))
+
+        # Every bond is parsed once, its slaves take their part of it
+        bonds_data = {}
+        for bdf_dev in mlnx_bdf_devices:
+            if bdf_dev.bond_master in ("=N/A=", "ovs-system", ""):
+                continue
+            if bdf_dev.bond_master not in bonds_data:
+                bonds_data[bdf_dev.bond_master] = ProcNetBonding(self._data_source, self._config)
+                bonds_data[bdf_dev.bond_master].get_data(bdf_dev.bond_master)
+            bdf_dev.set_bond_slave_data(bonds_data[bdf_dev.bond_master])
+
         # First handle all PFs
         for bdf_dev in mlnx_bdf_devices:
             rdma_bond_bdf = None
 
             # Only first slave interface in a bond has infiniband information on his sysfs
             if bdf_dev.bond_master != "=N/A=" and bdf_dev.bond_master != "ovs-system" and bdf_dev.rdma != "" :
-                rdma_bond_bdf = MlnxRdmaBondDevice(bdf_dev.bdf, self._data_source, self._config)
-                rdma_bond_bdf.get_data()
+                # Bond record is derived from the slave, which was already collected
+                rdma_bond_bdf = MlnxRdmaBondDevice(bdf_dev, bonds_data[bdf_dev.bond_master])
+                with self._data_source.profiler.span("bdf", self._bdf_label(bdf_dev.bdf, "rdma_bond"), bdf=bdf_dev.bdf) as span:
+                    rdma_bond_bdf.get_data()
+                    span.tag(rdma=rdma_bond_bdf.rdma, net=rdma_bond_bdf.net)
 
             if bdf_dev.sriov in ("PF", "PF" + self._config.warning_sign, "SF"):
                 hca_found = False
@@ -439,7 +723,9 @@ class HCAManager(object):
                     self.mlnxHCAs.append(hca)
 
                 if not hca.hca_data_retrieved:
-                    hca.get_data(bdf_dev)
+                    with self._data_source.profiler.span("hca", self._bdf_label(bdf_dev.bdf, "hca"), bdf=bdf_dev.bdf,
+                                                         rdma=bdf_dev.rdma):
+                        hca.get_data(bdf_dev)
                     if rdma_bond_bdf:
                         bdf_dev.rdma = ""
                         bdf_dev.lnk_state = ""
@@ -469,15 +755,136 @@ class HCAManager(object):
             for hca in self.mlnxHCAs:
                 hca.check_for_issues()
 
+    def index_sfs(self):
+        # type: () -> dict
+        # SFs of all PFs enumerated once from the auxiliary bus:
+        #   {PF BDF: [{"sf": mlx5_core.sf.N, "sfnum": str, "controller": str, "state": str}]}
+        # Returns None if there is no auxiliary bus, SFs are looked for in PF sysfs directories then
+        aux_prefix = "/sys/bus/auxiliary/devices"
+        aux_devices = self._data_source.list_dir_if_exists(aux_prefix).split()
+        if not aux_devices:
+            return None
+
+        sf_index = {}
+        sfs_by_sfnum = {}
+        sf_list = find_in_list(aux_devices, r'^mlx5_core\.sf\.[0-9]+$', return_only_first_group=False) or []
+        for sf in sorted(sf_list, key=lambda sf_name: int(sf_name.split(".")[-1])):
+            # i.e. ../../../devices/pci0000:00/0000:00:02.0/0000:03:00.0/mlx5_core.sf.2
+            parent = extract_string_by_regex(self._data_source.read_link_if_exists(aux_prefix + "/" + sf),
+                                             r".*/([0-9a-f]{4}:[0-9a-f]{2}:[0-9a-f]{2}\.[0-9a-f])/" + re.escape(sf) + "$")
+            if parent == "=N/A=":
+                self._data_source.log.error("Failed to identify parent PF of SF {}".format(sf))
+                continue
+
+            sf_info = {"sf": sf,
+                       "sfnum": self._data_source.read_file_if_exists(aux_prefix + "/" + sf + "/sfnum").strip(),
+                       "controller": "",
+                       "state": "attached" if self._data_source.read_link_if_exists(aux_prefix + "/" + sf + "/driver") else "detached"}
+            sf_index.setdefault(parent, []).append(sf_info)
+            sfs_by_sfnum[(parent, sf_info["sfnum"])] = sf_info
+
+        # Controller and state are known to eswitch manager only, single devlink call covers all SFs
+        if sfs_by_sfnum and (self._config.output_view == "sf" or self._config.output_view == "all"):
+            data = self._data_source.exec_shell_cmd("devlink port show -j", use_cache=True, report_cmd_error=False)
+            try:
+                devlink_ports = json.loads("".join(data)).get("port", {})
+            except (TypeError, ValueError, AttributeError):
+                devlink_ports = {}
+            for devlink_port, attributes in devlink_ports.items():
+                if attributes.get("flavour") != "pcisf":
+                    continue
+                # i.e. pci/0000:03:00.0/229409
+                sf_info = sfs_by_sfnum.get((devlink_port.split("/")[1], str(attributes.get("sfnum"))))
+                if sf_info is None:
+                    continue
+                sf_info["controller"] = str(attributes.get("controller", ""))
+                sf_info["state"] = attributes.get("function", {}).get("opstate", sf_info["state"])
+
+        return sf_index
+
+    def sample_counters(self, bdf_devices):
+        # type: (list) -> None
+        # Counters of all ports are read in bulk, once before and once after the sampling interval
+        counters_dirs = remove_duplicates([bdf_dev.counters_dir for bdf_dev in bdf_devices if bdf_dev.counters_dir])
+        if not counters_dirs:
+            return
+
+        first_timestamp = self._data_source.exec_python_code("time.time()", "_counters__1")
+        first_sample = self._data_source.read_counters(counters_dirs, "__1")
+        self._data_source.exec_python_code("time.sleep({})".format(self._config.counters_interval))
+        second_timestamp = self._data_source.exec_python_code("time.time()", "_counters__2")
+        second_sample = self._data_source.read_counters(counters_dirs, "__2")
+
+        try:
+            elapsed = second_timestamp - first_timestamp
+        except TypeError:
+            elapsed = 0
+
+        for bdf_dev in bdf_devices:
+            if bdf_dev.counters_dir:
+                bdf_dev.set_counters(first_sample.get(bdf_dev.counters_dir), second_sample.get(bdf_dev.counters_dir),
+                                     elapsed)
+
+    def sample_ethtool_stats(self, bdf_devices):
+        # type: (list) -> None
+        # Driver statistics of all Eth interfaces are read in one pass before and once after the sampling interval,
+        # so rates of all interfaces are of the same time window
+        interfaces = remove_duplicates([bdf_dev.net for bdf_dev in bdf_devices
+                                        if bdf_dev.net and bdf_dev.link_layer != "IB"])
+        if not interfaces:
+            return
+
+        first_timestamp = self._data_source.exec_python_code("time.time()", "_ethstats__1")
+        first_sample = self._data_source.get_ethtool_stats(interfaces, "__1")
+        self._data_source.exec_python_code("time.sleep({})".format(self._config.counters_interval))
+        second_timestamp = self._data_source.exec_python_code("time.time()", "_ethstats__2")
+        second_sample = self._data_source.get_ethtool_stats(interfaces, "__2")
+
+        try:
+            elapsed = second_timestamp - first_timestamp
+        except TypeError:
+            elapsed = 0
+
+        for bdf_dev in bdf_devices:
+            if bdf_dev.net in interfaces:
+                bdf_dev.set_ethtool_stats(first_sample.get(bdf_dev.net), second_sample.get(bdf_dev.net), elapsed)
+
+    def _list_pf_sfs(self, bdf):
+        # type: (str) -> list
+        tmp = self._data_source.list_dir_if_exists("/sys/bus/pci/devices/" + bdf).rstrip().split()
+        sf_list = find_in_list(tmp, r'mlx5_core\.sf\.[0-9]+', return_only_first_group=False)
+        return sf_list or []
+
+    def output_info(self):
+        # type: () -> list
+        output = []
+        with self._data_source.profiler.phase("output_info"):
+            for hca in self.mlnxHCAs:
+                output_info = hca.output_info()
+                # counters view with --nonzero has no lines for HCA with idle ports
+                if output_info["bdf_devices"]:
+                    output.append(output_info)
+        return output
+
     def display_hcas_info(self):
         # type: () -> None
         out = Output(self._config, self._data_source)
-        for hca in self.mlnxHCAs:
-            output_info = hca.output_info()
+        for output_info in self.output_info():
             out.append(output_info)
 
         out.print_output()
 
+    @staticmethod
+    def _bdf_label(bdf, port, sf=""):
+        # type: (str, object, str) -> str
+        # profiler label of a single data collection, port 1 is omitted as most of BDFs have only one
+        label = bdf
+        if str(port) != "1":
+            label += " " + (str(port) if isinstance(port, str) else "port " + str(port))
+        if sf:
+            label += " " + sf
+        return label
+
     def _get_hca_by_sys_image_guid(self, sys_image_guid):
         # type: (str) -> MlnxHCA
         for hca in self.mlnxHCAs:
@@ -528,25 +935,30 @@ class Output(object):
             for bdf_device in hca["bdf_devices"]:
                 bdf_device.pop(key, None)
 
-    def apply_where_output_filters(self):
-        # type: () -> None
-        if not self.config.where_output_filter:
-            return
-
+    def compile_where_output_filters(self):
+        # type: () -> dict
+        # Returns {field: compiled regex}, raises ValueError if a filter is illegal
         output_filter = {}
         for filter_item in self.config.where_output_filter:
             f_list = filter_item.split("=")
             if len(f_list) != 2:
-                self.data_source.log.critical("Filter '{}' is illegal, see help for more info".format(filter_item))
-                sys.exit(1)
-            output_filter[f_list[0]] = f_list[1]
-
-        for filter_key in output_filter:
+                raise ValueError("Filter '{}' is illegal, see help for more info".format(filter_item))
             try:
-                output_filter[filter_key] = re.compile(output_filter[filter_key])
+                output_filter[f_list[0]] = re.compile(f_list[1])
             except sre_constants.error:
-                print("Error: Invalid pattern \"%s\" passed to output filter " % output_filter[filter_key])
-                sys.exit(1)
+                raise ValueError("Invalid pattern \"{}\" passed to output filter".format(f_list[1]))
+        return output_filter
+
+    def apply_where_output_filters(self):
+        # type: () -> None
+        if not self.config.where_output_filter:
+            return
+
+        try:
+            output_filter = self.compile_where_output_filters()
+        except ValueError as exception:
+            self.data_source.log.critical(str(exception))
+            sys.exit(1)
 
         for filter_key in output_filter:
             remove_hca_list = []
@@ -554,7 +966,7 @@ class Output(object):
                 remove_bdf_list = []
                 for bdf_device in hca["bdf_devices"]:
                     if filter_key in bdf_device and not re.match(output_filter[filter_key],
-                                                                 bdf_device[filter_key]):
+                                                                 str(bdf_device[filter_key])):
                         remove_bdf_list.append(bdf_device)
 
                 for bdf_device in remove_bdf_list:
@@ -590,6 +1002,9 @@ class Output(object):
             bfb_fields_to_remove["Bond"] = True
             bfb_fields_to_remove["BondState"] = True
             bfb_fields_to_remove["BondMiiStat"] = True
+            bfb_fields_to_remove["BondAggId"] = True
+            bfb_fields_to_remove["LacpPartner"] = True
+            bfb_fields_to_remove["BondLnkFail"] = True
             # ---- Remove PhyAnalisys if there are no issues
             bfb_fields_to_remove["PhyAnalisys"] = True
             # ---- Remove LLDP fields if the interface in not Eth
@@ -597,6 +1012,15 @@ class Output(object):
             bfb_fields_to_remove["LLDPsysName"] = True
             bfb_fields_to_remove["LLDPmgmtAddr"] = True
             bfb_fields_to_remove["LLDPsysDescr"] = True
+            # ---- Remove OVS port fields if they weren't read from ovsdb-server
+            bfb_fields_to_remove["OvsOfport"] = True
+            bfb_fields_to_remove["OvsAdmStat"] = True
+            # ---- Remove SF fields if there are no SFs
+            for field in ("SFnum", "SFctrl", "SFstate", "HwAddr"):
+                bfb_fields_to_remove[field] = True
+            # ---- Remove ethstats fields the driver has no statistics for
+            for field in ("PrioRxBps", "PrioTxBps", "PrioPause", "RxDiscPhy", "QDrops", "PauseStorm"):
+                bfb_fields_to_remove[field] = True
 
             for bdf_device in hca["bdf_devices"]:
                 # ---- Removing SRIOV and Parent_addr if no VFs present
@@ -634,6 +1058,14 @@ class Output(object):
                     bfb_fields_to_remove["BondState"] = False
                     bfb_fields_to_remove["BondMiiStat"] = False
 
+                # ---- Remove LACP fields if no 802.3ad bond and link failure count if there are no failures
+                if bdf_device.get("BondAggId"):
+                    bfb_fields_to_remove["BondAggId"] = False
+                if bdf_device.get("LacpPartner"):
+                    bfb_fields_to_remove["LacpPartner"] = False
+                if bdf_device.get("BondLnkFail") and bdf_device.get("BondLnkFail").strip() != "0":
+                    bfb_fields_to_remove["BondLnkFail"] = False
+
                 # ---- Remove PhyAnalisys if there are no issues
                 if bdf_device.get("PhyAnalisys") and bdf_device.get("PhyAnalisys") != "No_issue":
                     bfb_fields_to_remove["PhyAnalisys"] = False
@@ -649,6 +1081,22 @@ class Output(object):
                     bfb_fields_to_remove["LLDPmgmtAddr"] = False
                     bfb_fields_to_remove["LLDPsysDescr"] = False
 
+                # ---- Remove OVS port fields if they weren't read from ovsdb-server
+                if bdf_device.get("OvsOfport"):
+                    bfb_fields_to_remove["OvsOfport"] = False
+                if bdf_device.get("OvsAdmStat"):
+                    bfb_fields_to_remove["OvsAdmStat"] = False
+
+                # ---- Remove SF fields if there are no SFs
+                for field in ("SFnum", "SFctrl", "SFstate", "HwAddr"):
+                    if bdf_device.get(field):
+                        bfb_fields_to_remove[field] = False
+
+                # ---- Remove ethstats fields the driver has no statistics for
+                for field in ("PrioRxBps", "PrioTxBps", "PrioPause", "RxDiscPhy", "QDrops", "PauseStorm"):
+                    if bdf_device.get(field):
+                        bfb_fields_to_remove[field] = False
+
 
             for field,do_remove in bfb_fields_to_remove.items():
                 for bdf_device in hca["bdf_devices"]:
@@ -680,11 +1128,31 @@ class Output(object):
                 del hca["bdf_devices"][index]
 
 
+    def apply_baseline_diff(self):
+        # type: () -> None
+        # Replaces the output by its differences from baseline, see SnapshotDiff
+        current = self.output
+        self.output = self.data_source.read_baseline(self.config.baseline_file)
+        if self.output is None:
+            sys.exit(1)
+
+        # baseline is filtered same as the current output
+        self.apply_where_output_filters()
+        baseline = self.output
+
+        snapshot_diff = SnapshotDiff(self.output_order, self.config.diff_ignored_fields, self.config.output_format,
+                                     (self.config.warning_sign, self.config.error_sign))
+        self.output = snapshot_diff.diff(baseline, current)
+        self.output_order = SnapshotDiff.OUTPUT_ORDER
+
     def filter_out_data(self):
         # type: () -> None
         self.apply_where_output_filters()
         self.apply_select_output_filters()
-        if self.config.output_format == "human_readable" and self.config.output_format_elastic:
+        if self.config.baseline_file:
+            # elastic output removes fields, that would show as differences
+            self.apply_baseline_diff()
+        elif self.config.output_format == "human_readable" and self.config.output_format_elastic:
             self.elastic_output()
 
     def update_separator_and_column_width(self):
@@ -739,16 +1207,24 @@ class Output(object):
 
     def print_output(self):
         # type: () -> None
-        self.filter_out_data()
+        profiler = self.data_source.profiler
+        with profiler.phase("filter"):
+            self.filter_out_data()
 
         if self.config.output_format == "human_readable":
-            self.update_separator_and_column_width()
+            with profiler.phase("width"):
+                self.update_separator_and_column_width()
+            if self.separator_len == 0 and self.config.baseline_file:
+                print("No changes since baseline")
+                sys.exit(0)
             if self.separator_len == 0:
                 print("No HCAs to display")
                 sys.exit(0)
-            self.print_output_human_readable()
+            with profiler.phase("render"):
+                self.print_output_human_readable()
         elif self.config.output_format == "json":
-            self.print_output_json()
+            with profiler.phase("json"):
+                self.print_output_json()
 
     def colour_warnings_and_errors(self, field_value):
         # type: (str) -> str
@@ -834,15 +1310,426 @@ class Output(object):
             print(' | '.join(output_list))
 
 
+class FleetAggregate(object):
+    """
+    Cluster wide aggregation of lshca JSON snapshots, see --aggregate
+    Every BDF device row is merged with fields of its HCA and the "Node" field, and counted in to its group.
+    Per group and field: count of rows with the field, distinct values, min and max.
+    Distinct values are capped by max_distinct, so memory doesn't depend on number of nodes. Partial aggregates
+    of separate files are merged, that's how work is split between worker processes.
+    """
+    SUMMARY_FIELDS = ["Nodes", "Ports", "Field", "Count", "Distinct", "Min", "Max", "Values"]
+
+    def __init__(self, group_by, fields, max_distinct):
+        # type: (list, list, int) -> None
+        self.group_by = group_by
+        self.fields = [field for field in fields if field not in group_by]
+        self.max_distinct = max_distinct
+        # {group values tuple: {"nodes": int, "ports": int, "fields": {field: field stats}}}
+        self.groups = {}
+
+    def add_node(self, node, hcas):
+        # type: (str, list) -> None
+        # hcas is lshca -j output of a single node, already filtered
+        node_groups = set()
+        for hca in hcas:
+            hca_fields = dict((key, value) for key, value in hca.items() if key != "bdf_devices")
+            for bdf_device in hca.get("bdf_devices", []):
+                row = dict(hca_fields)
+                row.update(bdf_device)
+                row["Node"] = node
+                group_key = tuple(str(row.get(field, "")) for field in self.group_by)
+                group = self._get_group(group_key)
+                group["ports"] += 1
+                node_groups.add(group_key)
+                for field in self.fields:
+                    if field in row:
+                        self._add_value(group["fields"], field, str(row[field]), 1)
+
+        for group_key in node_groups:
+            self.groups[group_key]["nodes"] += 1
+
+    def merge(self, other):
+        # type: (FleetAggregate) -> None
+        for group_key, other_group in other.groups.items():
+            group = self._get_group(group_key)
+            group["nodes"] += other_group["nodes"]
+            group["ports"] += other_group["ports"]
+            for field, other_stats in other_group["fields"].items():
+                for value, count in other_stats["values"].items():
+                    self._add_value(group["fields"], field, value, count)
+                stats = group["fields"][field] if field in group["fields"] else None
+                if stats is None:
+                    # all values of the field were counted as other
+                    stats = group["fields"][field] = {"count": 0, "values": {}, "other": 0, "min": None, "max": None}
+                stats["other"] += other_stats["other"]
+                stats["count"] += other_stats["other"]
+                for bound, pick in (("min", min), ("max", max)):
+                    if other_stats[bound] is not None:
+                        stats[bound] = other_stats[bound] if stats[bound] is None else \
+                            pick(stats[bound], other_stats[bound], key=self._sort_key)
+
+    def output_info(self, output_format):
+        # type: (str) -> list
+        # Group is printed as an HCA, its fields as BDF devices. So it can be printed by Output
+        output = []
+        for group_key in sorted(self.groups):
+            group = self.groups[group_key]
+            group_output = OrderedDict(zip(self.group_by, group_key))
+            if output_format == "json":
+                group_output["Nodes"] = group["nodes"]
+                group_output["Ports"] = group["ports"]
+            else:
+                group_output["Nodes"] = str(group["nodes"])
+                group_output["Ports"] = str(group["ports"])
+            group_output["bdf_devices"] = []
+            for field in self.fields:
+                if field not in group["fields"]:
+                    continue
+                stats = group["fields"][field]
+                values = sorted(stats["values"].items(), key=lambda item: (-item[1], self._sort_key(item[0])))
+                if output_format == "json":
+                    field_output = {"Field": field,
+                                    "Count": stats["count"],
+                                    "Distinct": len(values),
+                                    "Min": stats["min"],
+                                    "Max": stats["max"],
+                                    "Values": OrderedDict(values),
+                                    "Other": stats["other"]}
+                else:
+                    values_str = " ".join("{}({})".format(value if value else '""', count) for value, count in values)
+                    if stats["other"]:
+                        values_str += " other({})".format(stats["other"])
+                    field_output = {"Field": field,
+                                    "Count": str(stats["count"]),
+                                    "Distinct": str(len(values)) + ("+" if stats["other"] else ""),
+                                    "Min": stats["min"] or "",
+                                    "Max": stats["max"] or "",
+                                    "Values": values_str}
+                group_output["bdf_devices"].append(field_output)
+            if group_output["bdf_devices"]:
+                output.append(group_output)
+        return output
+
+    def _get_group(self, group_key):
+        # type: (tuple) -> dict
+        if group_key not in self.groups:
+            self.groups[group_key] = {"nodes": 0, "ports": 0, "fields": {}}
+        return self.groups[group_key]
+
+    def _add_value(self, group_fields, field, value, count):
+        # type: (dict, str, str, int) -> None
+        if field not in group_fields:
+            group_fields[field] = {"count": 0, "values": {}, "other": 0, "min": None, "max": None}
+        stats = group_fields[field]
+        stats["count"] += count
+        if value in stats["values"] or len(stats["values"]) < self.max_distinct:
+            stats["values"][value] = stats["values"].get(value, 0) + count
+        else:
+            stats["other"] += count
+        # empty value is a field not relevant for the row, i.e. Tempr of VF
+        if value == "":
+            return
+        if stats["min"] is None or self._sort_key(value) < self._sort_key(stats["min"]):
+            stats["min"] = value
+        if stats["max"] is None or self._sort_key(value) > self._sort_key(stats["max"]):
+            stats["max"] = value
+
+    @staticmethod
+    def _sort_key(value):
+        # type: (str) -> tuple
+        # Numbers are compared as numbers and go before strings, i.e. Tempr, BondLnkFail
+        try:
+            return 0, float(value), value
+        except ValueError:
+            return 1, 0, value
+
+
+class SnapshotDiff(object):
+    """
+    Differences between two lshca -j snapshots of the same host, see --diff
+    HCAs are matched by SN, or by PCI_addr of their first BDF if SN isn't known. BDFs of matched HCAs are matched by
+    PCI_addr, Port and SFnum, nth repeat of the same key is a separate BDF (i.e. PF and its SFs without SFnum).
+    Both snapshots are indexed by these keys in dicts, so comparison is linear in size of the snapshots.
+    Output is in Output format: HCA with changes, line per changed, added or removed field. Added or removed
+    BDF/HCA is a single line.
+    Field values are compared as strings without warning/error signs, as baseline comes from JSON while current
+    output might be human readable.
+    """
+    HCA_HEADER_FIELDS = ["Dev", "Desc", "SN"]
+    BDF_KEY_FIELDS = ["PCI_addr", "Port", "SFnum"]
+    OUTPUT_ORDER = HCA_HEADER_FIELDS + ["PCI_addr", "Port", "Net", "Change", "Field", "Baseline", "Current"]
+
+    def __init__(self, fields, ignored_fields, output_format, signs=()):
+        # type: (list, list, str, tuple) -> None
+        self.fields = [field for field in fields if field not in ignored_fields]
+        self.output_format = output_format
+        self.signs = [sign for sign in signs if sign]
+
+    def diff(self, baseline, current):
+        # type: (list, list) -> list
+        baseline_index = self._index(baseline, self._hca_key)
+        output = []
+        for hca_key, hca in self._index(current, self._hca_key).items():
+            if hca_key in baseline_index:
+                lines = self._diff_hca(baseline_index.pop(hca_key), hca)
+            else:
+                lines = [self._line(bdf_device, "added") for bdf_device in hca.get("bdf_devices", [])] or \
+                        [self._line({}, "added")]
+            if lines:
+                output.append(self._header(hca, lines))
+
+        for hca in baseline_index.values():
+            lines = [self._line(bdf_device, "removed") for bdf_device in hca.get("bdf_devices", [])] or \
+                    [self._line({}, "removed")]
+            output.append(self._header(hca, lines))
+        return output
+
+    def _diff_hca(self, baseline_hca, hca):
+        # type: (dict, dict) -> list
+        lines = self._diff_fields({}, baseline_hca, hca)
+
+        baseline_index = self._index(baseline_hca.get("bdf_devices", []), self._bdf_key)
+        for bdf_key, bdf_device in self._index(hca.get("bdf_devices", []), self._bdf_key).items():
+            if bdf_key in baseline_index:
+                lines.extend(self._diff_fields(bdf_device, baseline_index.pop(bdf_key), bdf_device))
+            else:
+                lines.append(self._line(bdf_device, "added"))
+        for bdf_device in baseline_index.values():
+            lines.append(self._line(bdf_device, "removed"))
+        return lines
+
+    def _diff_fields(self, bdf_device, baseline_data, current_data):
+        # type: (dict, dict, dict) -> list
+        lines = []
+        for field in self.fields:
+            if field in self.BDF_KEY_FIELDS or field == "bdf_devices":
+                continue
+            if field in baseline_data and field in current_data:
+                if self._normalize(baseline_data[field]) != self._normalize(current_data[field]):
+                    lines.append(self._line(bdf_device, "changed", field, baseline_data[field], current_data[field]))
+            elif field in current_data:
+                lines.append(self._line(bdf_device, "added", field, "", current_data[field]))
+            elif field in baseline_data:
+                lines.append(self._line(bdf_device, "removed", field, baseline_data[field], ""))
+        return lines
+
+    def _line(self, bdf_device, change, field="", baseline_value="", current_value=""):
+        # type: (dict, str, str, object, object) -> dict
+        line = {"PCI_addr": bdf_device.get("PCI_addr", ""),
+                "Port": bdf_device.get("Port", ""),
+                "Net": bdf_device.get("Net", ""),
+                "Change": change,
+                "Field": field,
+                "Baseline": baseline_value,
+                "Current": current_value}
+        if self.output_format != "json":
+            for key in line:
+                line[key] = str(line[key])
+        return line
+
+    def _header(self, hca, lines):
+        # type: (dict, list) -> dict
+        header = OrderedDict()
+        for field in self.HCA_HEADER_FIELDS:
+            if field in hca:
+                header[field] = hca[field] if self.output_format == "json" else str(hca[field])
+        header["bdf_devices"] = lines
+        return header
+
+    def _normalize(self, value):
+        # type: (object) -> str
+        value = str(value)
+        stripped = True
+        while stripped:
+            stripped = False
+            for sign in self.signs:
+                if value.endswith(sign):
+                    value = value[:-len(sign)]
+                    stripped = True
+        return value
+
+    @staticmethod
+    def _index(items, key_function):
+        # type: (list, object) -> OrderedDict
+        # Repeating keys get nth repeat number, so every item is indexed
+        index = OrderedDict()
+        repeats = {}
+        for item in items:
+            key = key_function(item)
+            repeats[key] = repeats.get(key, 0) + 1
+            index[key + (repeats[key],)] = item
+        return index
+
+    @staticmethod
+    def _hca_key(hca):
+        # type: (dict) -> tuple
+        if hca.get("SN"):
+            return "SN", hca["SN"]
+        bdf_devices = hca.get("bdf_devices") or [{}]
+        return "PCI_addr", bdf_devices[0].get("PCI_addr", "")
+
+    @classmethod
+    def _bdf_key(cls, bdf_device):
+        # type: (dict) -> tuple
+        return tuple(str(bdf_device.get(field, "")) for field in cls.BDF_KEY_FIELDS)
+
+
+class LshcaDaemon(object):
+    """
+    Resident lshca, serving collected output info over unix socket, see --daemon
+    Single DataSource is kept for the daemon lifetime, so every data source is refreshed by its cache class TTL
+    (see Config.cache_ttl) and the rest is served from cache. Output info of every queried view is collected again
+    in background, while the view is queried, so queries don't wait for collection.
+    Protocol: client sends single JSON line {"view": view, "show_warnings": bool}, daemon answers with
+    {"hcas": output info, "output_order": fields} or {"error": message} and closes the connection. Output info is
+    the one HCAManager displays, output_order is the view fields with the ones added during collection
+    (i.e. SMGuid, MST_device). Selection, filtering and rendering are done by the client. See query_daemon
+    """
+    # Views sampling counters over --interval, client settings affect their collection
+    NOT_SERVED_VIEWS = ("counters", "ethstats")
+
+    def __init__(self, config, data_source):
+        # type: (Config, DataSource) -> None
+        self._config = config
+        self._data_source = data_source
+        self._refresh_interval = config.cache_ttl["volatile"]
+        # (view, show_warnings) -> (collection time, output info, output order)
+        self._results = {}
+        # (view, show_warnings) -> last query time
+        self._queried = {}
+        # HCAManager runs one at a time, DataSource and its cache are shared
+        self._collect_lock = threading.Lock()
+
+    def serve_forever(self):
+        # type: () -> None
+        socket_path = self._config.daemon_socket
+        if os.path.exists(socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+                self._data_source.log.critical("lshca daemon already listens on {}".format(socket_path))
+                sys.exit(1)
+            except socket.error:
+                # left by daemon that didn't exit cleanly
+                os.unlink(socket_path)
+            finally:
+                probe.close()
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        os.chmod(socket_path, 0o660)
+        server.listen(16)
+
+        # system view is collected right away, it's the default one
+        self._queried[("system", True)] = time.time()
+        refresher = threading.Thread(target=self._refresh_loop)
+        refresher.daemon = True
+        refresher.start()
+
+        try:
+            while True:
+                connection, _ = server.accept()
+                handler = threading.Thread(target=self._handle_connection, args=(connection,))
+                handler.daemon = True
+                handler.start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+    def get_output_info(self, view, show_warnings):
+        # type: (str, bool) -> tuple
+        # Returns (output info, output order)
+        key = (view, show_warnings)
+        self._queried[key] = time.time()
+        result = self._results.get(key)
+        # refresher keeps queried views younger than that, unless this is the first query
+        if result is None or time.time() - result[0] > 2 * self._refresh_interval:
+            result = self._collect(key, 2 * self._refresh_interval)
+        return result[1], result[2]
+
+    def _handle_connection(self, connection):
+        # type: (socket.socket) -> None
+        try:
+            connection.settimeout(self._config.daemon_timeout)
+            request = b""
+            while not request.endswith(b"\n"):
+                data = connection.recv(4096)
+                if not data:
+                    break
+                request += data
+            request = json.loads(request.decode("utf-8"))
+            view = request.get("view")
+            if view in self.NOT_SERVED_VIEWS or (view != "all" and view not in self._config.output_order_general):
+                response = {"error": "View '{}' isn't served by lshca daemon".format(view)}
+            else:
+                hcas, output_order = self.get_output_info(view, bool(request.get("show_warnings")))
+                response = {"hcas": hcas, "output_order": output_order}
+        except (socket.error, ValueError, AttributeError) as exception:
+            response = {"error": "Bad request: {}".format(exception)}
+        except Exception as exception:
+            # Failed collection fails the query, not the daemon
+            self._data_source.log.error("Collection failed: {}".format(exception))
+            response = {"error": "Collection failed: {}".format(exception)}
+
+        try:
+            connection.sendall(json.dumps(response).encode("utf-8"))
+        except socket.error:
+            pass
+        finally:
+            connection.close()
+
+    def _collect(self, key, max_age):
+        # type: (tuple, float) -> tuple
+        view, show_warnings = key
+        with self._collect_lock:
+            # same view might be collected by another thread while this one waited for the lock
+            result = self._results.get(key)
+            if result is not None and time.time() - result[0] <= max_age:
+                return result
+
+            config = copy.copy(self._config)
+            config.output_view = view
+            config.set_output_order()
+            config.output_format = "human_readable" if show_warnings else "json"
+            config.show_warnings_and_errors = show_warnings
+            self._data_source.cache.expire()
+
+            hca_manager = HCAManager(self._data_source, config)
+            hca_manager.get_data()
+            result = (time.time(), hca_manager.output_info(), config.output_order)
+            self._results[key] = result
+        return result
+
+    def _refresh_loop(self):
+        # type: () -> None
+        while True:
+            for key, queried in list(self._queried.items()):
+                if time.time() - queried > self._config.daemon_view_idle_time:
+                    del self._queried[key]
+                    self._results.pop(key, None)
+                    continue
+                try:
+                    self._collect(key, 0)
+                except Exception as exception:
+                    self._data_source.log.error("Collection of {} view failed: {}".format(key[0], exception))
+            time.sleep(self._refresh_interval)
+
+
 class MSTDevice(object):
     mst_tool_missing = False
     mst_service_initialized = False
     mst_service_should_be_stopped = False
 
-    def __init__(self, data_source, config):
-        # type: (DataSource, Config) -> None
+    def __init__(self, data_source, config, run_index=None):
+        # type: (DataSource, Config, dict) -> None
+        # "mst status -v" is parsed once per run, run_index is shared by all devices of the run. See index_mst_status
         self._config = config
         self._data_source = data_source
+        self._run_index = run_index if run_index is not None else {}
         self._mst_raw_data = None
 
         self.mst_device = ""
@@ -863,13 +1750,21 @@ class MSTDevice(object):
         if MSTDevice.mst_service_initialized or MSTDevice.mst_tool_missing:
             return
 
+        # MFT tools are addressed by PCI BDF, mst service isn't needed
+        if self._config.mft_by_bdf:
+            MSTDevice.mst_service_initialized = True
+            return
+
         result = self._data_source.exec_shell_cmd("which mst &> /dev/null ; echo $?", use_cache=True)
         if result == ["0"]:
             mst_installed = True
         else:
             mst_installed = False
 
-        if mst_installed:
+        if mst_installed and self._config.fs_root:
+            # Tree under --fs-root is only read, mst service of the running host is left as is
+            pass
+        elif mst_installed:
             result = self._data_source.exec_shell_cmd("mst status | grep -c 'MST PCI configuration module loaded'", use_cache=True)
             if int(result[0]) == 0:
                 self._data_source.exec_shell_cmd("mst start", use_cache=True)
@@ -882,25 +1777,49 @@ class MSTDevice(object):
 
         MSTDevice.mst_service_initialized = True
 
-    def get_data(self, bdf):
-        # type: (str) -> None
+    def get_data(self, bdf, physical_function=True):
+        # type: (str, bool) -> None
         if not MSTDevice.mst_service_initialized:
             return
 
+        # Same as mst, which lists physical functions only
+        if self._config.mft_by_bdf:
+            if physical_function:
+                self.mst_device = bdf
+                self.mst_cable = bdf
+            return
+
         mst_device_suffix = "None"
         self._mst_raw_data = self._data_source.exec_shell_cmd("mst status -v", use_cache=True)
         bdf_short = extract_string_by_regex(bdf, "0000:(.+)")
         if bdf_short == "=N/A=":
             bdf_short = bdf
 
-        for line in self._mst_raw_data:
-            data_line = extract_string_by_regex(line, "(.*" + bdf_short + ".*)")
+        if "mst_status" not in self._run_index:
+            self._run_index["mst_status"] = self.index_mst_status(self._mst_raw_data)
+        lines_by_bdf, cables = self._run_index["mst_status"]
+
+        data_line = lines_by_bdf.get(bdf_short)
+        if data_line is not None:
+            self.mst_device = extract_string_by_regex(data_line, r".* (/dev/mst/[^\s]+) .*")
+            mst_device_suffix = extract_string_by_regex(data_line, r"/dev/mst/([^\s]+)")
 
-            if data_line != "=N/A=":
-                self.mst_device = extract_string_by_regex(data_line, r".* (/dev/mst/[^\s]+) .*")
-                mst_device_suffix = extract_string_by_regex(data_line, r"/dev/mst/([^\s]+)")
+        self.mst_cable = find_in_list(cables, r"({}_cable_[^\s]+)".format(mst_device_suffix)).strip()
 
-        self.mst_cable = find_in_list(self._mst_raw_data, r"({}_cable_[^\s]+)".format(mst_device_suffix)).strip()
+    @staticmethod
+    def index_mst_status(mst_raw_data):
+        # type: (list) -> tuple
+        # Returns ({BDF: last line mentioning it}, [cable names])
+        # BDFs of 0000 domain are indexed by short form as well, it's what mst prints
+        lines_by_bdf = {}
+        cables = []
+        for line in mst_raw_data:
+            for bdf in re.findall(r"(?<![0-9a-fA-F:])((?:[0-9a-fA-F]{4}:)?[0-9a-fA-F]{2}:[0-9a-fA-F]{2}\.[0-9a-fA-F])", line):
+                lines_by_bdf[bdf] = line
+                if bdf.startswith("0000:"):
+                    lines_by_bdf[bdf[5:]] = line
+            cables.extend([word for word in line.split() if "_cable_" in word])
+        return lines_by_bdf, cables
 
 
 class PCIDevice(object):
@@ -994,11 +1913,14 @@ class PCIDevice(object):
 
 
 class SYSFSDevice(object):
-    def __init__(self, bdf, data_source, config, port=1, sf=""):
-        # type: (str, DataSource, Config, int, str) -> None
+    def __init__(self, bdf, data_source, config, port=1, sf="", run_index=None):
+        # type: (str, DataSource, Config, int, str, dict) -> None
+        # Netdevs of every PCI function (or SF) sysfs directory are indexed once per run, run_index is shared by all
+        # devices of the run. See index_net_devices
         self._bdf = bdf
         self._config = config
         self._data_source = data_source
+        self._run_index = run_index if run_index is not None else {}
         self._port = str(port)
 
         self._sys_prefix = "/sys/bus/pci/devices/" + self._bdf
@@ -1010,6 +1932,61 @@ class SYSFSDevice(object):
 
         self.driver = "Undefined"
 
+    def index_net_devices(self):
+        # type: () -> dict
+        # Returns {port: {"net": [netdevs], "uplnk_repr": [...], "pf_repr": [...], "vf_repr": [...]}}
+        # Eswitch representors are identified by phys_port_name (pfN, pfNvfM, pfNsfM). mlx5 PCI function has single
+        # port, so dev_id and dev_port of representors aren't read.
+        # Other netdevs (no phys_port_name or uplink) get the port from dev_id/dev_port, representors are recognised by name
+        index = {}
+        net_list = self._data_source.list_dir_if_exists(self._sys_prefix + "/net/")
+        for net in net_list.split(" "):
+            if not net:
+                continue
+            net_prefix = self._sys_prefix + "/net/" + net
+            # Reading phys_port_name of non representor netdev fails with EOPNOTSUPP
+            phys_port_name = self._data_source.read_file_if_exists(net_prefix + "/phys_port_name",
+                                                                   report_read_error=False).strip()
+            phys_port_name = re.sub(r"^c\d+", "", phys_port_name) # controller prefix of external host representors
+
+            if re.match(r"^pf\d+(vf|sf)?\d*$", phys_port_name):
+                net_port = 1
+            else:
+                # the below code tries to identify which of the files has valid port number dev_id or dev_port
+                # in mlx4 dev_port has the valid value, in mlx5 - dev_id
+                # this solution mimics one in ibdev2netdev
+
+                # Multiple network interfaces can be in mlx4 devices or in DPUs (representors)
+                net_port_dev_id = self._data_source.read_file_if_exists(net_prefix + "/dev_id")
+                try:
+                    net_port_dev_id = int(net_port_dev_id, 16)
+                except ValueError:
+                    net_port_dev_id = 0
+
+                net_port_dev_port = self._data_source.read_file_if_exists(net_prefix + "/dev_port")
+                try:
+                    net_port_dev_port = int(net_port_dev_port)
+                except ValueError:
+                    net_port_dev_port = 0
+
+                if net_port_dev_id > net_port_dev_port:
+                    net_port = net_port_dev_id
+                else:
+                    net_port = net_port_dev_port
+
+                net_port += 1
+
+            if re.match(r"^p\d+$", net):
+                kind = "uplnk_repr"
+            elif re.match(r"^pf\d+$", phys_port_name) or re.match(r"^pf\d+hpf$", net):
+                kind = "pf_repr"
+            elif re.match(r"^pf\d+vf\d+$", phys_port_name) or re.match(r"^pf\d+vf\d+$", net):
+                kind = "vf_repr"
+            else:
+                kind = "net"
+            index.setdefault(str(net_port), {}).setdefault(kind, []).append(net)
+        return index
+
     def __repr__(self):
         # type: () -> str
         delim = " "
@@ -1062,75 +2039,62 @@ class SYSFSDevice(object):
         if not self.numa and not self.is_sf and self._config.in_use_by_vm_str not in self.rdma:
             print("Warning: " + self._bdf + " has no NUMA assignment", file=sys.stderr)
 
-        net_list = self._data_source.list_dir_if_exists(self._sys_prefix + "/net/")
-        self.net = ""
-        self.uplnk_repr = ""
-        self.pf_repr = ""
-        self.vf_repr = ""
-        matched_net_list = []
-        for net in net_list.split(" "):
-            # the below code tries to identify which of the files has valid port number dev_id or dev_port
-            # in mlx4 dev_port has the valid value, in mlx5 - dev_id
-            # this solution mimics one in ibdev2netdev
-
-            # Multiple network interfaces can be in mlx4 devices or in DPUs (representors)
-            net_port_dev_id = self._data_source.read_file_if_exists(self._sys_prefix + "/net/" + net + "/dev_id")
-            try:
-                net_port_dev_id = int(net_port_dev_id, 16)
-            except ValueError:
-                net_port_dev_id = 0
-
-            net_port_dev_port = self._data_source.read_file_if_exists(self._sys_prefix + "/net/" + net + "/dev_port")
-            try:
-                net_port_dev_port = int(net_port_dev_port)
-            except ValueError:
-                net_port_dev_port = 0
-
-            if net_port_dev_id > net_port_dev_port:
-                net_port = net_port_dev_id
-            else:
-                net_port = net_port_dev_port
-
-            net_port += 1
-
-            if str(net_port) == self._port:
-                if re.match(r"^p\d+$", net):
-                    self.uplnk_repr = net
-                elif re.match(r"^pf\d+hpf$", net):
-                    self.pf_repr = net
-                elif re.match(r"^pf\d+vf\d+$", net):
-                    self.vf_repr = net
-                else:
-                    matched_net_list.append(net)
-
-        self.net = " ".join(matched_net_list)
+        net_index = self._run_index.setdefault("net", {})
+        if self._sys_prefix not in net_index:
+            net_index[self._sys_prefix] = self.index_net_devices()
+        port_net_devices = net_index[self._sys_prefix].get(self._port, {})
+
+        # Single representor of each kind per port is shown
+        self.uplnk_repr = (port_net_devices.get("uplnk_repr") or [""])[-1]
+        self.pf_repr = (port_net_devices.get("pf_repr") or [""])[-1]
+        self.vf_repr = (port_net_devices.get("vf_repr") or [""])[-1]
+        self.net = " ".join(port_net_devices.get("net", []))
+
+        # RDMA netlink has port attributes of all devices, read once. Port missing in it is read from sysfs
+        rdma_netlink_data = self._data_source.get_rdma_netlink_data("nldev", use_cache=True) or {}
+        nl_device = rdma_netlink_data.get("devices", {}).get(self.rdma)
+        nl_port = rdma_netlink_data.get("ports", {}).get(self.rdma + "/" + self._port) if nl_device else None
+        if nl_port and not self.net and nl_port["netdev"]:
+            # sysfs is filtered by network namespace, netlink reports netdevs of the current one
+            self.net = nl_port["netdev"]
 
         self.hca_type = self._data_source.read_file_if_exists(self._sys_prefix + "/infiniband/" + self.rdma + "/hca_type").rstrip()
 
-        self.lnk_state = self._data_source.read_file_if_exists(self._sys_prefix + "/infiniband/" + self.rdma + "/ports/" +
-                                                         self._port + "/state")
-        self.lnk_state = extract_string_by_regex(self.lnk_state, "[0-9:]+ (.*)", "").lower()
+        if nl_port and "state" in nl_port:
+            self.lnk_state = nl_port["state"].lower()
+        else:
+            self.lnk_state = self._data_source.read_file_if_exists(self._sys_prefix + "/infiniband/" + self.rdma + "/ports/" +
+                                                             self._port + "/state")
+            self.lnk_state = extract_string_by_regex(self.lnk_state, "[0-9:]+ (.*)", "").lower()
         if self.lnk_state == "active":
             self.lnk_state = "actv"
 
         if self.lnk_state == "down":
-            self.phys_state = self._data_source.read_file_if_exists(self._sys_prefix + "/infiniband/" + self.rdma +
-                                                          "/ports/" + self._port + "/phys_state")
-            self.phys_state = extract_string_by_regex(self.phys_state, "[0-9:]+ (.*)", "").lower()
-
+            if nl_port and "phys_state" in nl_port:
+                self.phys_state = nl_port["phys_state"].lower()
+            else:
+                self.phys_state = self._data_source.read_file_if_exists(self._sys_prefix + "/infiniband/" + self.rdma +
+                                                              "/ports/" + self._port + "/phys_state")
+                self.phys_state = extract_string_by_regex(self.phys_state, "[0-9:]+ (.*)", "").lower()
             if self.phys_state == "polling":
                 self.lnk_state = "poll"
 
 
-        self.link_layer = self._data_source.read_file_if_exists(self._sys_prefix + "/infiniband/" + self.rdma +
-                                                          "/ports/" + self._port + "/link_layer")
+        if nl_port and nl_port["link_layer"]:
+            self.link_layer = nl_port["link_layer"]
+        else:
+            self.link_layer = self._data_source.read_file_if_exists(self._sys_prefix + "/infiniband/" + self.rdma +
+                                                              "/ports/" + self._port + "/link_layer")
         self.link_layer = self.link_layer.rstrip()
         if self.link_layer == "InfiniBand":
             self.link_layer = "IB"
         elif self.link_layer == "Ethernet":
             self.link_layer = "Eth"
 
-        self.fw = self._data_source.read_file_if_exists(self._sys_prefix + "/infiniband/" + self.rdma + "/fw_ver")
+        if nl_device and nl_device["fw_ver"]:
+            self.fw = nl_device["fw_ver"]
+        else:
+            self.fw = self._data_source.read_file_if_exists(self._sys_prefix + "/infiniband/" + self.rdma + "/fw_ver")
         self.fw = self.fw.rstrip()
 
         self.psid = self._data_source.read_file_if_exists(self._sys_prefix + "/infiniband/" + self.rdma + "/board_id")
@@ -1142,23 +2106,32 @@ class SYSFSDevice(object):
         if self.lnk_state == "down" and self._config.show_warnings_and_errors is True:
             self.port_rate = self.port_rate + self._config.warning_sign
 
-        self.port_list = self._data_source.list_dir_if_exists(self._sys_prefix + "/infiniband/" + self.rdma + "/ports/").rstrip()
-        self.port_list = self.port_list.split(" ")
+        if nl_device and nl_device["port_count"]:
+            self.port_list = [str(port) for port in range(1, nl_device["port_count"] + 1)]
+        else:
+            self.port_list = self._data_source.list_dir_if_exists(self._sys_prefix + "/infiniband/" + self.rdma + "/ports/").rstrip()
+            self.port_list = self.port_list.split(" ")
 
-        self.plid = self._data_source.read_file_if_exists(self._sys_prefix + "/infiniband/" + self.rdma +
-                                                    "/ports/" + self._port + "/lid")
-        try:
-            self.plid = int(self.plid, 16)
-        except ValueError:
-            self.plid = ""
+        if nl_port:
+            self.plid = nl_port["lid"]
+        else:
+            self.plid = self._data_source.read_file_if_exists(self._sys_prefix + "/infiniband/" + self.rdma +
+                                                        "/ports/" + self._port + "/lid")
+            try:
+                self.plid = int(self.plid, 16)
+            except ValueError:
+                self.plid = ""
         self.plid = str(self.plid)
 
-        self.smlid = self._data_source.read_file_if_exists(self._sys_prefix + "/infiniband/" + self.rdma +
-                                                     "/ports/" + self._port + "/sm_lid")
-        try:
-            self.smlid = int(self.smlid, 16)
-        except ValueError:
-            self.smlid = ""
+        if nl_port:
+            self.smlid = nl_port["sm_lid"]
+        else:
+            self.smlid = self._data_source.read_file_if_exists(self._sys_prefix + "/infiniband/" + self.rdma +
+                                                         "/ports/" + self._port + "/sm_lid")
+            try:
+                self.smlid = int(self.smlid, 16)
+            except ValueError:
+                self.smlid = ""
         self.smlid = str(self.smlid)
 
         full_guid = self._data_source.read_file_if_exists(self._sys_prefix + "/infiniband/" + self.rdma +
@@ -1182,8 +2155,11 @@ class SYSFSDevice(object):
         else:
             self.virt_hca = ""
 
-        self.sys_image_guid = self._data_source.read_file_if_exists(self._sys_prefix + "/infiniband/" + self.rdma +
-                                                              "/sys_image_guid").rstrip()
+        if nl_device and nl_device["sys_image_guid"]:
+            self.sys_image_guid = nl_device["sys_image_guid"]
+        else:
+            self.sys_image_guid = self._data_source.read_file_if_exists(self._sys_prefix + "/infiniband/" + self.rdma +
+                                                                  "/sys_image_guid").rstrip()
 
         self.bond_mii_status = self._data_source.read_file_if_exists(self._sys_prefix + "/net/" + self.net +
                                                               "/bonding_slave/mii_status").rstrip()
@@ -1228,7 +2204,7 @@ class SYSFSDevice(object):
         self.tcp_ecn = None
         self.rdma_cm_tos = None
 
-        if self._config.output_view == "roce" or self._config.output_view == "all":
+        if self._config.output_view in ("roce", "ethstats", "all"):
             self.gtclass = self._data_source.read_file_if_exists(self._sys_prefix + "/infiniband/" + self.rdma +
                                                            "/tc/1/traffic_class").rstrip()
             self.tcp_ecn = self._data_source.read_file_if_exists("/proc/sys/net/ipv4/tcp_ecn").rstrip()
@@ -1237,13 +2213,13 @@ class SYSFSDevice(object):
             roce_tos_path_prefix_cleanup = False
             try:
                 if self._data_source.list_dir_if_exists(roce_tos_path_prefix) == "":
-                    os.mkdir(roce_tos_path_prefix)
+                    os.mkdir(self._data_source.fs_path(roce_tos_path_prefix))
                     roce_tos_path_prefix_cleanup = True
                     self._data_source.list_dir_if_exists(roce_tos_path_prefix) # here to record dir if recording enabled
                 self.rdma_cm_tos = self._data_source.read_file_if_exists(roce_tos_path_prefix +
                                                                    "/ports/1/default_roce_tos").rstrip()
                 if roce_tos_path_prefix_cleanup:
-                    os.rmdir(roce_tos_path_prefix)
+                    os.rmdir(self._data_source.fs_path(roce_tos_path_prefix))
             except OSError:
                 self.rdma_cm_tos = "Failed to retrieve"
 
@@ -1251,14 +2227,14 @@ class SYSFSDevice(object):
         self.traff_rx_bitps = "N/A"
         self.packet_seq_err_per_sec = "N/A"
 
-        # Read the SF config only once
-        if self._port == "1":
-            tmp = self._data_source.list_dir_if_exists(self._sys_prefix ).rstrip().split()
-            self.sf_list = find_in_list(tmp, r'mlx5_core\.sf\.[0-9]+', return_only_first_group=False)
-            if not self.sf_list:
-                self.sf_list = []
-        else:
-            self.sf_list = []
+        # Port counters and hw_counters are read from here by HCAManager.sample_counters
+        self.counters_dir = ""
+        if self.rdma and self._config.in_use_by_vm_str not in self.rdma:
+            self.counters_dir = self._sys_prefix + "/infiniband/" + self.rdma + "/ports/" + self._port
+
+        self.hw_addr = ""
+        if self.is_sf and self.net:
+            self.hw_addr = self._data_source.read_file_if_exists(self._sys_prefix + "/net/" + self.net + "/address").strip()
 
     def get_traffic(self):
         # type: () -> None
@@ -1326,45 +2302,56 @@ class SYSFSDevice(object):
 
 
 class SaSmpQueryDevice(object):
-    def __init__(self,  data_source, config):
-        # type: (DataSource, Config) -> None
+    """
+    SA/SMP queries of single IB port, natively over umad, or by smpquery/saquery when it's not possible
+    Queries are (attribute, target) tuples of UmadClient
+    """
+    def __init__(self, data_source, config, rdma, port):
+        # type: (DataSource, Config, str, str) -> None
         self._data_source = data_source
         self._config = config
-
-        self.sw_guid = ""
-        self.sw_description = ""
-        self.sm_guid = ""
-
-    def get_data(self, rdma, port, smlid, lnk_state, virt_hca):
-        # type: (str, str, str, str, str) -> None
-        self._port = port
         self._rdma = rdma
-        self._smlid = smlid
-
-        if "SMGuid" not in self._config.output_order:
-            self._config.output_order.append("SMGuid")
-        if "SwGuid" not in self._config.output_order:
-            self._config.output_order.append("SwGuid")
-        if "SwDescription" not in self._config.output_order:
-            self._config.output_order.append("SwDescription")
-
-        self.sw_guid = ''
-        if virt_hca == "Phys":
-            self.data = self._data_source.exec_shell_cmd("smpquery -C " + self._rdma + " -P " + self._port + " NI -D  0,1")
-            self.sw_guid = self.get_info_from_sa_smp_query_data(".*SystemGuid.*", "\.+(.*)")
-            self.sw_guid = extract_string_by_regex(self.sw_guid, "0x(.*)")
-
-        self.sw_description = ''
-        if virt_hca == "Phys":
-            self.data = self._data_source.exec_shell_cmd("smpquery -C " + self._rdma + " -P " + self._port + " ND -D  0,1")
-            self.sw_description = self.get_info_from_sa_smp_query_data(".*Node *Description.*", "\.+(.*)")
-
-        # Get SM lid
-        self.sm_guid = ''
-        if lnk_state != "init":
-            self.data = self._data_source.exec_shell_cmd("saquery SMIR -C " + self._rdma + " -P " + self._port + " " + self._smlid)
-            self.sm_guid = self.get_info_from_sa_smp_query_data(".*GUID.*", "\.+(.*)")
-            self.sm_guid = extract_string_by_regex(self.sm_guid, "0x(.*)")
+        self._port = port
+        self.data = []
+
+    def query(self, queries):
+        # type: (list) -> dict
+        # Returns {query: {field: value}}, fields of failed query are "=N/A=", same as of failed smpquery/saquery
+        # None if MADs can't be sent natively, smpquery and saquery are used instead
+        mad_data = self._data_source.exec_mad_queries(self._rdma, self._port, queries)
+
+        results = {}
+        for query in queries:
+            attribute, target = query
+            if attribute == "NodeInfo":
+                if mad_data is not None:
+                    results[query] = {"system_guid": self.get_info_from_mad_data(mad_data, query, "system_guid"),
+                                      "node_guid": self.get_info_from_mad_data(mad_data, query, "node_guid")}
+                else:
+                    self.data = self._data_source.exec_shell_cmd("smpquery -C " + self._rdma + " -P " + self._port + " NI -D  " + target)
+                    results[query] = {"system_guid": self.get_guid_from_sa_smp_query_data(".*SystemGuid.*"),
+                                      "node_guid": self.get_guid_from_sa_smp_query_data(".*Node *Guid.*")}
+            elif attribute == "NodeDescription":
+                if mad_data is not None:
+                    results[query] = {"description": self.get_info_from_mad_data(mad_data, query, "description")}
+                else:
+                    self.data = self._data_source.exec_shell_cmd("smpquery -C " + self._rdma + " -P " + self._port + " ND -D  " + target)
+                    results[query] = {"description": self.get_info_from_sa_smp_query_data(".*Node *Description.*", "\\.+(.*)")}
+            elif attribute == "SMInfoRecord":
+                if mad_data is not None:
+                    results[query] = {"guid": self.get_info_from_mad_data(mad_data, query, "guid")}
+                else:
+                    self.data = self._data_source.exec_shell_cmd("saquery SMIR -C " + self._rdma + " -P " + self._port + " " + target)
+                    results[query] = {"guid": self.get_guid_from_sa_smp_query_data(".*GUID.*")}
+        return results
+
+    @staticmethod
+    def get_info_from_mad_data(mad_data, query, field):
+        # type: (dict, tuple, str) -> str
+        response = mad_data.get(query)
+        if response is None:
+            return "=N/A="
+        return str(response[field]).strip()
 
     def get_info_from_sa_smp_query_data(self, search_regex, output_regex):
         # type: (re.Pattern, re.Pattern) -> str
@@ -1372,20 +2359,152 @@ class SaSmpQueryDevice(object):
         search_result = extract_string_by_regex(search_result, output_regex)
         return str(search_result).strip()
 
-
-class MlxCable(object):
-    def __init__(self, data_source):
-        # type: (DataSource) -> None
+    def get_guid_from_sa_smp_query_data(self, search_regex):
+        # type: (re.Pattern) -> str
+        guid = self.get_info_from_sa_smp_query_data(search_regex, "\\.+(.*)")
+        return extract_string_by_regex(guid, "0x(.*)")
+
+
+class SaSmpQueryManager(object):
+    """
+    SA/SMP queries of all IB ports of the host
+    Ports of the same subnet share SM and ports cabled to the same switch share the neighbor, thus:
+        SMInfoRecord    - queried once per (subnet prefix, SM LID)
+        NodeInfo        - queried per port, it identifies the neighbor
+        NodeDescription - queried once per neighbor node GUID
+    Queries of different ports run concurrently, up to Config.sa_smp_query_workers ports at a time,
+    port has single batch of queries in flight.
+    """
+    def __init__(self, data_source, config):
+        # type: (DataSource, Config) -> None
         self._data_source = data_source
+        self._config = config
 
-        self.cable_length = ""
-        self.cable_pn = ""
-        self.cable_sn = ""
+    def get_data(self, bdf_devices):
+        # type: (list[MlnxBDFDevice]) -> None
+        ib_devices = [bdf_dev for bdf_dev in bdf_devices if bdf_dev.sa_smp_query_required()]
+        if not ib_devices:
+            return
 
-    def get_data(self, mst_cable):
-        # type: (str) -> None
+        for field in ("SMGuid", "SwGuid", "SwDescription"):
+            if field not in self._config.output_order:
+                self._config.output_order.append(field)
+
+        # ---- First round: neighbor NodeInfo of every physical port and SMInfoRecord of every SM
+        ports = [] # type: list[tuple]
+        port_queries = {}
+        sm_queries = {}
+        for bdf_dev in ib_devices:
+            port_key = (bdf_dev.rdma, bdf_dev.port)
+            if port_key not in port_queries:
+                ports.append(port_key)
+                port_queries[port_key] = []
+            if bdf_dev.virt_hca == "Phys" and ("NodeInfo", "0,1") not in port_queries[port_key]:
+                port_queries[port_key].append(("NodeInfo", "0,1"))
+            sm_key = (bdf_dev.ib_net_prefix, bdf_dev.smlid)
+            if bdf_dev.lnk_state != "init" and sm_key not in sm_queries:
+                sm_queries[sm_key] = (port_key, ("SMInfoRecord", bdf_dev.smlid))
+                port_queries[port_key].append(("SMInfoRecord", bdf_dev.smlid))
+        first_results = self._run_queries(ports, port_queries)
+
+        # ---- Second round: NodeDescription of every distinct neighbor
+        neighbor_queries = {}
+        port_queries = dict((port_key, []) for port_key in ports)
+        for port_key in ports:
+            node_info = first_results[port_key].get(("NodeInfo", "0,1"))
+            if node_info is None:
+                continue
+            # Neighbor that didn't answer NodeInfo is queried per port, same as before batching
+            neighbor_key = node_info["node_guid"] if node_info["node_guid"] != "=N/A=" else port_key
+            if neighbor_key not in neighbor_queries:
+                neighbor_queries[neighbor_key] = port_key
+                port_queries[port_key].append(("NodeDescription", "0,1"))
+        second_results = self._run_queries(ports, port_queries)
+
+        # ---- Fan out
+        for bdf_dev in ib_devices:
+            port_key = (bdf_dev.rdma, bdf_dev.port)
+            node_info = first_results[port_key].get(("NodeInfo", "0,1"))
+            if node_info is not None:
+                bdf_dev.sw_guid = node_info["system_guid"]
+                neighbor_key = node_info["node_guid"] if node_info["node_guid"] != "=N/A=" else port_key
+                description_port_key = neighbor_queries[neighbor_key]
+                bdf_dev.sw_description = second_results[description_port_key].get(
+                    ("NodeDescription", "0,1"), {"description": "=N/A="})["description"]
+
+            sm_key = (bdf_dev.ib_net_prefix, bdf_dev.smlid)
+            if bdf_dev.lnk_state != "init":
+                sm_port_key, sm_query = sm_queries[sm_key]
+                bdf_dev.sm_guid = first_results[sm_port_key].get(sm_query, {"guid": "=N/A="})["guid"]
+
+    def _run_queries(self, ports, port_queries):
+        # type: (list, dict) -> dict
+        # Returns {port: {query: response}}
+        results = dict((port_key, {}) for port_key in ports)
+        jobs = [port_key for port_key in ports if port_queries.get(port_key)]
+
+        # Recorded and replayed runs are serial, so logged errors keep their order
+        workers = self._config.sa_smp_query_workers
+        if self._config.record_data_for_debug:
+            workers = 1
+
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    if not jobs:
+                        return
+                    port_key = jobs.pop(0)
+                rdma, port = port_key
+                try:
+                    with self._data_source.profiler.span("port", "{} port {} sa_smp".format(rdma, port), rdma=rdma):
+                        result = SaSmpQueryDevice(self._data_source, self._config, rdma, port).query(port_queries[port_key])
+                except Exception as exception:
+                    self._data_source.log.error("SA/SMP queries of {} port {} failed. {}".format(rdma, port, exception))
+                    result = {}
+                with lock:
+                    results[port_key] = result
+
+        if workers <= 1 or len(jobs) <= 1:
+            worker()
+        else:
+            threads = [threading.Thread(target=worker, name="sa_smp_{}".format(i)) for i in range(min(workers, len(jobs)))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        return results
+
+
+class MlxCable(object):
+    def __init__(self, data_source):
+        # type: (DataSource) -> None
+        self._data_source = data_source
+
+        self.cable_length = ""
+        self.cable_pn = ""
+        self.cable_sn = ""
+
+    def get_data(self, mst_cable, port=1):
+        # type: (str, int) -> None
         if mst_cable == "":
             return
+
+        # Module info is read by the same mlxlink call as MlxLink does
+        if is_bdf(mst_cable):
+            data = self._data_source.exec_shell_cmd("mlxlink -d {} -p {} -m --json".format(mst_cable, port), use_cache=True)
+            try:
+                module_info = json.loads("".join(data)).get("result", {}).get("output", {}).get("Module Info", {})
+            except (TypeError, ValueError, AttributeError):
+                return
+            cable_length = module_info.get("Cable Length [m]", module_info.get("Transfer Distance [m]", ""))
+            self.cable_length = str(cable_length).replace(" ", "") + "m" if cable_length not in ("", "N/A") else ""
+            self.cable_pn = str(module_info.get("Vendor Part Number", "")).replace(" ", "")
+            self.cable_sn = str(module_info.get("Vendor Serial Number", "")).replace(" ", "")
+            return
+
         data = self._data_source.exec_shell_cmd("mlxcables -d " + mst_cable, use_cache=True)
         self.cable_length = search_in_list_and_extract_by_regex(data, r'Length .*:.*', r'Length .*:(.*)').replace(" ", "")
         self.cable_pn = search_in_list_and_extract_by_regex(data, r'Part number +:.*', r'Part number +:(.*)').replace(" ", "")
@@ -1405,7 +2524,11 @@ class MlxLink(object):
         # type: (str, int) -> None
         if mst_device == "":
             return
-        data = self._data_source.exec_shell_cmd("mlxlink -d {} -p {} --json".format(mst_device, port), use_cache=True)
+        if is_bdf(mst_device):
+            # Module info is parsed by MlxCable
+            data = self._data_source.exec_shell_cmd("mlxlink -d {} -p {} -m --json".format(mst_device, port), use_cache=True)
+        else:
+            data = self._data_source.exec_shell_cmd("mlxlink -d {} -p {} --json".format(mst_device, port), use_cache=True)
         try:
             json_data = json.loads("".join(data))
         except (TypeError, ValueError):
@@ -1442,9 +2565,7 @@ class MlxConfig(object):
         if mst_device == "":
             return
 
-        # all of MST devices on single HCA point to the same configuration source
-        # this will reduce execution time
-        normalised_mst_device = re.sub(r'(.*)\.[0-9]', r'\1', mst_device)
+        normalised_mst_device = normalise_mft_device(mst_device)
 
         data = self._data_source.exec_shell_cmd("mlxconfig -d {} q".format(normalised_mst_device), use_cache=True)
         self.internal_cpu_model = search_in_list_and_extract_by_regex(data, r'.*INTERNAL_CPU_MODEL.*', r'.*\((.*)\)')
@@ -1466,9 +2587,7 @@ class MlxPrivHost(object):
         if mst_device == "":
             return
 
-        # all of MST devices on single HCA point to the same configuration source
-        # this will reduce execution time
-        normalised_mst_device = re.sub(r'(.*)\.[0-9]', r'\1', mst_device)
+        normalised_mst_device = normalise_mft_device(mst_device)
 
         data = self._data_source.exec_shell_cmd("mlxprivhost -d {} q".format(normalised_mst_device), use_cache=True)
         tmp = search_in_list_and_extract_by_regex(data, r'^level +: [A-Z]+', r'.*: ([A-Z]+)')
@@ -1476,17 +2595,28 @@ class MlxPrivHost(object):
 
 
 class OvsVsctl(object):
-    def __init__(self, data_source):
-        # type: (DataSource) -> None
+    def __init__(self, data_source, config):
+        # type: (DataSource, Config) -> None
         self._data_source = data_source
+        self._config = config
 
         self.ovs_bridge = ""
+        self.ovs_ofport = ""
+        self.ovs_admin_state = ""
         self.uplnk_repr = ""
         self.pf_repr = ""
         self.vf_repr = ""
 
     def get_data(self, net):
         # type: (str) -> None
+        ports_index = self._data_source.get_ovsdb_ports(self._config.ovsdb_socket, use_cache=True)
+        if ports_index is not None:
+            port = ports_index.get(net, {})
+            self.ovs_bridge = port.get("bridge", "")
+            self.ovs_ofport = port.get("ofport", "")
+            self.ovs_admin_state = port.get("admin_state", "")
+            return
+
         data = {}
         ovsvctl_list_br = self._data_source.exec_shell_cmd("ovs-vsctl list-br", use_cache=True)
         for bridge in ovsvctl_list_br:
@@ -1500,6 +2630,9 @@ class OvsVsctl(object):
 
 
 class MiscCMDs(object):
+    # ofed_info is a script with the version hard coded in its "-s" branch, at the top of the script
+    OFED_INFO_HEADER_LINES = 5
+
     def __init__(self, data_source, config):
         # type: (DataSource, Config) -> None
         self.data_source = data_source
@@ -1507,6 +2640,14 @@ class MiscCMDs(object):
 
     def get_mlnx_qos_trust(self, net):
         # type: (str) -> str
+        # OFED driver exposes trust state in sysfs, inbox one by DSCP entries in DCB APP table
+        trust = self.data_source.read_file_if_exists("/sys/class/net/" + net + "/qos/trust", use_cache=True).strip()
+        if trust:
+            return trust
+        dcb_data = self.data_source.get_dcb_data([net])[net]
+        if dcb_data is not None:
+            return dcb_data["trust"]
+
         data = self.data_source.exec_shell_cmd("mlnx_qos -i " + net, use_cache=True)
         regex = "Priority trust state: (.*)"
         search_result = find_in_list(data, regex)
@@ -1515,29 +2656,76 @@ class MiscCMDs(object):
 
     def get_mlnx_qos_pfc(self, net):
         # type: (str) -> str
+        dcb_data = self.data_source.get_dcb_data([net])[net]
+        if dcb_data is not None and "pfc" in dcb_data:
+            return dcb_data["pfc"]
+
         data = self.data_source.exec_shell_cmd("mlnx_qos -i " + net, use_cache=True)
         regex = '^\s+enabled\s+(([0-9]\s+)+)'
         search_result = find_in_list(data, regex)
         search_result = extract_string_by_regex(search_result, regex).replace(" ", "")
         return search_result
 
-    def get_tempr(self, rdma):
-        # type: (str) -> str
-        data = self.data_source.exec_shell_cmd("mget_temp -d " + rdma, use_cache=True)
-        regex = '^([0-9]+)\s+$'
-        search_result = find_in_list(data, regex)
-        search_result = extract_string_by_regex(search_result, regex).replace(" ", "")
-        try:
-            if int(search_result) > 90:
-                return search_result + self.config.error_sign
-            elif int(search_result) > 80:
-                return search_result + self.config.warning_sign
-            return search_result
-        except ValueError:
-            return "=N/A="
+    def get_tempr(self, rdma, bdf):
+        # type: (str, str) -> str
+        tempr, thresholds = self.get_tempr_from_hwmon(bdf)
+        if tempr is None:
+            data = self.data_source.exec_shell_cmd("mget_temp -d " + rdma, use_cache=True)
+            regex = '^([0-9]+)\s+$'
+            search_result = find_in_list(data, regex)
+            search_result = extract_string_by_regex(search_result, regex).replace(" ", "")
+            try:
+                tempr = int(search_result)
+            except ValueError:
+                return "=N/A="
+
+        error_threshold = thresholds.get("crit", self.config.tempr_error_threshold)
+        warning_threshold = thresholds.get("max", self.config.tempr_warning_threshold)
+        if tempr > error_threshold:
+            return str(tempr) + self.config.error_sign
+        elif tempr > warning_threshold or tempr < thresholds.get("min", tempr):
+            return str(tempr) + self.config.warning_sign
+        return str(tempr)
+
+    def get_tempr_from_hwmon(self, bdf):
+        # type: (str) -> tuple
+        # mlx5 hwmon sensors (kernel 6.5+), channel 1 is the ASIC. Values are in millidegrees Celsius
+        # Returns temperature and {threshold name: temperature}, temperature is None if there is no hwmon sensor
+        hwmon_prefix = "/sys/bus/pci/devices/" + bdf + "/hwmon/"
+        for hwmon in self.data_source.list_dir_if_exists(hwmon_prefix).split():
+            tempr = self.data_source.read_file_if_exists(hwmon_prefix + hwmon + "/temp1_input").strip()
+            if not tempr.lstrip("-").isdigit():
+                continue
+
+            thresholds = {}
+            for threshold in ("min", "max", "crit"):
+                value = self.data_source.read_file_if_exists(hwmon_prefix + hwmon + "/temp1_" + threshold).strip()
+                # thresholds that firmware doesn't report are 0
+                if value.lstrip("-").isdigit() and int(value) != 0:
+                    thresholds[threshold] = int(value) // 1000
+            return int(tempr) // 1000, thresholds
+        return None, {}
 
     def get_driver_ver(self):
         # type: () -> str
+        # Reading the version from ofed_info header doesn't need to run it
+        ofed_info = self.data_source.read_file_if_exists("/usr/bin/ofed_info", use_cache=True,
+                                                         max_lines=self.OFED_INFO_HEADER_LINES)
+        mofed_ver = extract_string_by_regex(ofed_info, 'MLNX_OFED_LINUX-([^:\s"\']+):')
+        if mofed_ver != "=N/A=":
+            return "mlnx_ofed-" + mofed_ver
+
+        mofed_ver = extract_string_by_regex(ofed_info, 'OFED-internal-([^:\s"\']+):')
+        if mofed_ver != "=N/A=":
+            return "ofed_internal-" + mofed_ver
+
+        if not ofed_info:
+            # Loaded module reports in sysfs the same version modinfo does. Inbox drivers of kernel 5.x+ have no version,
+            # they're left to modinfo and srcversion below, so Driver value doesn't change
+            module_ver = self.data_source.read_file_if_exists("/sys/module/mlx5_core/version", use_cache=True).strip()
+            if module_ver:
+                return "inbox-" + module_ver
+
         mofed_ver_raw = str(self.data_source.exec_shell_cmd("ofed_info -s ", use_cache=True, report_cmd_error=False))
         regex = '.*MLNX_OFED_LINUX-(.*):.*'
         mofed_ver = extract_string_by_regex(mofed_ver_raw, regex)
@@ -1555,6 +2743,11 @@ class MiscCMDs(object):
         search_result = extract_string_by_regex(search_result, regex)
         if search_result != self.config.na_str_extnd:
             return "inbox-" + str(search_result)
+
+        # Inbox driver of kernel 5.x+ has no version at all, loaded module is identified by its source checksum
+        src_ver = self.data_source.read_file_if_exists("/sys/module/mlx5_core/srcversion", use_cache=True).strip()
+        if src_ver:
+            return "inbox-" + src_ver
         else:
             err_msg = 'Driver identification CMDs failed to run, probably the driver is missing\n'
             err_msg += '\tCMDs: "ofed_info -s" and "modinfo mlx5_core"'
@@ -1570,24 +2763,31 @@ class MiscCMDs(object):
 
 
 class MlnxBDFDevice(object):
-    def __init__(self, bdf, data_source, config, port=1, sf=""):
-        # type: (str, DataSource, Config, int, str) -> None
+    def __init__(self, bdf, data_source, config, port=1, sf="", pf_device=None, sf_info=None, run_index=None):
+        # type: (str, DataSource, Config, int, str, MlnxBDFDevice, dict, dict) -> None
+        # SF shares PCI data of its PF (pf_device), sf_info comes from HCAManager.index_sfs
+        # run_index is owned by HCAManager, host wide data indexed once per run goes there
         self.bdf = bdf
         self._config = config
         self._data_source = data_source
+        self._sf_info = sf_info or {}
 
-        self._sysFSDevice = SYSFSDevice(self.bdf, self._data_source, self._config, port, sf)
-        self._pciDevice = PCIDevice(self.bdf, self._data_source, self._config)
-        self._mstDevice = MSTDevice(self._data_source, self._config)
+        self._sysFSDevice = SYSFSDevice(self.bdf, self._data_source, self._config, port, sf, run_index)
+        if pf_device is not None:
+            self._pciDevice = pf_device._pciDevice
+            self._pci_data_inherited = True
+        else:
+            self._pciDevice = PCIDevice(self.bdf, self._data_source, self._config)
+            self._pci_data_inherited = False
+        self._mstDevice = MSTDevice(self._data_source, self._config, run_index)
         self._mlxLink = MlxLink(self._data_source)
         self._mlxCable = MlxCable(self._data_source)
         self._mlxConfig = MlxConfig(self._data_source)
         self._mlxPrivHost = MlxPrivHost(self._data_source)
-        self._ovsVsctl = OvsVsctl(self._data_source)
+        self._ovsVsctl = OvsVsctl(self._data_source, self._config)
         self._miscDevice = MiscCMDs(self._data_source, self._config)
-        self._sasmpQueryDevice = SaSmpQueryDevice(self._data_source, self._config)
         self._lldpData = LldpData(self._data_source, self._config)
-        self._Rshim = RshimDevice(self.bdf, self._data_source, self._config)
+        self._Rshim = RshimDevice(self.bdf, self._data_source, self._config, run_index)
 
     def get_data(self):
         # type: () -> None
@@ -1616,18 +2816,36 @@ class MlnxBDFDevice(object):
         self.bond_master = self._sysFSDevice.bond_master
         self.bond_state = self._sysFSDevice.bond_state
         self.bond_mii_status = self._sysFSDevice.bond_mii_status
+        self.bond_aggregator_id = ""
+        self.bond_link_failures = ""
+        self.lacp_partner = ""
         if self._config.output_view == "traffic" or self._config.output_view == "all":
             self._sysFSDevice.get_traffic()
         self.traff_tx_bitps = self._sysFSDevice.traff_tx_bitps
         self.traff_rx_bitps = self._sysFSDevice.traff_rx_bitps
         self.packet_seq_err_per_sec = self._sysFSDevice.packet_seq_err_per_sec
-        self.sf_list = self._sysFSDevice.sf_list
+        self.counters_dir = self._sysFSDevice.counters_dir
+        self.counters = []
+        self.eth_rx_bitps = ""
+        self.eth_tx_bitps = ""
+        self.eth_prio_rx_bitps = ""
+        self.eth_prio_tx_bitps = ""
+        self.eth_prio_pause = ""
+        self.eth_rx_discards_phy = ""
+        self.eth_queue_drops = ""
+        self.eth_pause_storm = ""
+        self.sfnum = self._sf_info.get("sfnum", "")
+        self.sf_controller = self._sf_info.get("controller", "")
+        self.sf_state = self._sf_info.get("state", "")
+        # Read only for SFs of auxiliary bus index, recordings before it have no such data
+        self.hw_addr = self._sysFSDevice.hw_addr if self._sf_info else ""
         self.pf_repr = self._sysFSDevice.pf_repr
         self.vf_repr = self._sysFSDevice.vf_repr
         self.uplnk_repr = self._sysFSDevice.uplnk_repr
 
         # ------ PCI ------
-        self._pciDevice.get_data()
+        if not self._pci_data_inherited:
+            self._pciDevice.get_data()
         self._inside_dpu = self._pciDevice._inside_dpu
         self.description = self._pciDevice.description
         self.lnkCapWidth = self._pciDevice.lnkCapWidth
@@ -1646,7 +2864,7 @@ class MlnxBDFDevice(object):
           self._config.output_view == "dpu" or \
           self._config.output_view == "all":
             self._mstDevice.init_mst_service()
-            self._mstDevice.get_data(self.bdf)
+            self._mstDevice.get_data(self.bdf, self.sriov != "VF")
             if self._config.output_view != "dpu" and "MST_device" not in self._config.output_order:
                 self._config.output_order.append("MST_device")
         self.mst_device = self._mstDevice.mst_device
@@ -1654,14 +2872,14 @@ class MlnxBDFDevice(object):
 
         # ------ MLX link ------
         if self._config.output_view == "cable" or self._config.output_view == "all":
-            self._mlxLink.get_data(self.mst_device)
+            self._mlxLink.get_data(self.mst_device, self.port)
         self.physical_link_speed = self._mlxLink.physical_link_speed
         self.physical_link_status = self._mlxLink.physical_link_status
         self.physical_link_recommendation = self._mlxLink.physical_link_recommendation
 
         # ------ MLX Cable ------
         if self._config.output_view == "cable" or self._config.output_view == "all":
-            self._mlxCable.get_data(self.mst_cable)
+            self._mlxCable.get_data(self.mst_cable, self.port)
         self.cable_length = self._mlxCable.cable_length
         self.cable_pn = self._mlxCable.cable_pn
         self.cable_sn = self._mlxCable.cable_sn
@@ -1684,11 +2902,10 @@ class MlnxBDFDevice(object):
         # tempr, driver_ver and bfb_ver are HCA level information. Queried by hca.get_data()
 
         # ------ SA/SMP query ------
-        if (self._config.output_view == "ib" or self._config.output_view == "all") and self.link_layer == "IB" and self.lnk_state != "down":
-            self._sasmpQueryDevice.get_data(self.rdma, self.port, self.smlid, self.lnk_state, self.virt_hca)
-        self.sw_guid = self._sasmpQueryDevice.sw_guid
-        self.sw_description = self._sasmpQueryDevice.sw_description
-        self.sm_guid = self._sasmpQueryDevice.sm_guid
+        # Queried for all BDFs at once by SaSmpQueryManager, see sa_smp_query_required
+        self.sw_guid = ""
+        self.sw_description = ""
+        self.sm_guid = ""
 
         # ------ Traffic ------
         if self._config.output_view == "traffic" or self._config.output_view == "all":
@@ -1704,6 +2921,8 @@ class MlnxBDFDevice(object):
           (self._config.output_view == "dpu" or self._config.output_view == "all"):
             self._ovsVsctl.get_data(self.net)
         self.ovs_bridge = self._ovsVsctl.ovs_bridge
+        self.ovs_ofport = self._ovsVsctl.ovs_ofport
+        self.ovs_admin_state = self._ovsVsctl.ovs_admin_state
 
         # ------ LLDP ------
         if ( self._config.output_view == "lldp" or self._config.output_view == "all" ) and \
@@ -1729,6 +2948,130 @@ class MlnxBDFDevice(object):
             self._Rshim.get_data()
         self.rshim_dev = self._Rshim.rshim_dev
 
+    def set_counters(self, first_sample, second_sample, elapsed):
+        # type: (dict, dict, float) -> None
+        # Samples are {counter set: {counter: value}}, see DataSource.read_counters
+        # self.counters is list of (counter set, counter, total, delta, per second)
+        self.counters = []
+        if not first_sample or not second_sample:
+            return
+
+        for counter_set in ("counters", "hw_counters"):
+            first_values = first_sample.get(counter_set, {})
+            second_values = second_sample.get(counter_set, {})
+            for counter in sorted(second_values):
+                if counter not in first_values:
+                    continue
+                # not handling counter rollover, this is too reare case
+                delta = second_values[counter] - first_values[counter]
+                per_sec = float(delta) / elapsed if elapsed > 0 else 0.0
+                self.counters.append((counter_set, counter, second_values[counter], delta, per_sec))
+
+    def set_ethtool_stats(self, first_sample, second_sample, elapsed):
+        # type: (dict, dict, float) -> None
+        # Samples are {statistic: value}, see DataSource.get_ethtool_stats
+        if not first_sample or not second_sample or elapsed <= 0:
+            return
+
+        first_sample = aggregate_queue_stats(first_sample)
+        second_sample = aggregate_queue_stats(second_sample)
+        # not handling counter rollover, same as counters view
+        rates = {}
+        for stat in second_sample:
+            if stat in first_sample:
+                rates[stat] = (second_sample[stat] - first_sample[stat]) / elapsed
+
+        for direction in ("rx", "tx"):
+            for stat in (direction + "_bytes_phy", direction + "_bytes", direction + "_queues_bytes"):
+                if stat in rates:
+                    setattr(self, "eth_" + direction + "_bitps", humanize_number(rates[stat] * 8))
+                    break
+
+        prio_rx_bitps = []
+        prio_tx_bitps = []
+        prio_pause = []
+        for prio in range(8):
+            prefix = "_prio" + str(prio) + "_"
+            if rates.get("rx" + prefix + "bytes"):
+                prio_rx_bitps.append("{}:{}".format(prio, humanize_number(rates["rx" + prefix + "bytes"] * 8)))
+            if rates.get("tx" + prefix + "bytes"):
+                prio_tx_bitps.append("{}:{}".format(prio, humanize_number(rates["tx" + prefix + "bytes"] * 8)))
+            if rates.get("rx" + prefix + "pause") or rates.get("tx" + prefix + "pause"):
+                prio_pause.append("{}:{}/{}".format(prio, humanize_number(rates.get("rx" + prefix + "pause", 0)),
+                                                    humanize_number(rates.get("tx" + prefix + "pause", 0))))
+        self.eth_prio_rx_bitps = " ".join(prio_rx_bitps)
+        self.eth_prio_tx_bitps = " ".join(prio_tx_bitps)
+        self.eth_prio_pause = " ".join(prio_pause)
+        if prio_pause and self._config.show_warnings_and_errors is True:
+            self.eth_prio_pause += self._config.warning_sign
+
+        if "rx_discards_phy" in rates:
+            self.eth_rx_discards_phy = humanize_number(rates["rx_discards_phy"])
+            if rates["rx_discards_phy"] and self._config.show_warnings_and_errors is True:
+                self.eth_rx_discards_phy += self._config.warning_sign
+
+        queue_drop_stats = [stat for stat in rates if re.match(r"^[rt]x_queues_.*(drop|discard)", stat)]
+        if queue_drop_stats:
+            queue_drops = sum(rates[stat] for stat in queue_drop_stats)
+            self.eth_queue_drops = humanize_number(queue_drops)
+            if queue_drops and self._config.show_warnings_and_errors is True:
+                self.eth_queue_drops += self._config.warning_sign
+
+        if "tx_pause_storm_error_events" in rates:
+            self.eth_pause_storm = str(second_sample["tx_pause_storm_error_events"])
+            if rates["tx_pause_storm_error_events"] and self._config.show_warnings_and_errors is True:
+                self.eth_pause_storm += self._config.error_sign
+
+    def counters_output_info(self):
+        # type: () -> list
+        # counters view has a line per counter
+        output = []
+        # i.e. RDMA bond slave, counters belong to the bond
+        if not self.rdma:
+            return output
+
+        for counter_set, counter, total, delta, per_sec in self.counters:
+            if self._config.counters_nonzero and delta == 0:
+                continue
+            if self._config.output_format == "json":
+                total, delta, per_sec = total, delta, round(per_sec, 2)
+            else:
+                total, delta, per_sec = str(total), str(delta), humanize_number(per_sec)
+            output.append({"PCI_addr": self.bdf,
+                           "RDMA": self.rdma,
+                           "Port": self.port,
+                           "Net": self.net,
+                           "CntrSet": counter_set,
+                           "Counter": counter,
+                           "Total": total,
+                           "Delta": delta,
+                           "PerSec": per_sec})
+        return output
+
+    def set_bond_slave_data(self, bond_data):
+        # type: (ProcNetBonding) -> None
+        slave = bond_data.slaves.get(self.net)
+        if slave is None:
+            return
+
+        self.bond_link_failures = slave["link_failure_count"]
+        if self.bond_link_failures not in ("", "0") and self._config.show_warnings_and_errors is True:
+            self.bond_link_failures = self.bond_link_failures + self._config.warning_sign
+
+        self.bond_aggregator_id = slave["aggregator_id"]
+        if self.bond_aggregator_id and bond_data.aggregator_id and self.bond_aggregator_id != bond_data.aggregator_id \
+                and self._config.show_warnings_and_errors is True:
+            self.bond_aggregator_id = self.bond_aggregator_id + self._config.error_sign
+
+        self.lacp_partner = slave["partner_mac"]
+        if self.lacp_partner == ProcNetBonding.NO_PARTNER_MAC and self._config.show_warnings_and_errors is True:
+            self.lacp_partner = self.lacp_partner + self._config.error_sign
+
+    def sa_smp_query_required(self):
+        # type: () -> bool
+        return (self._config.output_view == "ib" or self._config.output_view == "all") and self.link_layer == "IB" and \
+            self.lnk_state != "down"
+
     def _is_dpu(self):
         # type: () -> bool
         # This function decides on well known Mellanox PCI ids taken from the https://pci-ids.ucw.cz/read/PC/15b3
@@ -1757,7 +3100,7 @@ class MlnxBDFDevice(object):
     def roce_status(self):
         # type: () -> str
         if self.link_layer == "IB" or self._config.in_use_by_vm_str in self.rdma or \
-          not ( self._config.output_view == "roce" or self._config.output_view == "all"):
+          self._config.output_view not in ("roce", "ethstats", "all"):
             return "N/A"
 
         lossy_status_bitmap_str = ""
@@ -1850,6 +3193,10 @@ class MlnxBDFDevice(object):
         else:
             sriov = "  " + self.sriov
         output = {"SRIOV": sriov,
+                  "SFnum": self.sfnum,
+                  "SFctrl": self.sf_controller,
+                  "SFstate": self.sf_state,
+                  "HwAddr": self.hw_addr,
                   "Numa": self.numa,
                   "PCI_addr": self.bdf,
                   "Parent_addr": self.vfParent,
@@ -1875,6 +3222,9 @@ class MlnxBDFDevice(object):
                   "Bond": self.bond_master,
                   "BondState": self.bond_state,
                   "BondMiiStat": self.bond_mii_status,
+                  "BondAggId": self.bond_aggregator_id,
+                  "BondLnkFail": self.bond_link_failures,
+                  "LacpPartner": self.lacp_partner,
                   "PhyLinkStat": self.physical_link_status ,
                   "PhyLnkSpd": self.physical_link_speed,
                   "CblPN": self.cable_pn,
@@ -1884,11 +3234,21 @@ class MlnxBDFDevice(object):
                   "TX_bps": self.traff_tx_bitps,
                   "RX_bps": self.traff_rx_bitps,
                   "PktSeqErr": self.packet_seq_err_per_sec,
+                  "RxBps": self.eth_rx_bitps,
+                  "TxBps": self.eth_tx_bitps,
+                  "PrioRxBps": self.eth_prio_rx_bitps,
+                  "PrioTxBps": self.eth_prio_tx_bitps,
+                  "PrioPause": self.eth_prio_pause,
+                  "RxDiscPhy": self.eth_rx_discards_phy,
+                  "QDrops": self.eth_queue_drops,
+                  "PauseStorm": self.eth_pause_storm,
                   "LLDPportId": self.llpd_port_id,
                   "LLDPsysName": self.llpd_system_name,
                   "LLDPsysDescr": self.llpd_system_description,
                   "LLDPmgmtAddr": self.llpd_mgmt_addr,
                   "OvsBrdg" : self.ovs_bridge,
+                  "OvsOfport" : self.ovs_ofport,
+                  "OvsAdmStat" : self.ovs_admin_state,
                   "PfRepr" : self.pf_repr,
                   "VfRepr" : self.vf_repr,
                   "UplnkRepr" : self.uplnk_repr
@@ -1932,7 +3292,7 @@ class MlnxHCA(object):
         self.fw = bdf_dev.fw
         self.psid = bdf_dev.psid
         self.description = bdf_dev.description
-        self.tempr = bdf_dev._miscDevice.get_tempr(bdf_dev.rdma)
+        self.tempr = bdf_dev._miscDevice.get_tempr(bdf_dev.rdma, bdf_dev.bdf)
         self.driver_ver = bdf_dev._miscDevice.get_driver_ver()
         self.bfb_ver = bdf_dev._miscDevice.get_bfb_version(bdf_dev._inside_dpu)
         self.dpu_mode = bdf_dev.dpu_mode
@@ -1979,7 +3339,10 @@ class MlnxHCA(object):
                   "RshimDev": self.rshim_dev,
                   "bdf_devices": []}
         for bdf_dev in self.bdf_devices:
-            output["bdf_devices"].append(bdf_dev.output_info())
+            if self.config.output_view == "counters":
+                output["bdf_devices"].extend(bdf_dev.counters_output_info())
+            else:
+                output["bdf_devices"].append(bdf_dev.output_info())
         return output
 
     def check_for_issues(self):
@@ -2000,10 +3363,15 @@ class MlnxHCA(object):
 
 
 class MlnxRdmaBondDevice(MlnxBDFDevice):
+    def __init__(self, slave_bdf_dev, bond_data):
+        # type: (MlnxBDFDevice, ProcNetBonding) -> None
+        # RDMA bond shares HCA, PCI and RDMA data with its first slave, so it starts as a copy of the
+        # already collected slave. Bond own data comes from bond_data, see get_data
+        self.__dict__.update(slave_bdf_dev.__dict__)
+        self._bond_data = bond_data
+
     def get_data(self):
         # type: () -> None
-        #Using python2 super notation for cross version compatability
-        super(MlnxRdmaBondDevice, self).get_data()
         self._fix_rdma_bond()
 
     def _fix_rdma_bond(self):
@@ -2012,6 +3380,11 @@ class MlnxRdmaBondDevice(MlnxBDFDevice):
         self.net = self.bond_master
         self.bond_master = ""
         self.bond_mii_status = ""
+        self.bond_link_failures = ""
+        self.bond_aggregator_id = self._bond_data.aggregator_id
+        self.lacp_partner = self._bond_data.partner_mac
+        if self.lacp_partner == ProcNetBonding.NO_PARTNER_MAC and self._config.show_warnings_and_errors is True:
+            self.lacp_partner = self.lacp_partner + self._config.error_sign
         self.ip_state = None
         self.mst_device = ""
         self.cable_length = ""
@@ -2024,6 +3397,15 @@ class MlnxRdmaBondDevice(MlnxBDFDevice):
         self.llpd_system_name =  ""
         self.llpd_system_description = ""
         self.llpd_mgmt_addr  = ""
+        # statistics are of the slave copied above, bonding driver has none of its own
+        self.eth_rx_bitps = ""
+        self.eth_tx_bitps = ""
+        self.eth_prio_rx_bitps = ""
+        self.eth_prio_tx_bitps = ""
+        self.eth_prio_pause = ""
+        self.eth_rx_discards_phy = ""
+        self.eth_queue_drops = ""
+        self.eth_pause_storm = ""
 
         sys_prefix = "/sys/devices/virtual/net/" + self.net
 
@@ -2052,10 +3434,15 @@ class MlnxRdmaBondDevice(MlnxBDFDevice):
         if self.ip_state == "up_noip" and self._config.show_warnings_and_errors is True:
             self.ip_state = self.ip_state + self._config.warning_sign
 
-        mode = self._data_source.read_file_if_exists(sys_prefix + "/bonding/mode").rstrip()
-        mode = mode.split(" ")[0]
-        xmit_hash_policy = self._data_source.read_file_if_exists(sys_prefix + "/bonding/xmit_hash_policy").rstrip()
-        xmit_hash_policy = xmit_hash_policy.split(" ")[0]
+        if self._bond_data.mode:
+            mode = self._bond_data.mode
+            xmit_hash_policy = self._bond_data.xmit_hash_policy
+        else:
+            # /proc/net/bonding wasn't read, i.e. recorded by older version
+            mode = self._data_source.read_file_if_exists(sys_prefix + "/bonding/mode").rstrip()
+            mode = mode.split(" ")[0]
+            xmit_hash_policy = self._data_source.read_file_if_exists(sys_prefix + "/bonding/xmit_hash_policy").rstrip()
+            xmit_hash_policy = xmit_hash_policy.split(" ")[0]
         xmit_hash_policy = xmit_hash_policy.replace("layer","l")
         xmit_hash_policy = xmit_hash_policy.replace("encap","e")
 
@@ -2064,11 +3451,17 @@ class MlnxRdmaBondDevice(MlnxBDFDevice):
             self.bond_state = self.bond_state + "/" + xmit_hash_policy
 
         # Slaves speed check
-        slaves = self._data_source.read_file_if_exists(sys_prefix + "/bonding/slaves").rstrip().split(" ")
+        if self._bond_data.slaves:
+            slaves = list(self._bond_data.slaves.keys())
+        else:
+            slaves = self._data_source.read_file_if_exists(sys_prefix + "/bonding/slaves").rstrip().split(" ")
         bond_speed = ""
         bond_speed_missmatch = False
         for slave in slaves:
-            slave_speed = self._data_source.read_file_if_exists(sys_prefix + "/slave_" + slave + "/speed").rstrip()
+            if self._bond_data.slaves:
+                slave_speed = self._bond_data.slaves[slave]["speed"]
+            else:
+                slave_speed = self._data_source.read_file_if_exists(sys_prefix + "/slave_" + slave + "/speed").rstrip()
             if slave_speed:
                 slave_speed = str(int(int(slave_speed)/1000))
             if self.port_rate != slave_speed:
@@ -2086,11 +3479,105 @@ class MlnxRdmaBondDevice(MlnxBDFDevice):
                 self.port_rate  = self.port_rate + self._config.error_sign
 
 
+class ProcNetBonding(object):
+    # Bonding mode names as /proc/net/bonding prints them, mapped to the short names of bonding/mode sysfs file
+    BONDING_MODES = {"load balancing (round-robin)": "balance-rr",
+                     "fault-tolerance (active-backup)": "active-backup",
+                     "load balancing (xor)": "balance-xor",
+                     "fault-tolerance (broadcast)": "broadcast",
+                     "IEEE 802.3ad Dynamic link aggregation": "802.3ad",
+                     "transmit load balancing": "balance-tlb",
+                     "adaptive load balancing": "balance-alb"}
+    # Partner system MAC of a slave that received no LACPDU
+    NO_PARTNER_MAC = "00:00:00:00:00:00"
+
+    def __init__(self, data_source, config):
+        # type: (DataSource, Config) -> None
+        self._data_source = data_source
+        self._config = config
+
+        self.mode = ""
+        self.xmit_hash_policy = ""
+        self.mii_status = ""
+        self.aggregator_id = ""
+        self.partner_mac = ""
+        self.slaves = OrderedDict()
+
+    def get_data(self, bond):
+        # type: (str) -> None
+        data = self._data_source.read_file_if_exists("/proc/net/bonding/" + bond)
+        self.parse(data.splitlines())
+
+    def parse(self, lines):
+        # type: (list) -> None
+        # Example:
+        #   Bonding Mode: IEEE 802.3ad Dynamic link aggregation
+        #   Transmit Hash Policy: layer3+4 (1)
+        #   MII Status: up
+        #   ...
+        #   Active Aggregator Info:
+        #           Aggregator ID: 1
+        #           Partner Mac Address: 1c:34:da:00:00:01
+        #
+        #   Slave Interface: ens1f0
+        #   MII Status: up
+        #   Speed: 200000 Mbps
+        #   Link Failure Count: 0
+        #   Aggregator ID: 1
+        #   details partner lacp pdu:
+        #       system mac address: 1c:34:da:00:00:01
+        section = "bond"
+        slave = None
+        for line in lines:
+            if ":" not in line:
+                continue
+            key, value = [item.strip() for item in line.split(":", 1)]
+
+            if key == "Slave Interface":
+                slave = {"mii_status": "", "speed": "", "link_failure_count": "", "aggregator_id": "",
+                         "partner_mac": ""}
+                self.slaves[value] = slave
+                section = "slave"
+            elif key == "Active Aggregator Info":
+                section = "active_aggregator"
+            elif key.startswith("details "):
+                section = "slave_" + key.split(" ")[1]
+            elif section == "bond" and key == "Bonding Mode":
+                self.mode = self.BONDING_MODES.get(value, value)
+            elif section == "bond" and key == "Transmit Hash Policy":
+                self.xmit_hash_policy = value.split(" ")[0]
+            elif section == "bond" and key == "MII Status":
+                self.mii_status = value
+            elif section == "active_aggregator" and key == "Aggregator ID":
+                self.aggregator_id = value
+            elif section == "active_aggregator" and key == "Partner Mac Address":
+                self.partner_mac = value
+            elif section == "slave" and key == "MII Status":
+                slave["mii_status"] = value
+            elif section == "slave" and key == "Speed":
+                # Speed is Unknown for slave without link
+                speed = value.split(" ")[0]
+                slave["speed"] = speed if speed.isdigit() else ""
+            elif section == "slave" and key == "Link Failure Count":
+                slave["link_failure_count"] = value
+            elif section == "slave" and key == "Aggregator ID":
+                slave["aggregator_id"] = value
+            elif section == "slave_partner" and key == "system mac address":
+                slave["partner_mac"] = value
+
+
 class ifreq(ctypes.Structure):
     _fields_ = [("ifr_ifrn", ctypes.c_char * 16),
                 ("ifr_flags", ctypes.c_short)]
 
 
+class ifreq_data(ctypes.Structure):
+    # ifreq with ifr_data union member, used by SIOCETHTOOL. Padded to full ifreq size
+    _fields_ = [("ifr_ifrn", ctypes.c_char * 16),
+                ("ifr_data", ctypes.c_void_p),
+                ("ifr_pad", ctypes.c_char * 16)]
+
+
 class LldpData:
     LLDP_ETHER_PROTO = 0x88CC       # LLDP ehternet protocol number
 
@@ -2210,68 +3697,1262 @@ class LldpData:
 
 
 class RshimDevice(object):
-    def __init__(self, bdf, data_source, config):
-        # type: (str, DataSource, Config) -> None
+    def __init__(self, bdf, data_source, config, run_index=None):
+        # type: (str, DataSource, Config, dict) -> None
+        # Host wide index of rshim devices is built once per run, run_index is shared by all devices of the run.
+        # See index_rshim_devices
         self._bdf = bdf
         self._config = config
         self._data_source = data_source
+        self._run_index = run_index if run_index is not None else {}
 
         self.rshim_dev = ""
 
     def get_data(self):
-        dev_list = self._data_source.list_dir_if_exists('/dev')
-        rshim_list = find_in_list(dev_list.split(' '),r'rshim[0-9]+',return_only_first_group=False)
+        if "rshim" not in self._run_index:
+            self._run_index["rshim"] = self.index_rshim_devices()
+        rshim_devices, rshim_by_pci_device = self._run_index["rshim"]
 
-        if not rshim_list:
+        if not rshim_devices:
             self._data_source.log.error('Missing /dev RSHIM devices for {}. Check if driver loaded'.format(self._bdf))
             return
 
-        for rshim in rshim_list:
+        # The full PCI address of rhsim interface is a pci addres of DMA device
+        # Currently DMA devices not supported by lshca
+        # so comparing only bus and device adresses (without function)
+        rshim_dev = rshim_by_pci_device.get(self._bdf.split('.')[0])
+        if rshim_dev is None:
+            return
+
+        self.rshim_dev = rshim_dev
+        if rshim_devices[rshim_dev]["drop_mode"] and self._config.show_warnings_and_errors is True:
+            self.rshim_dev += self._config.warning_sign
+
+    def index_rshim_devices(self):
+        # type: () -> tuple
+        # Every /dev/rshimN/misc is read once. Returns:
+        #   {rshim device: {"attach": pcie/usb, "pci_device": PCI bus:device, "drop_mode": bool, "dev_info": str}}
+        #   {PCI bus:device: rshim device}, first rshim device of the PCI device wins
+        rshim_devices = OrderedDict()
+        rshim_by_pci_device = {}
+
+        dev_list = self._data_source.list_dir_if_exists('/dev')
+        rshim_list = find_in_list(dev_list.split(' '),r'rshim[0-9]+',return_only_first_group=False)
+
+        for rshim in rshim_list or []:
             curr_rshim_dev = '/dev/{}'.format(rshim)
             curr_rshim_dev_misc = '{}/misc'.format(curr_rshim_dev)
-            misc_data = self._data_source.read_file_if_exists(curr_rshim_dev_misc,use_cache=True)
-            dev_name = search_in_list_and_extract_by_regex(misc_data.split('\n'),r'DEV_NAME.*',r'DEV_NAME +(.*)')
+            misc_data = self._data_source.read_file_if_exists(curr_rshim_dev_misc,use_cache=True).split('\n')
+            dev_name = search_in_list_and_extract_by_regex(misc_data,r'DEV_NAME.*',r'DEV_NAME +(.*)')
             if self._config.na_str in dev_name:
                 self._data_source.log.error('Failed to read {}. DEV_NAME is missing'.format(curr_rshim_dev_misc))
-                return
+                continue
 
             try:
                 bus = dev_name.split('-')[0]
                 addr = dev_name.split('-')[1]
-            except:
+            except IndexError:
                 self._data_source.log.error('Failed to identify bus and address in DEV_NAME {} of {}'.format(dev_name, curr_rshim_dev_misc))
                 continue
 
-            if 'usb' in bus.lower():
+            rshim_devices[curr_rshim_dev] = {
+                "attach": "usb" if 'usb' in bus.lower() else "pcie",
+                "pci_device": "",
+                # Driver released the device, i.e. to let another host access it
+                "drop_mode": search_in_list_and_extract_by_regex(misc_data, r'DROP_MODE.*', r'DROP_MODE +([0-9]+)') == "1",
+                "dev_info": search_in_list_and_extract_by_regex(misc_data, r'DEV_INFO.*', r'DEV_INFO +(.*)'),
+            }
+
+            if rshim_devices[curr_rshim_dev]["attach"] == "usb":
                 self._data_source.log.error('RSHIM device {} connected to USB "{}", no way to identify DPU'.format(curr_rshim_dev, bus))
                 continue
 
-            # The full PCI address of rhsim interface is a pci addres of DMA device
-            # Currently DMA devices not supported by lshca
-            # so comparing only bus and device adresses (without function)
-            if addr.split('.')[0] == self._bdf.split('.')[0]:
-                self.rshim_dev = curr_rshim_dev
+            rshim_devices[curr_rshim_dev]["pci_device"] = addr.split('.')[0]
+            rshim_by_pci_device.setdefault(addr.split('.')[0], curr_rshim_dev)
+
+        return rshim_devices, rshim_by_pci_device
+
+
+class UmadClient(object):
+    """
+    Minimal MAD client over kernel user_mad interface, /dev/infiniband/umadN (ABI version 5)
+    Serves single HCA port. Management agents are registered once, on first use, and reused by all queries.
+    Queries of a batch are sent up to MAX_IN_FLIGHT at a time and their responses matched by transaction ID.
+    Supported queries (attribute, target):
+        ("NodeInfo", "<DR path>"), ("NodeDescription", "<DR path>") - directed route SMPs, i.e. path "0,1"
+        ("SMInfoRecord", "<SM LID>")                                - SA SubnAdmGet
+    I/O is done by _open, _close, _ioctl, _write, _read and _wait_readable, a stand-in device overrides them
+    """
+    IOCTL_REGISTER_AGENT = 0xC01C1B01   # _IOWR(0x1b, 1, struct ib_user_mad_reg_req)
+    IOCTL_UNREGISTER_AGENT = 0x40041B02 # _IOW(0x1b, 2, __u32)
+    IOCTL_ENABLE_PKEY = 0x1B03          # _IO(0x1b, 3), header with pkey_index
+    REG_REQ_STRUCT = struct.Struct("=I16xBBB3sBx")
+    # struct ib_user_mad_hdr, id/status/timeout_ms/retries/length are in host order, addresses in network order
+    HDR_HOST_STRUCT = struct.Struct("=IIIII")
+    HDR_ADDR_STRUCT = struct.Struct(">IIHBBBBBB16sIH6x")
+    HDR_SIZE = HDR_HOST_STRUCT.size + HDR_ADDR_STRUCT.size
+    MAD_SIZE = 256
+    MAD_HDR_STRUCT = struct.Struct(">BBBBHHQHHI")
+
+    SMI_DR_CLASS = 0x81
+    SA_CLASS = 0x03
+    METHOD_GET = 0x01
+    ATTRIBUTES = {"NodeDescription": 0x0010, "NodeInfo": 0x0011, "SMInfoRecord": 0x0018}
+    SA_QKEY = 0x80010000
+    PERMISSIVE_LID = 0xffff
+    SMP_DATA_OFFSET = 64
+    SMP_INITIAL_PATH_OFFSET = 128
+    SA_DATA_OFFSET = 56
+
+    TIMEOUT_MS = 200
+    RETRIES = 2
+    MAX_IN_FLIGHT = 8
+
+    def __init__(self, umad_path):
+        # type: (str) -> None
+        self.umad_path = umad_path
+        self._fd = None
+        self._agents = {}
+        self._next_tid = 1
+        self._lock = threading.Lock()
+
+    def query(self, queries):
+        # type: (list) -> dict
+        # Returns {query: parsed response}, failed or timed out query has None
+        with self._lock:
+            if self._fd is None:
+                self._fd = self._open()
+                self._ioctl(self.IOCTL_ENABLE_PKEY, 0)
+
+            results = dict((query, None) for query in queries)
+            pending = {}
+            to_send = list(queries)
+            deadline = time.time() + (self.TIMEOUT_MS * (self.RETRIES + 1) + 1000) / 1000.0
+            while (to_send or pending) and time.time() < deadline:
+                while to_send and len(pending) < self.MAX_IN_FLIGHT:
+                    query = to_send.pop(0)
+                    tid = self._next_tid
+                    self._next_tid = (self._next_tid + 1) & 0xffffffff or 1
+                    self._write(self._build_request(query, tid))
+                    pending[tid] = query
+
+                if not self._wait_readable(deadline - time.time()):
+                    break
+                packet = self._read(self.HDR_SIZE + self.MAD_SIZE)
+                status = self.HDR_HOST_STRUCT.unpack_from(packet)[1]
+                mad = packet[self.HDR_SIZE:]
+                # kernel uses upper 32 bits of TID for the agent, request is matched by lower ones
+                tid = self.MAD_HDR_STRUCT.unpack_from(mad)[6] & 0xffffffff
+                query = pending.pop(tid, None)
+                if query is not None and status == 0:
+                    results[query] = self._parse_response(query, mad)
+            return results
+
+    def close(self):
+        # type: () -> None
+        with self._lock:
+            if self._fd is None:
+                return
+            for agent_id in self._agents.values():
+                try:
+                    self._ioctl(self.IOCTL_UNREGISTER_AGENT, struct.pack("=I", agent_id))
+                except (IOError, OSError):
+                    pass
+            self._agents = {}
+            self._close()
+            self._fd = None
+
+    def _agent(self, qpn, mgmt_class, class_version, rmpp_version):
+        # type: (int, int, int, int) -> int
+        key = (qpn, mgmt_class, class_version)
+        if key not in self._agents:
+            req = self.REG_REQ_STRUCT.pack(0, qpn, mgmt_class, class_version, b"\0\0\0", rmpp_version)
+            self._agents[key] = self.REG_REQ_STRUCT.unpack(self._ioctl(self.IOCTL_REGISTER_AGENT, req))[0]
+        return self._agents[key]
+
+    def _build_request(self, query, tid):
+        # type: (tuple, int) -> bytes
+        attribute, target = query
+        mad = bytearray(self.MAD_SIZE)
+        if attribute in ("NodeInfo", "NodeDescription"):
+            path = [int(hop) for hop in str(target).split(",")]
+            agent_id = self._agent(0, self.SMI_DR_CLASS, 1, 0)
+            # Status field of DR SMP holds D bit, HopPointer and HopCount
+            self.MAD_HDR_STRUCT.pack_into(mad, 0, 1, self.SMI_DR_CLASS, 1, self.METHOD_GET, 0, len(path) - 1,
+                                          tid, self.ATTRIBUTES[attribute], 0, 0)
+            struct.pack_into(">HH", mad, 32, self.PERMISSIVE_LID, self.PERMISSIVE_LID)
+            for index, hop in enumerate(path):
+                mad[self.SMP_INITIAL_PATH_OFFSET + index] = hop
+            addr = (0, 0, self.PERMISSIVE_LID)
+        else:
+            lid = int(str(target), 0)
+            agent_id = self._agent(1, self.SA_CLASS, 2, 1)
+            self.MAD_HDR_STRUCT.pack_into(mad, 0, 1, self.SA_CLASS, 2, self.METHOD_GET, 0, 0,
+                                          tid, self.ATTRIBUTES[attribute], 0, 0)
+            # Component mask selects record by LID, the first SMInfoRecord field
+            struct.pack_into(">Q", mad, 48, 0x1)
+            struct.pack_into(">H", mad, self.SA_DATA_OFFSET, lid)
+            addr = (1, self.SA_QKEY, lid)
+
+        hdr = self.HDR_HOST_STRUCT.pack(agent_id, 0, self.TIMEOUT_MS, self.RETRIES, 0) + \
+            self.HDR_ADDR_STRUCT.pack(addr[0], addr[1], addr[2], 0, 0, 0, 0, 0, 0, b"\0" * 16, 0, 0)
+        return hdr + bytes(mad)
+
+    def _parse_response(self, query, mad):
+        # type: (tuple, bytes) -> dict
+        attribute = query[0]
+        mad_status = self.MAD_HDR_STRUCT.unpack_from(mad)[4]
+        if attribute in ("NodeInfo", "NodeDescription"):
+            mad_status &= 0x7fff # D bit
+        if mad_status != 0:
+            return None
+
+        if attribute == "NodeInfo":
+            node_type, num_ports, system_guid, node_guid, port_guid = \
+                struct.unpack_from(">xxBBQQQ", mad, self.SMP_DATA_OFFSET)
+            return {"node_type": node_type, "num_ports": num_ports, "system_guid": "{:016x}".format(system_guid),
+                    "node_guid": "{:016x}".format(node_guid), "port_guid": "{:016x}".format(port_guid)}
+        elif attribute == "NodeDescription":
+            description = mad[self.SMP_DATA_OFFSET:self.SMP_DATA_OFFSET + 64].split(b"\0")[0]
+            return {"description": description.decode("utf-8", "replace")}
+        else:
+            lid, guid, priority_state = struct.unpack_from(">H2xQ12xB", mad, self.SA_DATA_OFFSET)
+            return {"lid": lid, "guid": "{:016x}".format(guid), "priority": priority_state >> 4,
+                    "state": priority_state & 0xf}
+
+    def _open(self):
+        # type: () -> int
+        return os.open(self.umad_path, os.O_RDWR)
+
+    def _close(self):
+        # type: () -> None
+        os.close(self._fd)
+
+    def _ioctl(self, request, arg):
+        return fcntl.ioctl(self._fd, request, arg)
+
+    def _write(self, packet):
+        # type: (bytes) -> None
+        os.write(self._fd, packet)
+
+    def _read(self, size):
+        # type: (int) -> bytes
+        return os.read(self._fd, size)
+
+    def _wait_readable(self, timeout):
+        # type: (float) -> bool
+        if timeout <= 0:
+            return False
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        return bool(readable)
+
+
+class DcbNetlinkClient(object):
+    """
+    rtnetlink DCB client, stdlib only
+    DCB_CMD_IEEE_GET requests of all interfaces are sent over single socket before reading the replies,
+    replies are matched by netlink sequence number.
+    Parsed reply of interface:
+        pfc         - per priority PFC enable string, priority 0 first, i.e. "00010000" (same as mlnx_qos shows)
+        prio_tc, tc_tsa, tc_tx_bw - ETS configuration per priority/traffic class
+        prio2buffer, buffer_size, total_size - port buffer configuration, if supported by the driver
+        app         - APP table entries (selector, priority, protocol)
+        trust       - "dscp" if APP table has DSCP entries, else "pcp". That's how mlx5 reflects trust state
+    Netlink socket is opened by _socket, a stand-in socket overrides it
+    """
+    RTM_GETDCB = 78
+    NLM_F_REQUEST = 1
+    DCB_CMD_IEEE_GET = 21
+    DCB_ATTR_IFNAME = 1
+    DCB_ATTR_IEEE = 13
+    DCB_ATTR_IEEE_ETS = 1
+    DCB_ATTR_IEEE_PFC = 2
+    DCB_ATTR_IEEE_APP_TABLE = 3
+    DCB_ATTR_DCB_BUFFER = 10
+    DCB_APP_SEL_DSCP = 5
+
+    NLMSG_HDR_STRUCT = struct.Struct("=IHHII")
+    DCBMSG_STRUCT = struct.Struct("=BBH")
+    NLA_HDR_STRUCT = struct.Struct("=HH")
+    IEEE_ETS_STRUCT = struct.Struct("=BBB8s8s8s8s8s8s8s")
+    IEEE_PFC_STRUCT = struct.Struct("=BBB")
+    DCB_BUFFER_STRUCT = struct.Struct("=8s8II")
+    DCB_APP_STRUCT = struct.Struct("=BBH")
+
+    TIMEOUT = 1.0
+
+    def query(self, interfaces):
+        # type: (list) -> dict
+        # Returns {interface: parsed reply}, interface without DCB support has None
+        results = dict((interface, None) for interface in interfaces)
+        sock = self._socket()
+        try:
+            sock.settimeout(self.TIMEOUT)
+            sock.bind((0, 0))
+            pending = {}
+            for seq, interface in enumerate(interfaces, 1):
+                sock.send(self._build_request(interface, seq))
+                pending[seq] = interface
+
+            while pending:
+                data = sock.recv(65536)
+                offset = 0
+                while offset + self.NLMSG_HDR_STRUCT.size <= len(data):
+                    msg_len, msg_type, _, seq, _ = self.NLMSG_HDR_STRUCT.unpack_from(data, offset)
+                    if msg_len < self.NLMSG_HDR_STRUCT.size:
+                        break
+                    interface = pending.pop(seq, None)
+                    if interface is not None and msg_type == self.RTM_GETDCB:
+                        payload = data[offset + self.NLMSG_HDR_STRUCT.size + self.DCBMSG_STRUCT.size:offset + msg_len]
+                        results[interface] = self._parse_reply(payload)
+                    offset += self._align(msg_len)
+        except socket.timeout:
+            pass
+        finally:
+            sock.close()
+        return results
+
+    def _build_request(self, interface, seq):
+        # type: (str, int) -> bytes
+        ifname = interface.encode() + b"\0"
+        attr = self.NLA_HDR_STRUCT.pack(self.NLA_HDR_STRUCT.size + len(ifname), self.DCB_ATTR_IFNAME) + ifname
+        attr += b"\0" * (self._align(len(attr)) - len(attr))
+        body = self.DCBMSG_STRUCT.pack(socket.AF_UNSPEC, self.DCB_CMD_IEEE_GET, 0) + attr
+        return self.NLMSG_HDR_STRUCT.pack(self.NLMSG_HDR_STRUCT.size + len(body), self.RTM_GETDCB,
+                                          self.NLM_F_REQUEST, seq, 0) + body
+
+    def _parse_reply(self, payload):
+        # type: (bytes) -> dict
+        ieee = self._parse_attributes(payload).get(self.DCB_ATTR_IEEE)
+        if ieee is None:
+            return None
+        attributes = self._parse_attributes(ieee)
+        reply = {}
+
+        if self.DCB_ATTR_IEEE_PFC in attributes:
+            pfc_cap, pfc_en, _ = self.IEEE_PFC_STRUCT.unpack_from(attributes[self.DCB_ATTR_IEEE_PFC])
+            reply["pfc_cap"] = pfc_cap
+            reply["pfc"] = "".join(str((pfc_en >> prio) & 1) for prio in range(8))
+
+        if self.DCB_ATTR_IEEE_ETS in attributes:
+            ets = self.IEEE_ETS_STRUCT.unpack_from(attributes[self.DCB_ATTR_IEEE_ETS])
+            reply["tc_tx_bw"] = list(bytearray(ets[3]))
+            reply["tc_tsa"] = list(bytearray(ets[5]))
+            reply["prio_tc"] = list(bytearray(ets[6]))
+
+        if self.DCB_ATTR_DCB_BUFFER in attributes:
+            buffer_data = self.DCB_BUFFER_STRUCT.unpack_from(attributes[self.DCB_ATTR_DCB_BUFFER])
+            reply["prio2buffer"] = list(bytearray(buffer_data[0]))
+            reply["buffer_size"] = list(buffer_data[1:9])
+            reply["total_size"] = buffer_data[9]
+
+        reply["app"] = []
+        app_table = attributes.get(self.DCB_ATTR_IEEE_APP_TABLE, b"")
+        offset = 0
+        while offset + self.NLA_HDR_STRUCT.size <= len(app_table):
+            nla_len, _ = self.NLA_HDR_STRUCT.unpack_from(app_table, offset)
+            if nla_len < self.NLA_HDR_STRUCT.size:
+                break
+            if nla_len >= self.NLA_HDR_STRUCT.size + self.DCB_APP_STRUCT.size:
+                reply["app"].append(self.DCB_APP_STRUCT.unpack_from(app_table, offset + self.NLA_HDR_STRUCT.size))
+            offset += self._align(nla_len)
+        reply["trust"] = "dscp" if [app for app in reply["app"] if app[0] == self.DCB_APP_SEL_DSCP] else "pcp"
+        return reply
+
+    def _parse_attributes(self, data):
+        # type: (bytes) -> dict
+        attributes = {}
+        offset = 0
+        while offset + self.NLA_HDR_STRUCT.size <= len(data):
+            nla_len, nla_type = self.NLA_HDR_STRUCT.unpack_from(data, offset)
+            if nla_len < self.NLA_HDR_STRUCT.size:
+                break
+            # NLA_F_NESTED and NLA_F_NET_BYTEORDER flags
+            attributes[nla_type & 0x3fff] = data[offset + self.NLA_HDR_STRUCT.size:offset + nla_len]
+            offset += self._align(nla_len)
+        return attributes
+
+    def _socket(self):
+        # type: () -> socket.socket
+        return socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, 0) # NETLINK_ROUTE
+
+    @staticmethod
+    def _align(length):
+        # type: (int) -> int
+        return (length + 3) & ~3
+
+
+class RdmaNetlinkClient(object):
+    """
+    RDMA netlink (NETLINK_RDMA, nldev) client, stdlib only
+    Devices are read with single RDMA_NLDEV_CMD_GET dump. Port requests of all devices are sent over the same
+    socket before reading the replies, replies are matched by netlink sequence number.
+    Returns {"devices": {rdma: device}, "ports": {"rdma/port": port}}
+        device - index, port_count, fw_ver, node_guid, sys_image_guid, link_layer
+        port   - state, phys_state, lid, sm_lid, subnet_prefix, netdev
+    Values are formatted as sysfs shows them, i.e. "ACTIVE", "LinkUp", "0000:0000:0000:0000", "InfiniBand"
+    Netlink socket is opened by _socket, a stand-in socket overrides it
+    """
+    NETLINK_RDMA = 20
+    RDMA_NL_NLDEV = 5
+    RDMA_NLDEV_CMD_GET = 1
+    RDMA_NLDEV_CMD_PORT_GET = 5
+    NLM_F_REQUEST = 1
+    NLM_F_DUMP = 0x300
+    NLMSG_ERROR = 2
+    NLMSG_DONE = 3
+
+    RDMA_NLDEV_ATTR_DEV_INDEX = 1
+    RDMA_NLDEV_ATTR_DEV_NAME = 2
+    RDMA_NLDEV_ATTR_PORT_INDEX = 3
+    RDMA_NLDEV_ATTR_FW_VERSION = 5
+    RDMA_NLDEV_ATTR_NODE_GUID = 6
+    RDMA_NLDEV_ATTR_SYS_IMAGE_GUID = 7
+    RDMA_NLDEV_ATTR_SUBNET_PREFIX = 8
+    RDMA_NLDEV_ATTR_LID = 9
+    RDMA_NLDEV_ATTR_SM_LID = 10
+    RDMA_NLDEV_ATTR_PORT_STATE = 12
+    RDMA_NLDEV_ATTR_PORT_PHYS_STATE = 13
+    RDMA_NLDEV_ATTR_NDEV_NAME = 51
+    RDMA_NLDEV_ATTR_DEV_PROTOCOL = 67
+
+    PORT_STATES = {0: "NOP", 1: "DOWN", 2: "INIT", 3: "ARMED", 4: "ACTIVE", 5: "ACTIVE_DEFER"}
+    PORT_PHYS_STATES = {1: "Sleep", 2: "Polling", 3: "Disabled", 4: "PortConfigurationTraining", 5: "LinkUp",
+                        6: "LinkErrorRecovery", 7: "Phy Test"}
+    LINK_LAYERS = {"ib": "InfiniBand", "roce": "Ethernet", "iw": "Ethernet"}
+
+    NLMSG_HDR_STRUCT = struct.Struct("=IHHII")
+    NLA_HDR_STRUCT = struct.Struct("=HH")
+    U8_STRUCT = struct.Struct("=B")
+    U32_STRUCT = struct.Struct("=I")
+    U64_STRUCT = struct.Struct("=Q")
+
+    TIMEOUT = 1.0
+
+    def query(self):
+        # type: () -> dict
+        result = {"devices": {}, "ports": {}}
+        sock = self._socket()
+        try:
+            sock.settimeout(self.TIMEOUT)
+            sock.bind((0, 0))
+
+            sock.send(self._build_request(self.RDMA_NLDEV_CMD_GET, self.NLM_F_DUMP, 1))
+            for payload in self._receive(sock, {1: None}).get(1, []):
+                device = self._parse_device(self._parse_attributes(payload))
+                if device:
+                    result["devices"][device.pop("name")] = device
+
+            pending = {}
+            seq = 1
+            for rdma, device in result["devices"].items():
+                for port in range(1, device["port_count"] + 1):
+                    seq += 1
+                    sock.send(self._build_request(self.RDMA_NLDEV_CMD_PORT_GET, 0, seq,
+                                                  [(self.RDMA_NLDEV_ATTR_DEV_INDEX, self.U32_STRUCT.pack(device["index"])),
+                                                   (self.RDMA_NLDEV_ATTR_PORT_INDEX, self.U32_STRUCT.pack(port))]))
+                    pending[seq] = rdma + "/" + str(port)
+
+            for seq, payloads in self._receive(sock, pending).items():
+                rdma = pending[seq].split("/")[0]
+                for payload in payloads:
+                    result["ports"][pending[seq]] = self._parse_port(self._parse_attributes(payload),
+                                                                     result["devices"][rdma])
+        finally:
+            sock.close()
+        return result
+
+    def _receive(self, sock, pending):
+        # type: (socket.socket, dict) -> dict
+        # Returns {seq: [payloads]}. Dump ends with NLMSG_DONE, single reply by itself, NLMSG_ERROR ends either
+        pending = dict(pending)
+        replies = {}
+        try:
+            while pending:
+                data = sock.recv(65536)
+                offset = 0
+                while offset + self.NLMSG_HDR_STRUCT.size <= len(data):
+                    msg_len, msg_type, flags, seq, _ = self.NLMSG_HDR_STRUCT.unpack_from(data, offset)
+                    if msg_len < self.NLMSG_HDR_STRUCT.size:
+                        break
+                    if seq in pending:
+                        if msg_type == self.NLMSG_DONE or msg_type == self.NLMSG_ERROR:
+                            pending.pop(seq)
+                        else:
+                            replies.setdefault(seq, []).append(
+                                data[offset + self.NLMSG_HDR_STRUCT.size:offset + msg_len])
+                            if not flags & 0x2: # NLM_F_MULTI
+                                pending.pop(seq)
+                    offset += self._align(msg_len)
+        except socket.timeout:
+            pass
+        return replies
+
+    def _build_request(self, command, flags, seq, attributes=()):
+        # type: (int, int, int, list) -> bytes
+        body = b""
+        for nla_type, value in attributes:
+            attr = self.NLA_HDR_STRUCT.pack(self.NLA_HDR_STRUCT.size + len(value), nla_type) + value
+            body += attr + b"\0" * (self._align(len(attr)) - len(attr))
+        msg_type = (self.RDMA_NL_NLDEV << 10) + command
+        return self.NLMSG_HDR_STRUCT.pack(self.NLMSG_HDR_STRUCT.size + len(body), msg_type,
+                                          self.NLM_F_REQUEST | flags, seq, 0) + body
+
+    def _parse_device(self, attributes):
+        # type: (dict) -> dict
+        if self.RDMA_NLDEV_ATTR_DEV_NAME not in attributes or self.RDMA_NLDEV_ATTR_DEV_INDEX not in attributes:
+            return None
+        device = {"name": self._string(attributes[self.RDMA_NLDEV_ATTR_DEV_NAME]),
+                  "index": self.U32_STRUCT.unpack_from(attributes[self.RDMA_NLDEV_ATTR_DEV_INDEX])[0],
+                  # On device, port index is the number of ports
+                  "port_count": self.U32_STRUCT.unpack_from(attributes.get(self.RDMA_NLDEV_ATTR_PORT_INDEX,
+                                                                           self.U32_STRUCT.pack(0)))[0],
+                  "fw_ver": self._string(attributes.get(self.RDMA_NLDEV_ATTR_FW_VERSION, b"")),
+                  "link_layer": self.LINK_LAYERS.get(self._string(attributes.get(self.RDMA_NLDEV_ATTR_DEV_PROTOCOL,
+                                                                                 b"")), "")}
+        for key, nla_type in (("node_guid", self.RDMA_NLDEV_ATTR_NODE_GUID),
+                              ("sys_image_guid", self.RDMA_NLDEV_ATTR_SYS_IMAGE_GUID)):
+            device[key] = self._guid(attributes[nla_type]) if nla_type in attributes else ""
+        return device
+
+    def _parse_port(self, attributes, device):
+        # type: (dict, dict) -> dict
+        port = {"link_layer": device["link_layer"], "netdev": ""}
+        if self.RDMA_NLDEV_ATTR_PORT_STATE in attributes:
+            state = self.U8_STRUCT.unpack_from(attributes[self.RDMA_NLDEV_ATTR_PORT_STATE])[0]
+            port["state"] = self.PORT_STATES.get(state, str(state))
+        if self.RDMA_NLDEV_ATTR_PORT_PHYS_STATE in attributes:
+            phys_state = self.U8_STRUCT.unpack_from(attributes[self.RDMA_NLDEV_ATTR_PORT_PHYS_STATE])[0]
+            port["phys_state"] = self.PORT_PHYS_STATES.get(phys_state, str(phys_state))
+        # LID, SM LID and subnet prefix are reported for IB ports only, sysfs shows 0 for the rest
+        port["lid"] = self.U32_STRUCT.unpack_from(attributes.get(self.RDMA_NLDEV_ATTR_LID, self.U32_STRUCT.pack(0)))[0]
+        port["sm_lid"] = self.U32_STRUCT.unpack_from(attributes.get(self.RDMA_NLDEV_ATTR_SM_LID,
+                                                                    self.U32_STRUCT.pack(0)))[0]
+        if self.RDMA_NLDEV_ATTR_SUBNET_PREFIX in attributes:
+            port["subnet_prefix"] = self._guid(attributes[self.RDMA_NLDEV_ATTR_SUBNET_PREFIX])
+        # Netdev is reported only if it's in the same network namespace
+        if self.RDMA_NLDEV_ATTR_NDEV_NAME in attributes:
+            port["netdev"] = self._string(attributes[self.RDMA_NLDEV_ATTR_NDEV_NAME])
+        return port
+
+    def _parse_attributes(self, data):
+        # type: (bytes) -> dict
+        attributes = {}
+        offset = 0
+        while offset + self.NLA_HDR_STRUCT.size <= len(data):
+            nla_len, nla_type = self.NLA_HDR_STRUCT.unpack_from(data, offset)
+            if nla_len < self.NLA_HDR_STRUCT.size:
                 break
+            # NLA_F_NESTED and NLA_F_NET_BYTEORDER flags
+            attributes[nla_type & 0x3fff] = data[offset + self.NLA_HDR_STRUCT.size:offset + nla_len]
+            offset += self._align(nla_len)
+        return attributes
+
+    def _socket(self):
+        # type: () -> socket.socket
+        return socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, self.NETLINK_RDMA)
+
+    def _guid(self, data):
+        # type: (bytes) -> str
+        # i.e. b8ce:f603:00a1:2b3c, same as sysfs node_guid
+        guid = "{:016x}".format(self.U64_STRUCT.unpack_from(data)[0])
+        return ":".join(guid[i:i + 4] for i in range(0, 16, 4))
+
+    @staticmethod
+    def _string(data):
+        # type: (bytes) -> str
+        return data.split(b"\0")[0].decode("utf-8", "replace")
+
+    @staticmethod
+    def _align(length):
+        # type: (int) -> int
+        return (length + 3) & ~3
+
+
+class EthtoolClient(object):
+    """
+    ethtool ioctl client, stdlib only. Reads same driver statistics as "ethtool -S", without forking it
+    Statistics names (ETHTOOL_GSTRINGS) are read once per interface and kept for the client lifetime,
+    values (ETHTOOL_GSTATS) are read on every query.
+    """
+    SIOCETHTOOL = 0x8946
+    ETHTOOL_GSTRINGS = 0x1b
+    ETHTOOL_GSTATS = 0x1d
+    ETHTOOL_GSSET_INFO = 0x37
+    ETH_SS_STATS = 1
+    ETH_GSTRING_LEN = 32
+
+    SSET_INFO_STRUCT = struct.Struct("=IIQI")
+    GSTRINGS_STRUCT = struct.Struct("=III")
+    GSTATS_STRUCT = struct.Struct("=II")
+    STAT_STRUCT = struct.Struct("=Q")
+
+    def __init__(self):
+        # type: () -> None
+        self._stats_names = {}
+
+    def query(self, interfaces):
+        # type: (list) -> dict
+        # Returns {interface: {statistic: value}}, interface without driver statistics (i.e. bond) has None
+        results = dict((interface, None) for interface in interfaces)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            for interface in interfaces:
+                try:
+                    results[interface] = self._get_stats(sock, interface)
+                except (IOError, OSError):
+                    continue
+        finally:
+            sock.close()
+        return results
+
+    def _get_stats(self, sock, interface):
+        # type: (socket.socket, str) -> dict
+        names = self._get_stats_names(sock, interface)
+        if not names:
+            return None
+
+        buf = ctypes.create_string_buffer(self.GSTATS_STRUCT.size + len(names) * self.STAT_STRUCT.size)
+        self.GSTATS_STRUCT.pack_into(buf, 0, self.ETHTOOL_GSTATS, len(names))
+        self._ioctl(sock, interface, buf)
+        raw = buf.raw
+        n_stats = self.GSTATS_STRUCT.unpack_from(raw)[1]
+        if n_stats != len(names):
+            # Statistics set changed since names were read, i.e. number of channels changed
+            del self._stats_names[interface]
+            return None
+
+        stats = {}
+        for index, name in enumerate(names):
+            stats[name] = self.STAT_STRUCT.unpack_from(raw, self.GSTATS_STRUCT.size + index * self.STAT_STRUCT.size)[0]
+        return stats
+
+    def _get_stats_names(self, sock, interface):
+        # type: (socket.socket, str) -> list
+        if interface in self._stats_names:
+            return self._stats_names[interface]
+
+        buf = ctypes.create_string_buffer(self.SSET_INFO_STRUCT.size)
+        self.SSET_INFO_STRUCT.pack_into(buf, 0, self.ETHTOOL_GSSET_INFO, 0, 1 << self.ETH_SS_STATS, 0)
+        self._ioctl(sock, interface, buf)
+        _, _, sset_mask, n_stats = self.SSET_INFO_STRUCT.unpack_from(buf.raw)
+        if not sset_mask & (1 << self.ETH_SS_STATS):
+            n_stats = 0
+
+        names = []
+        if n_stats:
+            buf = ctypes.create_string_buffer(self.GSTRINGS_STRUCT.size + n_stats * self.ETH_GSTRING_LEN)
+            self.GSTRINGS_STRUCT.pack_into(buf, 0, self.ETHTOOL_GSTRINGS, self.ETH_SS_STATS, n_stats)
+            self._ioctl(sock, interface, buf)
+            raw = buf.raw
+            n_stats = self.GSTRINGS_STRUCT.unpack_from(raw)[2]
+            for index in range(n_stats):
+                offset = self.GSTRINGS_STRUCT.size + index * self.ETH_GSTRING_LEN
+                names.append(raw[offset:offset + self.ETH_GSTRING_LEN].split(b"\0")[0].decode("utf-8", "replace"))
+
+        self._stats_names[interface] = names
+        return names
+
+    def _ioctl(self, sock, interface, buf):
+        # type: (socket.socket, str, ctypes.Array) -> None
+        ifr = ifreq_data()
+        ifr.ifr_ifrn = interface.encode('UTF-8')
+        ifr.ifr_data = ctypes.addressof(buf)
+        fcntl.ioctl(sock.fileno(), self.SIOCETHTOOL, ifr)
+
+
+class OvsdbClient(object):
+    """
+    OVSDB JSON-RPC (RFC 7047) client of local ovsdb-server unix socket, stdlib only
+    Bridge, Port and Interface tables are read in single transaction and turned into port index:
+        {port name: {"bridge": bridge name, "ofport": OpenFlow port number, "admin_state": up/down}}
+    Members of bond ports are indexed by their interface name as well
+    """
+    TIMEOUT = 2.0
+
+    def __init__(self, socket_path):
+        # type: (str) -> None
+        self.socket_path = socket_path
+
+    def get_ports_index(self):
+        # type: () -> dict
+        result = self._transact([
+            {"op": "select", "table": "Bridge", "where": [], "columns": ["name", "ports"]},
+            {"op": "select", "table": "Port", "where": [], "columns": ["_uuid", "name", "interfaces"]},
+            {"op": "select", "table": "Interface", "where": [], "columns": ["_uuid", "name", "ofport", "admin_state"]},
+        ])
+        bridges, ports, interfaces = [operation.get("rows", []) for operation in result]
+
+        interface_by_uuid = dict((self._uuid(row["_uuid"]), row) for row in interfaces)
+        port_by_uuid = dict((self._uuid(row["_uuid"]), row) for row in ports)
+
+        index = {}
+        for bridge in bridges:
+            for port_uuid in self._set(bridge["ports"]):
+                port = port_by_uuid.get(self._uuid(port_uuid))
+                if port is None:
+                    continue
+                port_interfaces = [interface_by_uuid[self._uuid(iface_uuid)] for iface_uuid in self._set(port["interfaces"])
+                                   if self._uuid(iface_uuid) in interface_by_uuid]
+                for interface in port_interfaces:
+                    index[interface["name"]] = self._port_entry(bridge["name"], interface)
+                if port["name"] not in index:
+                    index[port["name"]] = self._port_entry(bridge["name"], port_interfaces[0] if port_interfaces else {})
+        return index
+
+    def _transact(self, operations):
+        # type: (list) -> list
+        request = {"method": "transact", "params": ["Open_vSwitch"] + operations, "id": 0}
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.TIMEOUT)
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps(request).encode())
+
+            # Reply has no framing, it's complete once it decodes as JSON
+            data = b""
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    raise ValueError("ovsdb-server closed connection")
+                data += chunk
+                try:
+                    reply = json.loads(data.decode())
+                except ValueError:
+                    continue
+                if reply.get("id") == 0:
+                    break
+                # Notifications, i.e. echo, aren't replies of the transaction
+                data = b""
+        finally:
+            sock.close()
+
+        if reply.get("error"):
+            raise ValueError("ovsdb-server error: {}".format(reply["error"]))
+        for operation in reply["result"]:
+            if operation and "error" in operation:
+                raise ValueError("ovsdb-server error: {}".format(operation["error"]))
+        return reply["result"]
+
+    def _port_entry(self, bridge, interface):
+        # type: (str, dict) -> dict
+        ofport = self._set(interface.get("ofport", ["set", []]))
+        admin_state = self._set(interface.get("admin_state", ["set", []]))
+        return {"bridge": bridge,
+                "ofport": str(ofport[0]) if ofport else "",
+                "admin_state": admin_state[0] if admin_state else ""}
+
+    @staticmethod
+    def _set(value):
+        # type: (object) -> list
+        # Set of one element is encoded as the element itself, empty optional column as empty set
+        if isinstance(value, list) and value and value[0] == "set":
+            return value[1]
+        return [value]
+
+    @staticmethod
+    def _uuid(value):
+        # type: (list) -> str
+        return value[1]
+
+
+class RecordFileWriter(object):
+    """
+    Writer of the indexed recording format (.lshrec)
+    File layout:
+        header - MAGIC + FORMAT_VERSION
+        blobs  - zlib compressed pickles. Identical data is stored only once (deduplicated by sha1 of the pickle)
+        index  - zlib compressed pickle of {(source, key): (blob offset, blob length)}
+        Blobs and index are pickled with PICKLE_PROTOCOL, so recordings made by Python 3 can be replayed by Python 2
+        footer - index offset, index length and INDEX_MAGIC. Fixed size, so the index is found without scanning the file
+    """
+    MAGIC = b"LSHCAREC"
+    FORMAT_VERSION = b"\x01"
+    INDEX_MAGIC = b"LSHCAIDX"
+    FOOTER_STRUCT = struct.Struct("<QQ8s")
+    PICKLE_PROTOCOL = 2 # readable by both Python 2 and 3
+
+    def __init__(self, file_name):
+        # type: (str) -> None
+        self._file = open(file_name, "wb")
+        self._file.write(self.MAGIC + self.FORMAT_VERSION)
+        self._blobs = {}
+        self._index = {}
+
+    def add(self, source, key, data):
+        # type: (str, str, object) -> None
+        # Same (source, key) recorded more than once is overwritten, same as extraction of a tar with duplicate members
+        p_data = pickle.dumps(data, self.PICKLE_PROTOCOL)
+        digest = hashlib.sha1(p_data).digest()
+        if digest not in self._blobs:
+            c_data = zlib.compress(p_data)
+            self._blobs[digest] = (self._file.tell(), len(c_data))
+            self._file.write(c_data)
+        self._index[(source, key)] = self._blobs[digest]
+
+    def close(self):
+        # type: () -> None
+        index_offset = self._file.tell()
+        c_index = zlib.compress(pickle.dumps(self._index, self.PICKLE_PROTOCOL))
+        self._file.write(c_index)
+        self._file.write(self.FOOTER_STRUCT.pack(index_offset, len(c_index), self.INDEX_MAGIC))
+        self._file.close()
+
+
+class RecordFileReader(object):
+    """
+    Random access reader of the indexed recording format, see RecordFileWriter for the file layout
+    Only the index is loaded on open, every entry is read with single seek and decompressed on request
+    """
+    def __init__(self, file_name):
+        # type: (str) -> None
+        self.file_name = file_name
+        self._file = open(file_name, "rb")
+        header = self._file.read(len(RecordFileWriter.MAGIC) + len(RecordFileWriter.FORMAT_VERSION))
+        if header != RecordFileWriter.MAGIC + RecordFileWriter.FORMAT_VERSION:
+            raise ValueError("{} is not a supported lshca recording".format(file_name))
+
+        self._file.seek(-RecordFileWriter.FOOTER_STRUCT.size, os.SEEK_END)
+        index_offset, index_len, index_magic = RecordFileWriter.FOOTER_STRUCT.unpack(
+            self._file.read(RecordFileWriter.FOOTER_STRUCT.size))
+        if index_magic != RecordFileWriter.INDEX_MAGIC:
+            raise ValueError("{} has no index, the recording was probably interrupted".format(file_name))
+
+        self._file.seek(index_offset)
+        self._index = pickle.loads(zlib.decompress(self._file.read(index_len)))
+
+    def __contains__(self, source_key):
+        # type: (tuple) -> bool
+        return source_key in self._index
+
+    def keys(self):
+        # type: () -> list
+        return list(self._index.keys())
+
+    def read_raw(self, source, key):
+        # type: (str, str) -> bytes
+        # Returns pickled data, raises KeyError if entry wasn't recorded
+        offset, length = self._index[(source, key)]
+        self._file.seek(offset)
+        return zlib.decompress(self._file.read(length))
+
+    def read(self, source, key):
+        # type: (str, str) -> object
+        return pickle.loads(self.read_raw(source, key))
+
+    def close(self):
+        # type: () -> None
+        self._file.close()
+
+    @staticmethod
+    def is_record_file(file_name):
+        # type: (str) -> bool
+        with open(file_name, "rb") as f:
+            return f.read(len(RecordFileWriter.MAGIC)) == RecordFileWriter.MAGIC
+
+
+class DataSourceCache(object):
+    """
+    Cache of DataSource outputs, keyed by (source, key) tuples
+    Every entry belongs to a class, each class has its own time to live (see Config.cache_ttl):
+        static   - doesn't change while the host is up, i.e. VPD, firmware and driver version
+        slow     - changes by administrative action, i.e. mlxconfig, cable info, QoS settings
+        volatile - everything else, i.e. link state, counters, temperature
+    Class is taken from CLASS_RULES unless given explicitly.
+    Entries never expire or get evicted during a run, so repeated reads within a run return the same data.
+    Resident users (LshcaDaemon, collect on a reused DataSource) call expire between runs, it drops entries older
+    than their TTL and bounds the cache size by LRU eviction.
+    Entry age is measured by clock, time.time unless a stand-in clock is given.
+    """
+    STATIC = "static"
+    SLOW = "slow"
+    VOLATILE = "volatile"
+    CLASSES = (STATIC, SLOW, VOLATILE)
+
+    MISS = object() # returned by get, cached output might be None or empty
+
+    # (source, regex matched against the key, class). First match wins, default is volatile
+    CLASS_RULES = [(source, re.compile(regex), cache_class) for source, regex, cache_class in [
+        ("shell.cmd", r"^\s*(lspci|ofed_info|modinfo|mst version|which )", STATIC),
+        ("shell.cmd", r"^\s*(mlxconfig|mlxcables|mlxprivhost|mlnx_qos|ovs-vsctl|mst )", SLOW),
+        ("lspci", r".", STATIC),
+        ("file", r"^/etc/|^/sys/module/|^/usr/bin/ofed_info$|"
+                 r"/infiniband/[^/]+/(fw_ver|board_id|hca_type|node_guid|sys_image_guid)$", STATIC),
+        ("raw.socket", r".", SLOW),
+        ("dcb", r".", SLOW),
+        ("ovsdb", r".", SLOW),
+    ]]
+
+    def __init__(self, ttl, max_entries, clock=time.time):
+        # type: (dict, int, object) -> None
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._clock = clock
+        self._entries = OrderedDict() # (source, key) -> (output, class, time it was set)
+        self._lock = threading.RLock()
+        self.misses = 0
+        self.stats = dict((cache_class, {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "invalidations": 0})
+                          for cache_class in self.CLASSES)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, source_key):
+        # type: (tuple) -> bool
+        # Doesn't count as hit or miss, nor refresh LRU position
+        return source_key in self._entries
+
+    def classify(self, source, key):
+        # type: (str, object) -> str
+        for rule_source, regex, cache_class in self.CLASS_RULES:
+            if source == rule_source and regex.search(str(key)):
+                return cache_class
+        return self.VOLATILE
+
+    def get(self, source, key, cache_class=None):
+        # type: (str, object, str) -> object
+        with self._lock:
+            entry = self._entries.pop((source, key), None)
+            if entry is None:
+                self._count_miss(cache_class or self.classify(source, key))
+                return self.MISS
+
+            # re-inserted as the most recently used
+            self._entries[(source, key)] = entry
+            output, entry_class, _ = entry
+            self.stats[entry_class]["hits"] += 1
+            return output
+
+    def set(self, source, key, output, cache_class=None):
+        # type: (str, object, object, str) -> None
+        if cache_class is None:
+            cache_class = self.classify(source, key)
+
+        with self._lock:
+            self._entries.pop((source, key), None)
+            self._entries[(source, key)] = (output, cache_class, self._clock())
+
+    def expire(self):
+        # type: () -> None
+        # Called between runs only, see class description
+        now = self._clock()
+        with self._lock:
+            for source_key, (_, entry_class, set_time) in list(self._entries.items()):
+                ttl = self._ttl.get(entry_class)
+                if ttl is not None and set_time + ttl < now:
+                    del self._entries[source_key]
+                    self.stats[entry_class]["expired"] += 1
+            while len(self._entries) > self._max_entries:
+                _, (_, evicted_class, _) = self._entries.popitem(last=False)
+                self.stats[evicted_class]["evictions"] += 1
+
+    def invalidate(self, source=None, key_regex=None, cache_class=None):
+        # type: (str, str, str) -> int
+        # Removes entries matching all given criteria, without criteria the whole cache is dropped
+        regex = re.compile(key_regex) if key_regex is not None else None
+        with self._lock:
+            to_remove = [(entry_source, key) for (entry_source, key), (_, entry_class, _) in self._entries.items()
+                         if (source is None or entry_source == source) and
+                            (regex is None or regex.search(str(key))) and
+                            (cache_class is None or entry_class == cache_class)]
+            for source_key in to_remove:
+                entry_class = self._entries.pop(source_key)[1]
+                self.stats[entry_class]["invalidations"] += 1
+        return len(to_remove)
+
+    def _count_miss(self, cache_class):
+        # type: (str) -> None
+        self.misses += 1
+        self.stats[cache_class]["misses"] += 1
+
+
+class NullProfilerSpan(object):
+    # Returned by disabled profiler, keeps instrumented code free of "if profiling" checks
+    cache_hit = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def tag(self, **args):
+        pass
+
+
+class ProfilerSpan(object):
+    def __init__(self, profiler, category, name, args):
+        # type: (Profiler, str, str, dict) -> None
+        self.profiler = profiler
+        self.category = category
+        self.name = name
+        self.args = args
+        self.cache_hit = None # None - call not cached, True/False - cache hit/miss
+        self.start = None
+
+    def __enter__(self):
+        self.profiler.scope_stack.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.time() - self.start
+        self.profiler.scope_stack.pop()
+        self.profiler.span_finished(self, duration)
+        return False
+
+    def tag(self, **args):
+        # Adds data known only after the span started, i.e. RDMA device of a BDF
+        self.args.update(args)
+
+
+class Profiler(object):
+    """
+    Collects timing of lshca run for --profile and --trace
+    Spans are opened around DataSource calls (category is the DataSource method), BDF, HCA and IB port data
+    collection (categories "bdf", "hca" and "port") and pipeline phases (category "phase").
+    DataSource calls are aggregated per method and per command template, i.e. command or path with BDFs,
+    device names and numbers replaced, and attributed to the innermost BDF span.
+    With trace enabled every span is also kept as Chrome trace event, see write_trace.
+    """
+    BDF_REGEX = re.compile(r'[0-9a-fA-F]{4}:[0-9a-fA-F]{2}:[0-9a-fA-F]{2}\.[0-9a-fA-F]')
+    NUMBER_REGEX = re.compile(r'\d+')
+    TOP_TEMPLATES = 25
+    SCOPE_CATEGORIES = ("bdf", "hca", "port") # data collection scopes, DataSource calls are attributed to them
+
+    def __init__(self, profile=False, trace=False):
+        # type: (bool, bool) -> None
+        self.enabled = profile or trace
+        self.trace = trace
+        self.start = time.time()
+        self.sources = {}
+        self.templates = {}
+        self.bdfs = {}
+        self.phases = []
+        self.trace_events = []
+        self._null_span = NullProfilerSpan()
+        self._thread_data = threading.local()
+        self._lock = threading.Lock()
+
+        self._tracemalloc = None
+        # tracemalloc slows down every allocation, it would distort the trace, thus used only for the profile report
+        if profile:
+            try:
+                import tracemalloc
+                # reset_peak is required for per phase peak, it was added in Python 3.9
+                if hasattr(tracemalloc, "reset_peak"):
+                    self._tracemalloc = tracemalloc
+                    if not tracemalloc.is_tracing():
+                        tracemalloc.start()
+            except ImportError:
+                pass
+
+    @property
+    def scope_stack(self):
+        # type: () -> list[ProfilerSpan]
+        # Spans are nested per thread
+        if not hasattr(self._thread_data, "scope_stack"):
+            self._thread_data.scope_stack = []
+        return self._thread_data.scope_stack
+
+    def span(self, category, name, **args):
+        # type: (str, str, dict) -> ProfilerSpan
+        if not self.enabled:
+            return self._null_span
+        return ProfilerSpan(self, category, name, args)
+
+    def phase(self, name):
+        # type: (str) -> ProfilerSpan
+        if self.enabled and self._tracemalloc:
+            self._tracemalloc.reset_peak()
+        return self.span("phase", name)
+
+    def span_finished(self, span, duration):
+        # type: (ProfilerSpan, float) -> None
+        with self._lock:
+            if span.category == "phase":
+                self.phases.append({"phase": span.name, "time": duration, "peak_mem_kb": self._peak_memory_kb()})
+            elif span.category in self.SCOPE_CATEGORIES:
+                bdf_stats = self.bdfs.setdefault(span.name, {"time": 0.0, "calls": 0, "data_source_time": 0.0})
+                bdf_stats["time"] += duration
+            else:
+                self._add_call(self.sources, span.category, span, duration)
+                self._add_call(self.templates, span.category + ": " + self.template(span.name), span, duration)
+                for scope in reversed(self.scope_stack):
+                    if scope.category in self.SCOPE_CATEGORIES:
+                        bdf_stats = self.bdfs.setdefault(scope.name, {"time": 0.0, "calls": 0, "data_source_time": 0.0})
+                        bdf_stats["calls"] += 1
+                        bdf_stats["data_source_time"] += duration
+                        for tag in ("bdf", "rdma"):
+                            if tag in scope.args:
+                                span.args.setdefault(tag, scope.args[tag])
+                        break
+
+            if self.trace:
+                if span.cache_hit is not None:
+                    span.args["cache_hit"] = span.cache_hit
+                self.trace_events.append({"name": str(span.name).strip(),
+                                          "cat": span.category,
+                                          "ph": "X",
+                                          "ts": int((span.start - self.start) * 1000000),
+                                          "dur": int(duration * 1000000),
+                                          "pid": os.getpid(),
+                                          "tid": threading.current_thread().ident,
+                                          "args": span.args})
+
+    @staticmethod
+    def _add_call(stats, stats_key, span, duration):
+        # type: (dict, str, ProfilerSpan, float) -> None
+        if stats_key not in stats:
+            stats[stats_key] = {"calls": 0, "time": 0.0, "max_time": 0.0, "cache_hits": 0, "cache_misses": 0}
+        entry = stats[stats_key]
+        entry["calls"] += 1
+        entry["time"] += duration
+        entry["max_time"] = max(entry["max_time"], duration)
+        if span.cache_hit is True:
+            entry["cache_hits"] += 1
+        elif span.cache_hit is False:
+            entry["cache_misses"] += 1
+
+    def _peak_memory_kb(self):
+        # type: () -> int
+        if self._tracemalloc:
+            return self._tracemalloc.get_traced_memory()[1] // 1024
+        try:
+            import resource
+            # Process wide peak RSS, it only grows, thus it's an upper bound of the phase peak
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        except ImportError:
+            return None
+
+    def template(self, name):
+        # type: (str) -> str
+        name = self.BDF_REGEX.sub("<bdf>", str(name).strip())
+        return self.NUMBER_REGEX.sub("#", name)
+
+    def report(self, cache_stats=None):
+        # type: (dict) -> dict
+        return {"total_time": time.time() - self.start,
+                "cache": cache_stats,
+                "peak_mem_source": "tracemalloc" if self._tracemalloc else "maxrss",
+                "phases": self.phases,
+                "data_sources": self.sources,
+                "templates": self.templates,
+                "bdfs": self.bdfs}
+
+    def write_trace(self, file_name):
+        # type: (str) -> None
+        # Chrome trace event format, loadable by chrome://tracing and https://ui.perfetto.dev
+        thread_names = {}
+        for thread in threading.enumerate():
+            thread_names[thread.ident] = thread.name
+        events = []
+        for tid in sorted(set(event["tid"] for event in self.trace_events)):
+            events.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                           "args": {"name": thread_names.get(tid, str(tid))}})
+        events.extend(sorted(self.trace_events, key=lambda event: event["ts"]))
+
+        with open(file_name, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def print_report(self, output_format, cache_stats=None, stream=sys.stderr):
+        # type: (str, dict, object) -> None
+        report = self.report(cache_stats)
+        if output_format == "json":
+            print(json.dumps(report, indent=4, sort_keys=True), file=stream)
+            return
+
+        total_time = report["total_time"]
+        print("\nlshca profile, total time {:.1f}ms".format(total_time * 1000), file=stream)
+
+        print("\n{:<14} {:>10} {:>16}".format("Phase", "Time, ms", "Peak mem, KB"), file=stream)
+        for phase in report["phases"]:
+            print("{:<14} {:>10.1f} {:>16}".format(phase["phase"], phase["time"] * 1000, phase["peak_mem_kb"]),
+                  file=stream)
+        if not self._tracemalloc:
+            print("Peak memory is process max RSS, per phase peak requires Python 3.9+", file=stream)
+
+        for title, stats, limit in (("Data source", report["data_sources"], None),
+                                    ("Command template", report["templates"], self.TOP_TEMPLATES)):
+            width = max([len(title)] + [len(k) for k in stats])
+            print("\n{0:<{w}} {1:>7} {2:>6} {3:>6} {4:>10} {5:>9} {6:>6}".format(
+                title, "Calls", "Hits", "Misses", "Total, ms", "Max, ms", "Share", w=width), file=stream)
+            for key in sorted(stats, key=lambda k: stats[k]["time"], reverse=True)[:limit]:
+                entry = stats[key]
+                print("{0:<{w}} {1:>7} {2:>6} {3:>6} {4:>10.1f} {5:>9.1f} {6:>5.1f}%".format(
+                    key, entry["calls"], entry["cache_hits"], entry["cache_misses"], entry["time"] * 1000,
+                    entry["max_time"] * 1000, 100 * entry["time"] / total_time, w=width), file=stream)
+            if limit and len(stats) > limit:
+                print("... {} more, use -j for full report".format(len(stats) - limit), file=stream)
+
+        if cache_stats:
+            print("\n{:<10} {:>6} {:>7} {:>8} {:>10} {:>14}".format(
+                "Cache", "Hits", "Misses", "Expired", "Evictions", "Invalidations"), file=stream)
+            for cache_class in DataSourceCache.CLASSES:
+                entry = cache_stats[cache_class]
+                print("{:<10} {:>6} {:>7} {:>8} {:>10} {:>14}".format(
+                    cache_class, entry["hits"], entry["misses"], entry["expired"], entry["evictions"],
+                    entry["invalidations"]), file=stream)
+
+        bdfs = report["bdfs"]
+        width = max([len("BDF")] + [len(k) for k in bdfs])
+        print("\n{0:<{w}} {1:>10} {2:>7} {3:>16}".format("BDF", "Time, ms", "Calls", "Data source, ms", w=width),
+              file=stream)
+        for bdf in sorted(bdfs, key=lambda k: bdfs[k]["time"], reverse=True):
+            print("{0:<{w}} {1:>10.1f} {2:>7} {3:>16.1f}".format(
+                bdf, bdfs[bdf]["time"] * 1000, bdfs[bdf]["calls"], bdfs[bdf]["data_source_time"] * 1000, w=width),
+                file=stream)
+
+
+def profile_data_source_call(use_cache_default=False):
+    # Wraps DataSource method in a profiler span named by its first argument (command, path, interface)
+    # Cache hit is a cached call that didn't add misses, nested calls (lspci dictionary) count as one
+    def decorator(method):
+        def wrapper(self, name, *args, **kwargs):
+            if not self.profiler.enabled:
+                return method(self, name, *args, **kwargs)
+
+            with self.profiler.span(method.__name__, name, cmd=str(name)) as span:
+                cache_misses = self.cache.misses
+                output = method(self, name, *args, **kwargs)
+                if kwargs.get("use_cache", use_cache_default):
+                    span.cache_hit = self.cache.misses == cache_misses
+            return output
+        wrapper.__name__ = method.__name__
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+    return decorator
 
 
 class DataSource(object):
+    # Handler of the latest DataSource, replaced by next one. Several DataSources in one process, see collect
+    _log_handler = None
+
     def __init__(self, config):
         # type: (Config) -> None
-        self.cache = {}
         self.config = config
+        self.cache = DataSourceCache(self.config.cache_ttl, self.config.cache_max_entries)
         self.interfaces_struct = []
+        self.profiler = Profiler(self.config.profile, self.config.trace_file is not None)
+        self._umad_clients = None
+        self._ethtool_client = None
 
         self.logging_stream = sys.stderr
+        self.tar = None
+        self.record_file_writer = None
         if self.config.record_data_for_debug is True:
             if not os.path.exists(self.config.record_dir):
                 os.makedirs(self.config.record_dir)
 
-            self.config.record_tar_file = "%s/%s--%s--%s--v%s.tar" % (self.config.record_dir, os.uname()[1], str(self.config.output_view).upper(),
-                                                                  str(time.time()), self.config.ver)
+            self.config.record_file = "%s/%s--%s--%s--v%s.%s" % (self.config.record_dir, os.uname()[1], str(self.config.output_view).upper(),
+                                                               str(time.time()), self.config.ver, self.config.record_format)
 
             print("\nlshca started data recording")
-            print("output saved in " + self.config.record_tar_file + " file\n")
-            self.tar = tarfile.open(name=self.config.record_tar_file, mode='a')
+            print("output saved in " + self.config.record_file + " file\n")
+            if self.config.record_format == "tar":
+                self.tar = tarfile.open(name=self.config.record_file, mode='a')
+            else:
+                self.record_file_writer = RecordFileWriter(self.config.record_file)
 
             self.stdout = StringIO()
             sys.stdout = self.stdout
@@ -2285,19 +4966,25 @@ class DataSource(object):
         log_handler.setLevel(self.config.log_level)
         self.log = logging.getLogger("lshcaLogger")
         self.log.setLevel(self.config.log_level)
+        if DataSource._log_handler is not None:
+            self.log.removeHandler(DataSource._log_handler)
         self.log.addHandler(log_handler)
+        DataSource._log_handler = log_handler
 
     def __del__(self):
         # type: () -> None
+        for umad_client in (self._umad_clients or {}).values():
+            umad_client.close()
+
         if self.config.record_data_for_debug is True:
             sys.stdout = sys.__stdout__
             try:
                 args_str = " ".join(sys.argv[1:])
             except:
                 args_str = ""
-            self.record_data("cmd", "lshca " + args_str)
-            self.record_data("output", self.stdout.getvalue())
-            self.record_data("errors", self.logging_stream.getvalue())
+            self.record_data("", "cmd", "lshca " + args_str)
+            self.record_data("", "output", self.stdout.getvalue())
+            self.record_data("", "errors", self.logging_stream.getvalue())
 
             self.config.record_data_for_debug = False
             environment = list()
@@ -2307,28 +4994,36 @@ class DataSource(object):
             environment.append("Uname:  " + " ".join(self.exec_shell_cmd("uname -a")))
             environment.append("Release:  " + " ".join(self.exec_shell_cmd("cat /etc/*release")))
             environment.append("Env:  " + " ".join(self.exec_shell_cmd("env")))
-            self.record_data("environment", environment)
-            self.record_data("output_fields", self.config.output_order)
+            self.record_data("", "environment", environment)
+            self.record_data("", "output_fields", self.config.output_order)
 
-            self.tar.close()
+            if self.tar:
+                self.tar.close()
+            else:
+                self.record_file_writer.close()
 
 
+    @profile_data_source_call()
     def exec_shell_cmd(self, cmd, use_cache=False, splitlines=True, report_cmd_error=True):
         # type: (str, bool, bool, bool) -> list
         timeout = 10
-        cache_key = self.cmd_to_str(cmd)
 
-        if use_cache is True and cache_key in self.cache:
-            output = self.cache[cache_key]
+        output = self.cache.get("shell.cmd", cmd) if use_cache is True else DataSourceCache.MISS
+        if output is not DataSourceCache.MISS:
             error = ""
         else:
             # using shell timeout, because python subprocess timeout requres Python 3.3+
             cmd_with_timeout = "timeout {} {}".format(timeout, cmd)
+            env = None
+            if self.config.fs_root:
+                env = dict(os.environ)
+                env["PATH"] = self.config.fs_root + "/bin:" + env.get("PATH", "")
             process = subprocess.Popen(cmd_with_timeout,
                                     stdout=subprocess.PIPE,
                                     stderr=subprocess.PIPE,
                                     shell=True,
-                                    executable="/bin/bash")
+                                    executable="/bin/bash",
+                                    env=env)
             output, error = process.communicate()
             if process.returncode == 124:
                 # report_cmd_error not used here because timeout is an issue that should be always reported,
@@ -2344,33 +5039,24 @@ class DataSource(object):
                 output = output.decode('utf8')
 
             if use_cache is True:
-                self.cache.update({cache_key: output})
+                self.cache.set("shell.cmd", cmd, output)
 
         if self.config.record_data_for_debug is True:
-            cmd = "shell.cmd/" + cmd
-            self.record_data(cmd, output, error)
+            self.record_data("shell.cmd/", cmd, output, error)
 
         if splitlines:
             output = output.splitlines()
 
         return output
 
+    @profile_data_source_call(use_cache_default=True)
     def get_bdf_data_from_lspci(self, bdf, use_cache=True):
         # type: (str, bool) -> dict
         cmd = "lspci -vvvDnnd 15b3:"
 
-        lspci_dict_cache_key = self.cmd_to_str(cmd + "lspci_dictionary")
-        if use_cache is True and lspci_dict_cache_key in self.cache:
-            d_output = self.cache[lspci_dict_cache_key]
-        else:
-            lspci_cache_key = self.cmd_to_str(cmd)
-            if use_cache is True and lspci_cache_key in self.cache:
-                data = self.cache[lspci_cache_key]
-            else:
-                data = self.exec_shell_cmd(cmd, use_cache=True, splitlines=False)
-
-                if use_cache is True:
-                    self.cache.update({lspci_cache_key: data})
+        d_output = self.cache.get("lspci", "dictionary") if use_cache is True else DataSourceCache.MISS
+        if d_output is DataSourceCache.MISS:
+            data = self.exec_shell_cmd(cmd, use_cache=True, splitlines=False)
 
             l_output = data.strip().split("\n\n")
 
@@ -2379,16 +5065,24 @@ class DataSource(object):
                 d_output[raw_bdf.split(" ")[0]] = raw_bdf
 
             if use_cache is True:
-                self.cache.update({lspci_dict_cache_key: d_output})
+                self.cache.set("lspci", "dictionary", d_output)
 
         output = d_output.get(bdf, "").splitlines()
         return output
 
-    def record_data(self, cmd, output, error=""):
-        # type: (str, list, str) -> None
-        self.record_data_to_tar(cmd, output)
+    def record_data(self, source, key, output, error=""):
+        # type: (str, str, list, str) -> None
+        # In tar recordings source and key are concatenated to a member name, i.e. shell.cmd/<cmd>
+        self._record_entry(source, key, output)
         if error:
-            self.record_data_to_tar('{}__ERROR'.format(cmd), error)
+            self._record_entry(source, '{}__ERROR'.format(key), error)
+
+    def _record_entry(self, source, key, data):
+        # type: (str, str, object) -> None
+        if self.tar:
+            self.record_data_to_tar(source + key, data)
+        else:
+            self.record_file_writer.add(source, key, data)
 
     def record_data_to_tar(self, file_name, data):
         # type: (str, str) -> None
@@ -2404,19 +5098,24 @@ class DataSource(object):
             tarinfo.mtime = time.time()
             self.tar.addfile(tarinfo, tar_contents)
 
-    def read_file_if_exists(self, file_to_read, record_suffix="", use_cache=False):
-        # type: (str, str, bool) -> str
-        cache_key = self.cmd_to_str(str(file_to_read) + str(record_suffix))
+    @profile_data_source_call()
+    def read_file_if_exists(self, file_to_read, record_suffix="", use_cache=False, report_read_error=True, max_lines=None):
+        # type: (str, str, bool, bool, int) -> str
+        # max_lines - read only this many first lines, the rest of the file isn't read nor recorded
+        cache_key = str(file_to_read) + str(record_suffix)
 
-        if use_cache is True and cache_key in self.cache:
-            output = self.cache[cache_key]
-        else:
-            if os.path.exists(file_to_read):
-                f = open(file_to_read, "r")
+        output = self.cache.get("file", cache_key) if use_cache is True else DataSourceCache.MISS
+        if output is DataSourceCache.MISS:
+            if os.path.exists(self.fs_path(file_to_read)):
+                f = open(self.fs_path(file_to_read), "r")
                 try:
-                    output = f.read()
+                    if max_lines is None:
+                        output = f.read()
+                    else:
+                        output = "".join(itertools.islice(f, max_lines))
                 except (IOError, TypeError) as exception:
-                    print("Driver error: failed to read {}".format(file_to_read), file=sys.stderr)
+                    if report_read_error:
+                        print("Driver error: failed to read {}".format(file_to_read), file=sys.stderr)
                     output = ""
                 except Exception as e:
                     print("\n\nFailed to read file" + str(file_to_read) + "\n\n")
@@ -2426,18 +5125,35 @@ class DataSource(object):
                 output = ""
 
             if use_cache is True:
-                self.cache.update({cache_key: output})
+                self.cache.set("file", cache_key, output)
+
+        if self.config.record_data_for_debug is True:
+            self.record_data("os.path.exists", file_to_read + record_suffix, output)
+
+        return output
+
+    @profile_data_source_call()
+    def read_baseline(self, baseline_file):
+        # type: (str) -> list
+        # lshca -j snapshot of --baseline. It's a file of the running host, fs_root doesn't apply
+        # Recorded, so --diff output can be replayed. Returns None if it can't be read
+        try:
+            with open(baseline_file, "r") as f:
+                output = json.load(f)
+        except (IOError, OSError, ValueError) as exception:
+            self.log.critical("Failed to read baseline {}: {}".format(baseline_file, exception))
+            output = None
 
         if self.config.record_data_for_debug is True:
-            cmd = "os.path.exists" + file_to_read + record_suffix
-            self.record_data(cmd, output)
+            self.record_data("baseline/", baseline_file, output)
 
         return output
 
+    @profile_data_source_call()
     def read_link_if_exists(self, link_to_read):
         # type: (str) -> str
         try:
-            output = os.readlink(link_to_read)
+            output = os.readlink(self.fs_path(link_to_read))
         except OSError as exception:
             # if OSError: [Errno 2] No such file or directory
             if exception.errno == 2:
@@ -2446,15 +5162,15 @@ class DataSource(object):
                 raise exception
 
         if self.config.record_data_for_debug is True:
-            cmd = "os.readlink" + link_to_read
-            self.record_data(cmd, output)
+            self.record_data("os.readlink", link_to_read, output)
 
         return output
 
+    @profile_data_source_call()
     def list_dir_if_exists(self, dir_to_list):
         # type: (str) -> str
         try:
-            output = os.listdir(dir_to_list)
+            output = os.listdir(self.fs_path(dir_to_list))
             output = " ".join(output)
         except OSError as exception:
             # if OSError: [Errno 2] No such file or directory
@@ -2464,74 +5180,238 @@ class DataSource(object):
                 raise exception
 
         if self.config.record_data_for_debug is True:
-            cmd = "os.listdir" + dir_to_list.rstrip('/') + "_dir"
-            self.record_data(cmd, output)
+            self.record_data("os.listdir", dir_to_list.rstrip('/') + "_dir", output)
 
         return output
 
+    @profile_data_source_call()
     def exec_python_code(self, python_code, record_suffix="", use_cache=False):
         # type: (str, str, bool) -> str
-        cache_key = self.cmd_to_str(str(python_code) + str(record_suffix))
+        cache_key = str(python_code) + str(record_suffix)
 
-        if use_cache is True and cache_key in self.cache:
-            output = self.cache[cache_key]
-        else:
+        output = self.cache.get("python", cache_key) if use_cache is True else DataSourceCache.MISS
+        if output is DataSourceCache.MISS:
             output = eval(python_code)
 
             if use_cache is True:
-                self.cache.update({cache_key: output})
+                self.cache.set("python", cache_key, output)
 
         if self.config.record_data_for_debug is True:
-            cmd = "os.python.code/" + hashlib.md5(python_code.encode('utf-8')).hexdigest() + record_suffix
-            self.record_data(cmd, output)
+            self.record_data("os.python.code/", hashlib.md5(python_code.encode('utf-8')).hexdigest() + record_suffix, output)
 
         return output
 
-    def get_raw_socket_data(self, interface, ether_proto, capture_timeout, use_cache=True):
-        # type: (str, int, int, bool) -> str
-        cache_key = self.cmd_to_str(str(interface) + str(ether_proto))
+    @profile_data_source_call()
+    def read_counters(self, counters_dirs, record_suffix=""):
+        # type: (list, str) -> dict
+        # Bulk read of counters and hw_counters of all ports in one pass
+        # Returns {counters dir: {"counters": {counter: value}, "hw_counters": {counter: value}}}
+        output = {}
+        for counters_dir in counters_dirs:
+            output[counters_dir] = {}
+            for counter_set in ("counters", "hw_counters"):
+                counter_set_path = self.fs_path(counters_dir + "/" + counter_set)
+                values = {}
+                try:
+                    counters = os.listdir(counter_set_path)
+                except OSError:
+                    counters = []
+                for counter in counters:
+                    try:
+                        with open(os.path.join(counter_set_path, counter), "r") as f:
+                            values[counter] = int(f.read())
+                    except (IOError, OSError, ValueError):
+                        # Counters not supported by the port fail on read
+                        continue
+                output[counters_dir][counter_set] = values
 
-        if use_cache is True and cache_key in self.cache:
-            output = self.cache[cache_key]
-        else:
-            try:
-                raw_socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ether_proto))
-            except socket.error as e:
-                    print('Socket could not be created. {}'.format(e))
-                    sys.exit()
+        if self.config.record_data_for_debug is True:
+            for counters_dir in counters_dirs:
+                self.record_data("counters/", counters_dir + record_suffix, output[counters_dir])
 
+        return output
+
+    @profile_data_source_call()
+    def exec_mad_queries(self, rdma, port, queries):
+        # type: (str, str, list) -> dict
+        # Sends SMP/SA queries of UmadClient over the port umad device
+        # Returns {query: parsed response or None}, or None if MADs can't be sent, i.e. no umad device or permissions
+        output = None
+        umad_client = self.get_umad_client(rdma, port)
+        if umad_client:
             try:
-                raw_socket.bind((interface, ether_proto))
-                self.interfaces_struct.append({"interface":interface, "socket": raw_socket})
-                self._set_interface_promisc_status(interface, raw_socket, True)
-            except Exception as e:
-                print("Tried connecting interface '{}'".format(interface))
-                raise e
+                output = umad_client.query(queries)
+            except (IOError, OSError) as exception:
+                self.log.info("MAD queries over {} failed, falling back to smpquery/saquery. {}".format(
+                    umad_client.umad_path, exception))
+                umad_client.close()
+
+        if self.config.record_data_for_debug is True:
+            self.record_data("umad/", "{}/{}/{}".format(rdma, port, ";".join("{}:{}".format(*query) for query in queries)),
+                             output)
+
+        return output
+
+    @profile_data_source_call()
+    def get_dcb_data(self, interfaces, use_cache=True):
+        # type: (list, bool) -> dict
+        # DCB configuration by rtnetlink, see DcbNetlinkClient
+        # Returns {interface: DCB data}. None if interface has no DCB support or netlink isn't available
+        output = {}
+        to_query = []
+        for interface in interfaces:
+            output[interface] = self.cache.get("dcb", interface) if use_cache is True else DataSourceCache.MISS
+            if output[interface] is DataSourceCache.MISS:
+                to_query.append(interface)
+
+        if to_query:
+            queried = {}
+            # netlink would query the running host, not the one under fs_root
+            if not self.config.fs_root:
+                try:
+                    queried = DcbNetlinkClient().query(to_query)
+                except (socket.error, OSError) as exception:
+                    self.log.info("DCB netlink query failed, falling back to mlnx_qos. {}".format(exception))
+            for interface in to_query:
+                output[interface] = queried.get(interface)
+                if use_cache is True:
+                    self.cache.set("dcb", interface, output[interface])
 
-            signal.signal(signal.SIGINT, self.signal_recieved)
-            signal.signal(signal.SIGALRM, self.signal_recieved)
-            signal.alarm(capture_timeout)
+        if self.config.record_data_for_debug is True:
+            for interface in interfaces:
+                self.record_data("dcb.netlink/", interface, output[interface])
+
+        return output
 
+    @profile_data_source_call()
+    def get_ethtool_stats(self, interfaces, record_suffix=""):
+        # type: (list, str) -> dict
+        # Driver statistics by ethtool ioctl, see EthtoolClient. Not cached, the values are sampled
+        # Returns {interface: {statistic: value}}. None if interface has no driver statistics
+        output = dict((interface, None) for interface in interfaces)
+        # ioctl would query the running host, not the one under fs_root
+        if not self.config.fs_root:
+            if self._ethtool_client is None:
+                self._ethtool_client = EthtoolClient()
             try:
-                output = raw_socket.recvfrom(65565)
-            except TimeoutError:
-                output = "TimeoutError"
+                output = self._ethtool_client.query(interfaces)
+            except (socket.error, OSError) as exception:
+                self.log.info("ethtool statistics query failed. {}".format(exception))
+
+        if self.config.record_data_for_debug is True:
+            for interface in interfaces:
+                self.record_data("ethtool.stats/", interface + record_suffix, output[interface])
+
+        return output
+
+    @profile_data_source_call()
+    def get_rdma_netlink_data(self, client="nldev", use_cache=True):
+        # type: (str, bool) -> dict
+        # RDMA devices and ports read over RDMA netlink, see RdmaNetlinkClient
+        # Returns None if RDMA netlink isn't available, sysfs is used then
+        output = self.cache.get("rdma.netlink", client) if use_cache is True else DataSourceCache.MISS
+        if output is DataSourceCache.MISS:
+            output = None
+            # netlink would query the running host, not the one under fs_root
+            if not self.config.fs_root:
+                try:
+                    output = RdmaNetlinkClient().query()
+                except (socket.error, OSError, struct.error) as exception:
+                    self.log.info("RDMA netlink query failed, falling back to sysfs. {}".format(exception))
+            if use_cache is True:
+                self.cache.set("rdma.netlink", client, output)
+
+        if self.config.record_data_for_debug is True:
+            self.record_data("rdma.netlink/", client, output)
+
+        return output
+
+    @profile_data_source_call()
+    def get_ovsdb_ports(self, socket_path, use_cache=True):
+        # type: (str, bool) -> dict
+        # OVS port index read from ovsdb-server, see OvsdbClient
+        # Returns None if ovsdb-server isn't accessible
+        output = self.cache.get("ovsdb", socket_path) if use_cache is True else DataSourceCache.MISS
+        if output is DataSourceCache.MISS:
+            output = None
+            if os.path.exists(self.fs_path(socket_path)):
+                try:
+                    output = OvsdbClient(self.fs_path(socket_path)).get_ports_index()
+                except (socket.error, OSError, ValueError, KeyError, IndexError, TypeError) as exception:
+                    self.log.info("ovsdb-server query failed, falling back to ovs-vsctl. {}".format(exception))
+            if use_cache is True:
+                self.cache.set("ovsdb", socket_path, output)
 
-            signal.alarm(0)
-            self._set_interface_promisc_status(interface, raw_socket, False)
-            self.interfaces_struct.remove({"interface":interface, "socket": raw_socket})
-            signal.signal(signal.SIGINT, signal.SIG_DFL)
-            signal.signal(signal.SIGALRM, signal.SIG_DFL)
+        if self.config.record_data_for_debug is True:
+            self.record_data("ovsdb/", socket_path, output)
+
+        return output
+
+    def get_umad_client(self, rdma, port):
+        # type: (str, str) -> UmadClient
+        # umad devices are indexed once, on first use
+        if self._umad_clients is None:
+            self._umad_clients = {}
+            for umad in self.list_dir_if_exists("/sys/class/infiniband_mad/").split():
+                if not re.match(r"^umad\d+$", umad):
+                    continue
+                ibdev = self.read_file_if_exists("/sys/class/infiniband_mad/" + umad + "/ibdev").strip()
+                umad_port = self.read_file_if_exists("/sys/class/infiniband_mad/" + umad + "/port").strip()
+                self._umad_clients[(ibdev, umad_port)] = UmadClient(self.fs_path("/dev/infiniband/" + umad))
+        return self._umad_clients.get((rdma, str(port)))
+
+    @profile_data_source_call(use_cache_default=True)
+    def get_raw_socket_data(self, interface, ether_proto, capture_timeout, use_cache=True):
+        # type: (str, int, int, bool) -> str
+        cache_key = (interface, ether_proto)
+
+        output = self.cache.get("raw.socket", cache_key) if use_cache is True else DataSourceCache.MISS
+        if output is DataSourceCache.MISS:
+            output = ""
+            # capture would sniff the running host, not the one under fs_root
+            if not self.config.fs_root:
+                output = self._capture_raw_socket(interface, ether_proto, capture_timeout)
 
             if use_cache is True:
-                self.cache.update({cache_key: output})
+                self.cache.set("raw.socket", cache_key, output)
 
         if self.config.record_data_for_debug is True:
-            cmd = "raw.socket.data/" + cache_key
-            self.record_data(cmd, output)
+            self.record_data("raw.socket.data/", self.cmd_to_str(str(interface) + str(ether_proto)), output)
 
         return output
 
+    def _capture_raw_socket(self, interface, ether_proto, capture_timeout):
+        # type: (str, int, int) -> object
+        try:
+            raw_socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ether_proto))
+        except socket.error as e:
+                print('Socket could not be created. {}'.format(e))
+                sys.exit()
+
+        try:
+            raw_socket.bind((interface, ether_proto))
+            self.interfaces_struct.append({"interface":interface, "socket": raw_socket})
+            self._set_interface_promisc_status(interface, raw_socket, True)
+        except Exception as e:
+            print("Tried connecting interface '{}'".format(interface))
+            raise e
+
+        signal.signal(signal.SIGINT, self.signal_recieved)
+        signal.signal(signal.SIGALRM, self.signal_recieved)
+        signal.alarm(capture_timeout)
+
+        try:
+            output = raw_socket.recvfrom(65565)
+        except TimeoutError:
+            output = "TimeoutError"
+
+        signal.alarm(0)
+        self._set_interface_promisc_status(interface, raw_socket, False)
+        self.interfaces_struct.remove({"interface":interface, "socket": raw_socket})
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGALRM, signal.SIG_DFL)
+        return output
+
     def signal_recieved(self, signal_number, stack_frame):
         interfaces_affected = ""
         for int_str in self.interfaces_struct:
@@ -2561,9 +5441,17 @@ class DataSource(object):
             ifr.ifr_flags &= ~IFF_PROMISC # Remove promisc flag
         fcntl.ioctl(raw_socket.fileno(), SIOCSIFFLAGS, ifr) # S for Set
 
+    def fs_path(self, path):
+        # type: (str) -> str
+        # Paths used across lshca are host paths, this maps them in to the configured filesystem root
+        if self.config.fs_root:
+            return self.config.fs_root + path
+        return path
+
     @staticmethod
     def cmd_to_str(cmd):
         # type: (str) -> str
+        # Used only for names of recorded raw socket data, kept for compatibility with existing recordings
         output = re.escape(cmd)
         return output
 
@@ -2589,6 +5477,18 @@ def extract_string_by_regex(data_string, regex, na_string="=N/A="):
     return search_result
 
 
+def is_bdf(device):
+    # type: (str) -> bool
+    return re.match(r"^([0-9a-fA-F]{4}:)?[0-9a-fA-F]{2}:[0-9a-fA-F]{2}\.[0-9a-fA-F]$", device) is not None
+
+def normalise_mft_device(mft_device):
+    # type: (str) -> str
+    # all of MST devices (PCI functions) on single HCA point to the same configuration source
+    # this will reduce execution time
+    if is_bdf(mft_device):
+        return re.sub(r'\.[0-9a-fA-F]$', '.0', mft_device)
+    return re.sub(r'(.*)\.[0-9]', r'\1', mft_device)
+
 def find_in_list(list_to_search_in, regex_pattern, return_only_first_group=True):
     # type: (list, re.Pattern, bool) -> str
     regex = re.compile(regex_pattern)
@@ -2608,6 +5508,20 @@ def search_in_list_and_extract_by_regex(data_list, search_regex, output_regex):
     regex_search_result = extract_string_by_regex(list_search_result, output_regex)
     return str(regex_search_result).strip()
 
+def aggregate_queue_stats(stats):
+    # type: (dict) -> dict
+    # Per queue driver statistics, i.e. mlx5 rx3_packets or virtio_net rx_queue_3_packets, are summed
+    # in to rx_queues_packets. Other statistics are kept as is
+    output = {}
+    for stat, value in stats.items():
+        match = re.match(r"^(rx|tx|ch)(\d+)_(.+)$", stat) or re.match(r"^(rx|tx)_queue_(\d+)_(.+)$", stat)
+        if match:
+            stat = match.group(1) + "_queues_" + match.group(3)
+            value += output.get(stat, 0)
+        output[stat] = value
+    return output
+
+
 def humanize_number(num, precision=1):
     # type: (int, int) -> str
     abbrevs = (
@@ -2641,20 +5555,230 @@ def remove_duplicates(orig_list):
 
     return resulting_list
 
+def iterate_snapshot_files(paths):
+    # type: (list) -> str
+    # Directories are walked lazily, so list of files isn't held in memory
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, dir_names, file_names in os.walk(path):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    yield os.path.join(dir_path, file_name)
+        else:
+            yield path
+
+
+def aggregate_snapshot_file(task):
+    # type: (tuple) -> tuple
+    # Worker of --aggregate process pool. Returns (partial FleetAggregate, error message)
+    path, config, fields = task
+    aggregate = FleetAggregate(config.aggregate_group_by, fields, config.aggregate_max_distinct)
+    # where filters were validated by the parent process, data source isn't used
+    out = Output(config, None)
+    node = os.path.basename(path)
+    try:
+        with open(path, "r") as f:
+            if re.search(r"\.(ndjson|jsonl)$", path):
+                # lines are parsed one by one, file size doesn't matter
+                for line_number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    snapshot = json.loads(line)
+                    if isinstance(snapshot, dict):
+                        line_node, hcas = str(snapshot.get("node", "")), snapshot.get("hcas", [])
+                    else:
+                        line_node, hcas = "", snapshot
+                    out.output = hcas
+                    line_node = line_node or "{}:{}".format(node, line_number)
+                    for hca in hcas:
+                        hca["Node"] = line_node
+                    out.apply_where_output_filters()
+                    aggregate.add_node(line_node, out.output)
+            else:
+                node = re.sub(r"\.json$", "", node)
+                out.output = json.load(f)
+                for hca in out.output:
+                    hca["Node"] = node
+                out.apply_where_output_filters()
+                aggregate.add_node(node, out.output)
+    except (IOError, OSError, ValueError, TypeError, AttributeError) as exception:
+        return aggregate, "Failed to aggregate {}: {}".format(path, exception)
+
+    return aggregate, None
+
+
+def aggregate_snapshots(config, data_source):
+    # type: (Config, DataSource) -> None
+    if config.output_fields_filter_positive:
+        fields = list(config.output_fields_filter_positive)
+    else:
+        fields = [field for field in config.output_order if field != "Dev" and
+                  field not in config.output_fields_filter_negative]
+
+    # invalid where filter exits here, before workers start
+    Output(config, data_source).apply_where_output_filters()
+
+    aggregate = FleetAggregate(config.aggregate_group_by, fields, config.aggregate_max_distinct)
+    tasks = ((path, config, fields) for path in iterate_snapshot_files(config.aggregate_paths))
+    pool = None
+    if config.aggregate_workers == 1:
+        results = (aggregate_snapshot_file(task) for task in tasks)
+    else:
+        pool = multiprocessing.Pool(processes=config.aggregate_workers or None)
+        # partial aggregates are merged as they come, memory doesn't grow with number of files
+        results = pool.imap_unordered(aggregate_snapshot_file, tasks, chunksize=16)
+    try:
+        for partial_aggregate, error in results:
+            if error:
+                data_source.log.error(error)
+            aggregate.merge(partial_aggregate)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    out = Output(config, data_source)
+    out.output = aggregate.output_info(config.output_format)
+    out.output_order = aggregate.group_by + FleetAggregate.SUMMARY_FIELDS
+    if config.output_format == "json":
+        out.print_output_json()
+        return
+
+    out.update_separator_and_column_width()
+    if out.separator_len == 0:
+        print("No HCAs to display")
+        sys.exit(0)
+    out.print_output_human_readable()
+
+
+def query_daemon(config, data_source):
+    # type: (Config, DataSource) -> list
+    # Returns output info served by lshca daemon, None if there is no daemon or it can't serve. See LshcaDaemon
+    # config.output_order is set to the daemon's one, fields added during collection are shown as by direct run
+    if config.output_view in LshcaDaemon.NOT_SERVED_VIEWS or not os.path.exists(config.daemon_socket):
+        return None
+
+    request = {"view": config.output_view, "show_warnings": config.show_warnings_and_errors}
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(config.daemon_timeout)
+        sock.connect(config.daemon_socket)
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        response = b""
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            response += data
+        response = json.loads(response.decode("utf-8"))
+    except (socket.error, ValueError) as exception:
+        data_source.log.info("lshca daemon query failed, collecting directly. {}".format(exception))
+        return None
+    finally:
+        sock.close()
+
+    if "error" in response:
+        data_source.log.info("lshca daemon query failed, collecting directly. {}".format(response["error"]))
+        return None
+    config.output_order = response.get("output_order", config.output_order)
+    return response.get("hcas")
+
+
+def collect(view="system", fields=None, where=None, data_source=None, fs_root=""):
+    # type: (str, list, list, DataSource, str) -> list
+    """
+    Library API, collects HCAs info in-process. Nothing is printed and sys.exit isn't called.
+        view        - output view name, same as -w. i.e. "system", "roce", "all"
+        fields      - field names to return, same as -o. Default: fields of the view
+        where       - list of "field=regex" filters, same as -ow
+        data_source - DataSource to reuse, its cache persists between calls. Created per call by default:
+                          data_source = lshca.DataSource(lshca.Config())
+                          lshca.collect("ib", data_source=data_source)
+        fs_root     - same as --fs-root, used only when data_source isn't given
+    Returns same records as lshca -j: list of HCA dicts, each with "bdf_devices" list of BDF dicts
+    Raises ValueError on unknown view or illegal where filter
+    Some fields require root privileges, they are empty otherwise.
+    """
+    config = Config()
+    if view != "all" and view not in config.output_order_general:
+        raise ValueError("Unknown view '{}'".format(view))
+    config.parse_arguments(["-w", view, "-j"])
+    config.fs_root = data_source.config.fs_root if data_source else fs_root.rstrip("/")
+    if fields:
+        config.output_fields_filter_positive = remove_duplicates(list(fields))
+    if where:
+        config.where_output_filter = list(config.where_output_filter) + list(where)
+
+    if data_source is None:
+        data_source = DataSource(config)
+    else:
+        # Reused DataSource keeps its own config, data cached by previous calls is refreshed by its TTL
+        data_source.cache.expire()
+
+    out = Output(config, data_source)
+    # illegal filter raises here, before data collection
+    out.compile_where_output_filters()
+
+    hca_manager = HCAManager(data_source, config)
+    with data_source.profiler.phase("get_data"):
+        hca_manager.get_data()
+    out.output = hca_manager.output_info()
+    out.apply_where_output_filters()
+    out.apply_select_output_filters()
+
+    output = []
+    for hca in out.output:
+        hca_output = dict((key, value) for key, value in hca.items() if key in out.output_order)
+        hca_output["bdf_devices"] = [dict((key, value) for key, value in bdf_device.items() if key in out.output_order)
+                                     for bdf_device in hca["bdf_devices"]]
+        output.append(hca_output)
+    return output
+
+
 def main():
     config = Config()
     config.parse_arguments(sys.argv[1:])
 
     data_source = DataSource(config)
 
-    if os.geteuid() != 0:
+    # Fleet aggregation works on snapshots, local HCAs aren't listed
+    if config.aggregate_paths:
+        aggregate_snapshots(config, data_source)
+        return
+
+    # Running daemon answers in milliseconds, it doesn't require root privileges from its clients. Opt-in, as it
+    # serves data collected earlier by root
+    if config.daemon_client:
+        hcas = query_daemon(config, data_source)
+        if hcas is not None:
+            out = Output(config, data_source)
+            for output_info in hcas:
+                out.append(output_info)
+            out.print_output()
+            return
+
+    # Reading a fake tree under --fs-root doesn't need root, daemon serves other users and does
+    if os.geteuid() != 0 and (not config.fs_root or config.daemon):
         data_source.log.critical("You need to have root privileges to run this script")
         sys.exit(1)
 
+    if config.daemon:
+        signal.signal(signal.SIGTERM, lambda signal_number, stack_frame: sys.exit(0))
+        LshcaDaemon(config, data_source).serve_forever()
+        return
+
     hca_manager = HCAManager(data_source, config)
-    hca_manager.get_data()
+    with data_source.profiler.phase("get_data"):
+        hca_manager.get_data()
 
-    hca_manager.display_hcas_info()
+    try:
+        hca_manager.display_hcas_info()
+    finally:
+        # Report is printed also when nothing to display, display_hcas_info exits in that case
+        if config.profile:
+            data_source.profiler.print_report(config.output_format, data_source.cache.stats)
+        if config.trace_file:
+            data_source.profiler.write_trace(config.trace_file)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+# Phase level benchmark of lshca, driven by recorded data
+# Every recorded data file is replayed through HCAManager.get_data and the Output pipeline for each view.
+# Phases are timed by the profiler phases of lshca itself, medians are compared against a saved JSON baseline.
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import sys
+import textwrap
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from lshca_regression import REC_DATA_DIR_PATH, SYNTHETIC_REC_DATA_DIR_PATH, BColors, DataSourceReplay, \
+    RecordedDataIndex, RegressionConfig, get_recorded_data_files_list, get_recorded_lshca_version
+
+import lshca
+
+VIEWS = ['system', 'ib', 'roce', 'cable', 'traffic', 'lldp', 'dpu', 'sf', 'counters', 'ethstats', 'all']
+PHASES = ['get_data', 'output_info', 'filter', 'width', 'render', 'json']
+
+
+class PhaseProfiler(lshca.Profiler):
+    """
+    Profiler that times pipeline phases only.
+    Spans of DataSource calls and tracemalloc of --profile would add their own overhead to the measured phases.
+    """
+    def __init__(self):
+        super(PhaseProfiler, self).__init__()
+        self.enabled = True
+
+    def span(self, category, name, **args):
+        # type: (str, str, dict) -> lshca.ProfilerSpan
+        if category != "phase":
+            return self._null_span
+        return lshca.ProfilerSpan(self, category, name, args)
+
+
+def median(values):
+    # type: (list) -> float
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def run_iteration(recorded_data, recorded_lshca_version, view):
+    # type: (RecordedDataIndex, str, str) -> dict
+    timings = {}
+
+    lshca.MSTDevice.mst_tool_missing = False
+    lshca.MSTDevice.mst_service_initialized = False
+    lshca.MSTDevice.mst_service_should_be_stopped = False
+
+    config = RegressionConfig()
+    # Views other than the recorded one read data that was never recorded
+    config.skip_missing = True
+    config.recorded_lshca_version = recorded_lshca_version
+    config.parse_arguments(["-w", view])
+    data_source = DataSourceReplay(config, recorded_data)
+    data_source.profiler = PhaseProfiler()
+
+    # Same pipeline as lshca main, the phases are timed by the Output and HCAManager methods themselves
+    hca_manager = lshca.HCAManager(data_source, config)
+    with data_source.profiler.phase("get_data"):
+        hca_manager.get_data()
+    for output_format in ("human_readable", "json"):
+        config.output_format = output_format
+        try:
+            hca_manager.display_hcas_info()
+        except SystemExit:
+            # Nothing to display, render phase is skipped
+            pass
+
+    for phase in data_source.profiler.phases:
+        # filter and output_info of the JSON pass repeat the human readable ones
+        if phase["phase"] not in timings:
+            timings[phase["phase"]] = phase["time"]
+    return timings
+
+
+def benchmark_recorded_data(recorded_data_dir, recorded_data_file, views, iterations):
+    # type: (str, str, list, int) -> dict
+    recorded_data = RecordedDataIndex(os.path.join(recorded_data_dir, recorded_data_file))
+    recorded_lshca_version = get_recorded_lshca_version(recorded_data)
+
+    results = {}
+    for view in views:
+        phase_samples = dict((phase, []) for phase in PHASES)
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+        try:
+            # first iteration warms up decoded entries LRU and isn't measured
+            for i in range(iterations + 1):
+                timings = run_iteration(recorded_data, recorded_lshca_version, view)
+                if i == 0:
+                    continue
+                for phase in PHASES:
+                    phase_samples[phase].append(timings.get(phase, 0.0))
+        except (Exception, SystemExit) as e:
+            results[view] = {"error": str(e)}
+            continue
+        finally:
+            sys.stdout = sys.__stdout__
+            sys.stderr = sys.__stderr__
+
+        results[view] = dict((phase, median(phase_samples[phase])) for phase in PHASES)
+
+    recorded_data.close()
+    return results
+
+
+def compare_to_baseline(results, baseline, threshold, min_time):
+    # type: (dict, dict, float, float) -> list
+    regressions = []
+    for recorded_data_file in results:
+        for view in results[recorded_data_file]:
+            current = results[recorded_data_file][view]
+            previous = baseline.get(recorded_data_file, {}).get(view)
+            if "error" in current or not previous or "error" in previous:
+                continue
+            for phase in PHASES:
+                if phase not in previous:
+                    continue
+                # Phases faster than min_time are dominated by timer noise
+                if current[phase] < min_time:
+                    continue
+                if current[phase] > previous[phase] * (1 + threshold):
+                    regressions.append((recorded_data_file, view, phase, previous[phase], current[phase]))
+    return regressions
+
+
+def print_results(results, regressions):
+    # type: (dict, list) -> None
+    regressed = set((r[0], r[1], r[2]) for r in regressions)
+    header = "{0:<8}".format("View") + "".join(["{0:>12}".format(phase) for phase in PHASES])
+    for recorded_data_file in sorted(results):
+        print(BColors.BOLD + recorded_data_file + BColors.ENDC + "   (median, ms)")
+        print(header)
+        print('-' * len(header))
+        for view in [v for v in VIEWS if v in results[recorded_data_file]]:
+            view_results = results[recorded_data_file][view]
+            if "error" in view_results:
+                print("{0:<8}".format(view) + BColors.FAIL + " Failed: " + view_results["error"] + BColors.ENDC)
+                continue
+            line = "{0:<8}".format(view)
+            for phase in PHASES:
+                field = "{0:>12.3f}".format(view_results[phase] * 1000)
+                if (recorded_data_file, view, phase) in regressed:
+                    field = BColors.FAIL + field + BColors.ENDC
+                line += field
+            print(line)
+        print("")
+
+    for recorded_data_file, view, phase, previous, current in regressions:
+        print(BColors.FAIL + "Regression: " + BColors.ENDC + "{} view {} phase {}: {:.3f}ms -> {:.3f}ms".format(
+            recorded_data_file, view, phase, previous * 1000, current * 1000))
+
+
+def benchmark():
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-w', dest="views", nargs="+", choices=VIEWS, default=VIEWS,
+                        help="views to benchmark (default: all of them)")
+    parser.add_argument('-n', dest="iterations", type=int, default=20,
+                        help="number of measured iterations per view (default: %(default)s)")
+    parser.add_argument('--data-source', nargs="+", help="Select single data souce from recorded_data directory")
+    parser.add_argument('--save-baseline', metavar="FILE", help="save results as JSON baseline")
+    parser.add_argument('--baseline', metavar="FILE", help="compare results to JSON baseline and fail on regression")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help=textwrap.dedent('''\
+                                allowed slowdown of a phase median relative to baseline (default: %(default)s, i.e. 25%%)
+                                '''))
+    parser.add_argument('--min-time', type=float, default=0.0005,
+                        help="ignore phases with median below this time in seconds (default: %(default)s)")
+
+    # comes to handle comma separated list of choices
+    cust_user_args = []
+    for arg in sys.argv[1:]:
+        result = arg.split(",")
+        for member in result:
+            cust_user_args.append(member)
+    args = parser.parse_args(cust_user_args)
+
+    results = {}
+    for recorded_data_dir in (REC_DATA_DIR_PATH, SYNTHETIC_REC_DATA_DIR_PATH):
+        for recorded_data_file in get_recorded_data_files_list(recorded_data_dir, args.data_source):
+            results[recorded_data_file] = benchmark_recorded_data(recorded_data_dir, recorded_data_file, args.views,
+                                                                  args.iterations)
+    if not results:
+        print("WARNING: no recorded data to benchmark")
+        sys.exit(0)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline.get("results", {}), args.threshold, args.min_time)
+
+    print_results(results, regressions)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"python": platform.python_version(),
+                       "iterations": args.iterations,
+                       "results": results}, f, indent=4, sort_keys=True)
+        print("Baseline saved in " + args.save_baseline)
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    benchmark()
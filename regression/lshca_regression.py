@@ -5,55 +5,150 @@ from __future__ import print_function
 import argparse
 import difflib
 import hashlib
+import multiprocessing
 import os
 import pickle
 import re
-import shutil
 import sys
 import tarfile
-import tempfile
 import textwrap
+import time
 import traceback
-from io import StringIO
+from collections import OrderedDict
+try:
+    from StringIO import StringIO # for Python 2, accepts str lshca prints and logs
+except ImportError:
+    from io import StringIO # for Python 3
 
 from packaging import version
 
+RECORDED_DATA_SUFFIXES = ('.tar', '.lshrec')
+
 regr_home = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(regr_home + '/../')
 
+REC_DATA_DIR_PATH = regr_home + "/../recorded_data/"
+# Recordings of synthetic hosts made by lshca_synthetic_host.py, they cover data sources added after the recordings
+# of REC_DATA_DIR_PATH were made. Run together with them
+SYNTHETIC_REC_DATA_DIR_PATH = regr_home + "/synthetic_recorded_data/"
+
 import lshca
 
 
-class DataSourceRecorded(lshca.DataSource):
+class RecordedDataIndex(object):
+    """
+    In memory index of a recorded data file, both tar and lshrec formats.
+    Index maps entry name (<source><key>, same as tar member name) to its location in the file.
+    Entries are unpickled on first access only, decoded entries are kept in LRU cache.
+    """
+    def __init__(self, recorded_data_file, lru_size=4096):
+        self.file_name = recorded_data_file
+        self._lru_size = lru_size
+        self._lru = OrderedDict()
+        self._tar_file = None
+        self._tar_offsets = {}
+        self._record_reader = None
+        self._record_keys = {}
+
+        if lshca.RecordFileReader.is_record_file(recorded_data_file):
+            self._record_reader = lshca.RecordFileReader(recorded_data_file)
+            for source, key in self._record_reader.keys():
+                self._record_keys[source + key] = (source, key)
+        else:
+            tar = tarfile.open(recorded_data_file)
+            for member in tar.getmembers():
+                if member.isfile():
+                    # Last member wins, same as tar extraction
+                    self._tar_offsets[member.name] = (member.offset_data, member.size)
+            tar.close()
+            self._tar_file = open(recorded_data_file, "rb")
+
+    def __contains__(self, name):
+        return name in self._tar_offsets or name in self._record_keys
+
+    def load(self, name):
+        # raises KeyError if name wasn't recorded
+        if name in self._lru:
+            data = self._lru.pop(name)
+            self._lru[name] = data
+            return data
+
+        if self._record_reader:
+            source, key = self._record_keys[name]
+            data = pickle.loads(self._record_reader.read_raw(source, key))
+        else:
+            offset, size = self._tar_offsets[name]
+            self._tar_file.seek(offset)
+            data = pickle.loads(self._tar_file.read(size))
+
+        self._lru[name] = data
+        if len(self._lru) > self._lru_size:
+            self._lru.popitem(last=False)
+        return data
+
+    def close(self):
+        if self._record_reader:
+            self._record_reader.close()
+        else:
+            self._tar_file.close()
+
+
+class DataSourceReplay(lshca.DataSource):
+    def __init__(self, config, recorded_data):
+        # type: (RegressionConfig, RecordedDataIndex) -> None
+        self.recorded_data = recorded_data
+        self.unrecorded_as_missing = version.parse(config.recorded_lshca_version) < \
+            version.parse(self.UNRECORDED_AS_MISSING_BEFORE)
+        self._replay_clock = 0.0
+        super(DataSourceReplay, self).__init__(config)
+
+    # Data read by native paths added in UNRECORDED_AS_MISSING_BEFORE version. Recordings of older versions don't
+    # have it, there it's replayed as missing, then lshca falls back to the commands those recordings have.
+    # Recordings of newer versions have to have it, missing one fails the replay
+    UNRECORDED_AS_MISSING_BEFORE = "3.10.dev0"
+    UNRECORDED_AS_MISSING = {
+        "os.path.exists": [re.compile(r"^/sys/bus/pci/devices/[^/]+/hwmon/"),
+                           re.compile(r"^/sys/module/mlx5_core/"),
+                           re.compile(r"^/usr/bin/ofed_info$"),
+                           re.compile(r"^/sys/class/net/[^/]+/qos/trust$"),
+                           re.compile(r"^/sys/bus/pci/devices/.+/net/[^/]+/phys_port_name$"),
+                           re.compile(r"^/sys/bus/pci/devices/[^/]+/mlx5_core\.sf\.[0-9]+/net/[^/]+/address$"),
+                           re.compile(r"^/proc/net/bonding/")],
+        "os.listdir": [re.compile(r"^/sys/bus/pci/devices/[^/]+/hwmon_dir$"),
+                       re.compile(r"^/sys/bus/auxiliary/devices_dir$")],
+    }
+
     def read_cmd_output_from_file(self, cmd_prefix, cmd):
-        output_file_to_read = self.config.record_dir + cmd_prefix + cmd
-        try:
-            f = open(output_file_to_read, "rb")
-            output = pickle.load(f)
+        name = cmd_prefix + cmd
+        if name in self.recorded_data:
+            output = self.recorded_data.load(name)
             error = ""
-            if os.path.exists('{}__ERROR'.format(output_file_to_read)):
-                f = open('{}__ERROR'.format(output_file_to_read), "rb")
-                error = pickle.load(f)
-        except IOError:
-            if cmd and 'lspci -vvvDnn -s' in cmd:
-                altered_cmd = cmd.replace('lspci -vvvDnn -s', 'lspci -vvvD -s')
-                output, error = self.read_cmd_output_from_file(cmd_prefix, altered_cmd)
-            elif cmd and 'lspci -vvvDnnd 15b3:' in cmd:
-                # Used to identify mellanox bdfs in version < 3.9
-                altered_cmd = cmd.replace('lspci -vvvDnnd 15b3:', 'lspci -Dd 15b3:')
-                output, error = self.read_cmd_output_from_file(cmd_prefix, altered_cmd)
-            elif self.config.skip_missing:
-                output = ""
-                error = ""
-            else:
-                raise
+            if '{}__ERROR'.format(name) in self.recorded_data:
+                error = self.recorded_data.load('{}__ERROR'.format(name))
+        elif cmd and 'lspci -vvvDnn -s' in cmd:
+            altered_cmd = cmd.replace('lspci -vvvDnn -s', 'lspci -vvvD -s')
+            output, error = self.read_cmd_output_from_file(cmd_prefix, altered_cmd)
+        elif cmd and 'lspci -vvvDnnd 15b3:' in cmd:
+            # Used to identify mellanox bdfs in version < 3.9
+            altered_cmd = cmd.replace('lspci -vvvDnnd 15b3:', 'lspci -Dd 15b3:')
+            output, error = self.read_cmd_output_from_file(cmd_prefix, altered_cmd)
+        elif self.config.skip_missing or self.unrecorded_as_missing and \
+                any(regex.search(cmd) for regex in self.UNRECORDED_AS_MISSING.get(cmd_prefix, [])):
+            output = ""
+            error = ""
+        else:
+            raise IOError("No such recorded data: '{}'".format(name))
 
         return output, error
 
-    def exec_shell_cmd(self, cmd, splitlines=True, **kwargs):
-        # use_cache is here for compatibility only
-        output, error = self.read_cmd_output_from_file("/shell.cmd/", cmd)
-        if error:
+    def exec_shell_cmd(self, cmd, use_cache=False, splitlines=True, report_cmd_error=True, **kwargs):
+        output, error = self.read_cmd_output_from_file("shell.cmd/", cmd)
+        # Live run returns cached output without the error for repeated commands
+        if use_cache is True:
+            if self.cache.get("shell.cmd", cmd) is not lshca.DataSourceCache.MISS:
+                error = ""
+            self.cache.set("shell.cmd", cmd, output)
+        if error and report_cmd_error:
             self.log.error('Following cmd returned and error message.\n\tCMD: {}\n\tMsg: {}'.format(cmd, error))
 
         # splitlines parameter added in version 3.9, before that everything was splitted and recorded in this state
@@ -66,39 +161,93 @@ class DataSourceRecorded(lshca.DataSource):
     def get_bdf_data_from_lspci(self, bdf, **kwargs):
         # type: (str, bool) -> dict
         if version.parse(self.config.recorded_lshca_version) >= version.parse("3.9"):
-            output = super(DataSourceRecorded, self).get_bdf_data_from_lspci(bdf)
+            output = super(DataSourceReplay, self).get_bdf_data_from_lspci(bdf)
         else:
             # comes to compensate on missing get_bdf_data_from_lspci information in recordings by versions < 3.9
             output = self.exec_shell_cmd("lspci -vvvDnn -s" + bdf)
         return output
 
     def read_file_if_exists(self, file_to_read, record_suffix="", **kwargs):
-        output, error = self.read_cmd_output_from_file("/os.path.exists/", file_to_read + record_suffix)
+        output, error = self.read_cmd_output_from_file("os.path.exists", file_to_read + record_suffix)
         if error:
             print(error, file=sys.stderr)
         return output
 
     def read_link_if_exists(self, link_to_read, **kwargs):
-        output, error = self.read_cmd_output_from_file("/os.readlink/", link_to_read)
+        output, error = self.read_cmd_output_from_file("os.readlink", link_to_read)
         if error:
             print(error, file=sys.stderr)
         return output
 
     def list_dir_if_exists(self, dir_to_list, **kwargs):
-        output, error = self.read_cmd_output_from_file("/os.listdir/", dir_to_list.rstrip('/') + "_dir")
+        output, error = self.read_cmd_output_from_file("os.listdir", dir_to_list.rstrip('/') + "_dir")
         if error:
             print(error, file=sys.stderr)
         return output
 
     def exec_python_code(self, python_code, record_suffix="", **kwargs):
-        output, error = self.read_cmd_output_from_file("/os.python.code/", hashlib.md5(python_code.encode('utf-8')).hexdigest() + record_suffix)
+        name = hashlib.md5(python_code.encode('utf-8')).hexdigest() + record_suffix
+        # Rates of views other than the recorded one are computed from timestamps that were never recorded,
+        # replayed clock ticks a second on every read to keep them numbers
+        if self.config.skip_missing and python_code == "time.time()" and \
+                "os.python.code/" + name not in self.recorded_data:
+            self._replay_clock += 1.0
+            return self._replay_clock
+        output, error = self.read_cmd_output_from_file("os.python.code/", name)
         if error:
             print(error, file=sys.stderr)
         return output
 
+    def exec_mad_queries(self, rdma, port, queries):
+        name = "umad/{}/{}/{}".format(rdma, port, ";".join("{}:{}".format(*query) for query in queries))
+        # Recordings made before native MAD queries have smpquery/saquery output only
+        if name not in self.recorded_data:
+            return None
+        return self.recorded_data.load(name)
+
+    def get_dcb_data(self, interfaces, **kwargs):
+        # Recordings made before DCB netlink queries have mlnx_qos output only
+        output = {}
+        for interface in interfaces:
+            name = "dcb.netlink/" + interface
+            output[interface] = self.recorded_data.load(name) if name in self.recorded_data else None
+        return output
+
+    def read_counters(self, counters_dirs, record_suffix="", **kwargs):
+        output = {}
+        for counters_dir in counters_dirs:
+            name = "counters/" + counters_dir + record_suffix
+            output[counters_dir] = self.recorded_data.load(name) if name in self.recorded_data else {}
+        return output
+
+    def get_rdma_netlink_data(self, client="nldev", **kwargs):
+        # Recordings made before RDMA netlink queries have sysfs data only
+        name = "rdma.netlink/" + client
+        if name not in self.recorded_data:
+            return None
+        return self.recorded_data.load(name)
+
+    def get_ethtool_stats(self, interfaces, record_suffix="", **kwargs):
+        output = {}
+        for interface in interfaces:
+            name = "ethtool.stats/" + interface + record_suffix
+            output[interface] = self.recorded_data.load(name) if name in self.recorded_data else None
+        return output
+
+    def get_ovsdb_ports(self, socket_path, **kwargs):
+        # Recordings made before ovsdb-server queries have ovs-vsctl output only
+        name = "ovsdb/" + socket_path
+        if name not in self.recorded_data:
+            return None
+        return self.recorded_data.load(name)
+
+    def read_baseline(self, baseline_file, **kwargs):
+        output, _ = self.read_cmd_output_from_file("baseline/", baseline_file)
+        return output
+
     def get_raw_socket_data(self, interface, ether_proto, capture_timeout, **kwargs):
         cache_key = self.cmd_to_str(str(interface) + str(ether_proto))
-        output, error = self.read_cmd_output_from_file("/raw.socket.data/", cache_key)
+        output, error = self.read_cmd_output_from_file("raw.socket.data/", cache_key)
         if error:
             print(error, file=sys.stderr)
         return output
@@ -120,17 +269,18 @@ class RegressionConfig(lshca.Config):
         self.skip_missing = False
         self.recorded_lshca_version = "0"
         super(RegressionConfig, self).__init__()
+        # Replay is serial, as the recording
+        self.sa_smp_query_workers = 1
 
 
-def main(tmp_dir_name, recorder_sys_argv, regression_conf):
+def main(recorded_data, recorder_sys_argv, regression_conf):
     config = regression_conf
 
     # Comes to handle missing TTY during regression
     config.override__set_tty_exists = True
     config.parse_arguments(recorder_sys_argv[1:])
     config.record_data_for_debug = False
-    config.record_dir = tmp_dir_name
-    data_source = DataSourceRecorded(config)
+    data_source = DataSourceReplay(config, recorded_data)
 
     hca_manager = lshca.HCAManager(data_source, config)
     hca_manager.get_data()
@@ -143,8 +293,6 @@ def regression():
     parser.add_argument('-v', action='store_true', dest="verbose", help="set high verbosity")
     parser.add_argument('--skip-missing', action='store_true', dest="skip_missing",
                         help="skip missing data source files")
-    parser.add_argument('--keep-recorded-ds', action='store_true', dest="keep_recorded_ds",
-                        help="Don't delete recorded data source tmp directory")
     parser.add_argument('--display-only', choices=["orig", "curr"], dest="display_only",
                         help=textwrap.dedent('''\
                                 instead of diff display only:
@@ -153,6 +301,8 @@ def regression():
                                 '''))
     parser.add_argument('--display-recorded-fields', action='store_true', help="Display ONLY originaly recorded fields. Overwrites -p")
     parser.add_argument('--data-source', nargs="+", help="Select single data souce from recorded_data directory")
+    parser.add_argument('-j', type=int, default=1, dest="jobs",
+                        help="run recorded data files in N parallel worker processes, 0 - one per CPU (default: %(default)s)")
     parser.add_argument('-p', dest="parameters", nargs=argparse.REMAINDER,
                         help=textwrap.dedent('''\
                                 override saved parameters and pass new ones
@@ -167,169 +317,217 @@ def regression():
             cust_user_args.append(member)
     args = parser.parse_args(cust_user_args)
 
-    rec_data_dir_path = os.path.dirname(os.path.abspath(__file__)) + "/../recorded_data/"
-    if args.data_source:
-        if os.path.isfile(rec_data_dir_path + str(args.data_source[0])):
-            recorded_data_files_list = [str(args.data_source[0])]
-        else:
-            print("No such data source \"" + str(args.data_source[0]) + "\"")
-            sys.exit(1)
-    else:
-        file_list = os.listdir(rec_data_dir_path)
-        if sys.version_info.major == 3:
-            p3_only_files = os.listdir(os.path.join(rec_data_dir_path, "py3-only"))
-            p3_only_files = [ os.path.join("py3-only", f) for f in p3_only_files ]
-            file_list.extend(p3_only_files)
-
-        recorded_data_files_list = []
-        for file in file_list:
-            if file.endswith('.tar'):
-                recorded_data_files_list.append(file)
-
-    if not recorded_data_files_list:
+    run_case_args = []
+    for rec_data_dir_path in (REC_DATA_DIR_PATH, SYNTHETIC_REC_DATA_DIR_PATH):
+        recorded_data_files_list = get_recorded_data_files_list(rec_data_dir_path, args.data_source)
+        run_case_args.extend([(f, rec_data_dir_path, args) for f in recorded_data_files_list])
+
+    if args.data_source and not run_case_args:
+        print("No such data source \"" + str(args.data_source[0]) + "\"")
+        sys.exit(1)
+
+    if not run_case_args:
         print("WARNING: no test cases ran")
         sys.exit(0)
 
-    tmp_dir_name = tempfile.mkdtemp(prefix="lshca_regression_")
-    regression_run_succseeded = True
-    for full_recorded_data_file in recorded_data_files_list:
-        if not os.path.isfile(rec_data_dir_path + full_recorded_data_file):
-            continue
-
-        recorded_data_file = full_recorded_data_file.split('/')[-1]
-        recorded_data_file_prefix = full_recorded_data_file.replace(recorded_data_file, '')
-        shutil.copyfile(
-            os.path.join(rec_data_dir_path, recorded_data_file_prefix, recorded_data_file),
-            os.path.join(tmp_dir_name, recorded_data_file)
-            )
-        untared_data_source_dir = tmp_dir_name + "/" + recorded_data_file.replace(".tar", "")
-        os.mkdir(untared_data_source_dir)
-
-        tar = tarfile.open(tmp_dir_name + "/" + recorded_data_file)
-        tar.extractall(path=untared_data_source_dir)
-
-        if args.parameters:
-            recorded_sys_args = args.parameters[0].split(" ")
-            recorded_sys_args.insert(0, "lshca_run_by_regression")
-        else:
-            f = open(untared_data_source_dir + "/cmd", "rb")
-            try:
-                recorded_sys_args = pickle.load(f)
-            except ValueError as e:
-                print("\nFailed unpickling %s \n\n" % str(recorded_data_file))
-                raise e
-
-            recorded_sys_args = recorded_sys_args.split(" ")
-            if args.display_recorded_fields:
-                try:
-                    f = open(untared_data_source_dir + "/output_fields", "rb")
-                    recorded_output_fields = pickle.load(f)
-                except:
-                    print(BColors.FAIL + "Error: No output fileds saved in "  + recorded_data_file + BColors.ENDC )
-                    sys.exit(1)
-                recorded_sys_args.append("-o")
-                recorded_sys_args.append(",".join(recorded_output_fields))
-
-        f = open(untared_data_source_dir + "/environment", "rb")
-        tmp = pickle.load(f)
-        for item in tmp:
-            if 'LSHCA:' in item:
-                recorded_lshca_version = item.split(" ")[1]
-                break
-
-        lshca_output, lshca_errors = StringIO(), StringIO()
-        sys.stdout, sys.stderr = lshca_output, lshca_errors
-
+    if args.jobs == 1:
+        results = [run_recorded_data_case(case_args) for case_args in run_case_args]
+    else:
+        # Each worker process runs a single recording, so module level state can't leak between cases
+        pool = multiprocessing.Pool(processes=args.jobs or None, maxtasksperchild=1)
         try:
-            regression_conf = RegressionConfig()
-            regression_conf.skip_missing = args.skip_missing
-            regression_conf.recorded_lshca_version = recorded_lshca_version
-            main(untared_data_source_dir, recorded_sys_args, regression_conf)
-        except Exception as e:
-            lshca_output = StringIO(str(e))
+            results = pool.map(run_recorded_data_case, run_case_args, chunksize=1)
         finally:
-            sys.stdout = sys.__stdout__
-            sys.stderr = sys.__stderr__
+            pool.close()
+            pool.join()
 
-        print('**************************************************************************************')
-        print(BColors.BOLD + 'Recorded data file: ' + str(full_recorded_data_file) + BColors.ENDC)
-        print("Command: " + " ".join(recorded_sys_args))
-        print('**************************************************************************************')
+    regression_run_succseeded = True
+    for result in results:
+        print(result["report"], end="")
+        if not result["passed"]:
+            regression_run_succseeded = False
 
-        saved_output = load_saved_output(recorded_data_file, untared_data_source_dir)
-        saved_errors = load_saved_errors(recorded_data_file, untared_data_source_dir)
+    print_summary(results)
 
-        print(regression_conf.output_separator_char)
-        test_errors = lshca_errors.getvalue()
-        test_output = re.sub(regression_conf.output_separator_char, '', lshca_output.getvalue())
-        saved_output = re.sub(regression_conf.output_separator_char, '', saved_output)
+    if not regression_run_succseeded:
+        sys.exit(1)
 
-        if not do_compare(args, saved_errors, saved_output, test_errors, test_output):
-            regression_run_succseeded = False
+def get_recorded_data_files_list(rec_data_dir_path, data_source=None):
+    # type: (str, list) -> list
+    if data_source:
+        if os.path.isfile(rec_data_dir_path + str(data_source[0])):
+            return [str(data_source[0])]
+        else:
+            return []
+
+    if not os.path.isdir(rec_data_dir_path):
+        return []
+
+    file_list = os.listdir(rec_data_dir_path)
+    if sys.version_info.major == 3 and os.path.isdir(os.path.join(rec_data_dir_path, "py3-only")):
+        p3_only_files = os.listdir(os.path.join(rec_data_dir_path, "py3-only"))
+        p3_only_files = [ os.path.join("py3-only", f) for f in p3_only_files ]
+        file_list.extend(p3_only_files)
+
+    recorded_data_files_list = []
+    for file in file_list:
+        if file.endswith(RECORDED_DATA_SUFFIXES) and os.path.isfile(rec_data_dir_path + file):
+            recorded_data_files_list.append(file)
+
+    recorded_data_files_list.sort()
+    return recorded_data_files_list
+
+def get_recorded_lshca_version(recorded_data):
+    # type: (RecordedDataIndex) -> str
+    for item in recorded_data.load("environment"):
+        if 'LSHCA:' in item:
+            return item.split(" ")[1]
+    return "0"
+
+def run_recorded_data_case(case_args):
+    # type: (tuple) -> dict
+    full_recorded_data_file, rec_data_dir_path, args = case_args
+    start_time = time.time()
+    report = StringIO()
+
+    # MST service state is kept in class attributes, reset it so previous case won't affect this one
+    lshca.MSTDevice.mst_tool_missing = False
+    lshca.MSTDevice.mst_service_initialized = False
+    lshca.MSTDevice.mst_service_should_be_stopped = False
+
+    recorded_data_file = full_recorded_data_file.split('/')[-1]
+    recorded_data = RecordedDataIndex(os.path.join(rec_data_dir_path, full_recorded_data_file))
+
+    if args.parameters:
+        recorded_sys_args = args.parameters[0].split(" ")
+        recorded_sys_args.insert(0, "lshca_run_by_regression")
+    else:
+        try:
+            recorded_sys_args = recorded_data.load("cmd")
+        except ValueError as e:
+            print("\nFailed unpickling %s \n\n" % str(recorded_data_file))
+            raise e
+
+        recorded_sys_args = recorded_sys_args.split(" ")
+        if args.display_recorded_fields:
+            try:
+                recorded_output_fields = recorded_data.load("output_fields")
+            except:
+                print(BColors.FAIL + "Error: No output fileds saved in "  + recorded_data_file + BColors.ENDC, file=report)
+                return {"file": full_recorded_data_file, "passed": False, "report": report.getvalue(),
+                        "wall_time": time.time() - start_time}
+            recorded_sys_args.append("-o")
+            recorded_sys_args.append(",".join(recorded_output_fields))
 
-        print("\n")
+    recorded_lshca_version = get_recorded_lshca_version(recorded_data)
 
-    if not args.keep_recorded_ds:
-        shutil.rmtree(tmp_dir_name)
-    else:
-        print("Data sources left in {} directory".format(tmp_dir_name))
+    lshca_output, lshca_errors = StringIO(), StringIO()
+    sys.stdout, sys.stderr = lshca_output, lshca_errors
 
-    if not regression_run_succseeded:
-        sys.exit(1)
+    try:
+        regression_conf = RegressionConfig()
+        regression_conf.skip_missing = args.skip_missing
+        regression_conf.recorded_lshca_version = recorded_lshca_version
+        main(recorded_data, recorded_sys_args, regression_conf)
+    except SystemExit:
+        # lshca exits by itself in some cases, i.e. no HCAs to display. Output till exit is compared
+        pass
+    except Exception as e:
+        lshca_output = StringIO(str(e))
+    finally:
+        sys.stdout = sys.__stdout__
+        sys.stderr = sys.__stderr__
+
+    print('**************************************************************************************', file=report)
+    print(BColors.BOLD + 'Recorded data file: ' + str(full_recorded_data_file) + BColors.ENDC, file=report)
+    print("Command: " + " ".join(recorded_sys_args), file=report)
+    print('**************************************************************************************', file=report)
+
+    saved_output = load_saved_output(recorded_data_file, recorded_data)
+    saved_errors = load_saved_errors(recorded_data_file, recorded_data, report)
+    recorded_data.close()
+
+    print(regression_conf.output_separator_char, file=report)
+    test_errors = lshca_errors.getvalue()
+    test_output = re.sub(regression_conf.output_separator_char, '', lshca_output.getvalue())
+    saved_output = re.sub(regression_conf.output_separator_char, '', saved_output)
+
+    passed = do_compare(args, saved_errors, saved_output, test_errors, test_output, report)
+
+    print("\n", file=report)
+
+    return {"file": full_recorded_data_file, "passed": passed, "report": report.getvalue(),
+            "wall_time": time.time() - start_time}
+
+def print_summary(results):
+    # type: (list) -> None
+    file_column_width = max([len(r["file"]) for r in results] + [len("Recorded data file")])
+    separator = '-' * (file_column_width + 22)
+
+    print(separator)
+    print("{0:<{width}} | {1:^6} | {2:>9}".format("Recorded data file", "Result", "Time, s", width=file_column_width))
+    print(separator)
+    for result in results:
+        if result["passed"]:
+            status = BColors.OKGREEN + "{0:^6}".format("PASSED") + BColors.ENDC
+        else:
+            status = BColors.FAIL + "{0:^6}".format("FAILED") + BColors.ENDC
+        print("{0:<{width}} | {1} | {2:>9.3f}".format(result["file"], status, result["wall_time"], width=file_column_width))
+    print(separator)
+    passed_count = len([r for r in results if r["passed"]])
+    print("Passed {} of {}, total time {:.3f}s".format(passed_count, len(results), sum([r["wall_time"] for r in results])))
 
-def load_saved_errors(recorded_data_file, untared_data_source_dir):
+def load_saved_errors(recorded_data_file, recorded_data, report):
     # recording of errors started from version 3.9
     # this comes to handle recordings with missing errors
     saved_errors = None
-    if os.path.exists(untared_data_source_dir + "/errors"):
+    if "errors" in recorded_data:
         try:
-            f = open(untared_data_source_dir + "/errors", "rb")
-            saved_errors = pickle.load(f)
+            saved_errors = recorded_data.load("errors")
         except ValueError as e:
             print("\nFailed unpickling %s \n\n" % str(recorded_data_file))
             raise e
     else:
-        print("{}Warring{}: Missing recorded errors".format(BColors.WARNING, BColors.ENDC))
+        print("{}Warring{}: Missing recorded errors".format(BColors.WARNING, BColors.ENDC), file=report)
     return saved_errors
 
-def load_saved_output(recorded_data_file, untared_data_source_dir):
+def load_saved_output(recorded_data_file, recorded_data):
     try:
-        f = open(untared_data_source_dir + "/output", "rb")
-        saved_output = pickle.load(f)
+        saved_output = recorded_data.load("output")
     except ValueError as e:
         print("\nFailed unpickling %s \n\n" % str(recorded_data_file))
         raise e
     return saved_output
 
-def do_compare(args, saved_errors, saved_output, test_errors, test_output):
+def do_compare(args, saved_errors, saved_output, test_errors, test_output, report):
     passed = True
 
     outs_equal = test_output == saved_output
     errs_equal = test_errors == saved_errors if saved_errors else True
     if outs_equal and errs_equal:
-        print("Regression run " + BColors.OKGREEN + "PASSED." + BColors.ENDC)
+        print("Regression run " + BColors.OKGREEN + "PASSED." + BColors.ENDC, file=report)
         if args.verbose:
-            print(BColors.OKBLUE + "Test output below:" + BColors.ENDC)
-            print(test_errors)
-            print(test_output)
+            print(BColors.OKBLUE + "Test output below:" + BColors.ENDC, file=report)
+            print(test_errors, file=report)
+            print(test_output, file=report)
     else:
         passed = False
         print("Regression run " + BColors.FAIL + "FAILED." + BColors.ENDC + \
-                    " Saved and regression outputs/errors differ\n")
+                    " Saved and regression outputs/errors differ\n", file=report)
 
         if not args.display_only:
             d = difflib.Differ()
             if saved_errors:
                 diff = d.compare(saved_errors.split("\n"), test_errors.split("\n"))
-                print('\n'.join(diff))
+                print('\n'.join(diff), file=report)
             diff = d.compare(saved_output.split("\n"), test_output.split("\n"))
-            print('\n'.join(diff))
+            print('\n'.join(diff), file=report)
         elif args.display_only == "orig":
-            print(saved_errors)
-            print(saved_output)
+            print(saved_errors, file=report)
+            print(saved_output, file=report)
         elif args.display_only == "curr":
-            print(test_errors)
-            print(test_output)
+            print(test_errors, file=report)
+            print(test_output, file=report)
     return passed
 
 
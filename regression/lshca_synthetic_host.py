@@ -0,0 +1,1502 @@
+#!/usr/bin/env python
+
+# Synthetic host generator for lshca scaling checks
+# Writes fake sysfs/procfs tree, matching "lspci -vvvDnn" output and stub executables in to a directory.
+# lshca reads it with --fs-root <directory>, no HCA hardware or root privileges required.
+#
+# generate      - single host of N HCAs x P ports x V VFs x S SFs, optionally with bonds and representors
+# scale         - generate hosts of growing HCA count and measure lshca wall time, syscalls and RSS
+# umad-loopback - check native MAD client of lshca against in memory umad device
+# ovsdb-stand-in - check OVSDB client of lshca against stand-in ovsdb-server socket
+# cache-expiry  - check expiry and eviction of lshca DataSourceCache by stand-in clock
+# sa-smp-batching - check SA/SMP query deduplication and fan-out of lshca ib view against loopback umad devices
+# dcb-netlink   - check DCB netlink client of lshca against stand-in rtnetlink socket
+# counters-sampling - check counters view rates and --nonzero of lshca with counters changing between samples
+# rdma-netlink  - check RDMA netlink (nldev) client of lshca against stand-in netlink socket
+# ethtool-stats - check ethtool statistics client and ethstats view rates of lshca against stand-in ethtool ioctl
+# fleet-aggregate - check --aggregate of lshca on json and ndjson snapshots with expected output
+# collect-api   - check lshca.collect() library API: errors, fields and where, reused DataSource
+# daemon-round-trip - check lshca daemon served output against direct output of the same views
+#
+# Regression recordings of generated hosts are kept in synthetic_recorded_data/, they're made by
+#   env -i PATH=$PATH LC_ALL=C lshca -m record --fs-root <directory> [-w <view>]
+# Empty environment keeps environment of the recording host out of the recording
+
+from __future__ import print_function
+
+import argparse
+import difflib
+import errno
+import json
+import os
+import resource
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+import uuid
+try:
+    from StringIO import StringIO # for Python 2, accepts str lshca prints
+except ImportError:
+    from io import StringIO # for Python 3
+
+regr_home = os.path.dirname(os.path.abspath(__file__))
+LSHCA_HOME = os.path.abspath(regr_home + '/../')
+sys.path.append(LSHCA_HOME)
+
+import lshca
+
+VFS_PER_BUS = 248 # 31 PCI devices x 8 functions, device 0 is taken by PFs
+
+
+class SyntheticHost(object):
+    def __init__(self, root, hcas=1, ports=2, vfs=0, sfs=0, link_layer="ib", bonds=False, representors=False):
+        # type: (str, int, int, int, int, str, bool, bool) -> None
+        self.root = root.rstrip("/")
+        self.hcas = hcas
+        self.ports = ports
+        self.vfs = vfs
+        self.sfs = sfs
+        self.link_layer = link_layer
+        self.bonds = bonds
+        self.representors = representors
+
+        self._rdma_index = 0
+        self._sf_index = 0
+        self._lspci = []
+        self._mst_devices = []
+        self._mst_cables = []
+        self.bdf_count = 0
+
+    def write_file(self, path, data):
+        # type: (str, str) -> None
+        full_path = self.root + path
+        if not os.path.isdir(os.path.dirname(full_path)):
+            os.makedirs(os.path.dirname(full_path))
+        with open(full_path, "w") as f:
+            f.write(data)
+
+    def symlink(self, path, target):
+        # type: (str, str) -> None
+        full_path = self.root + path
+        if not os.path.isdir(os.path.dirname(full_path)):
+            os.makedirs(os.path.dirname(full_path))
+        os.symlink(target, full_path)
+
+    def mkdir(self, path):
+        # type: (str) -> None
+        if not os.path.isdir(self.root + path):
+            os.makedirs(self.root + path)
+
+    def generate(self):
+        # type: () -> None
+        self.mkdir("/dev")
+        self.mkdir("/sys/kernel/config/rdma_cm")
+        self.mkdir("/sys/bus/auxiliary/devices")
+        self.write_file("/proc/sys/net/ipv4/tcp_ecn", "1\n")
+        self.write_file("/proc/sys/kernel/osrelease", "5.15.0-91-generic\n")
+        self.write_file("/sys/module/mlx5_core/version", "23.10-1.1.9\n")
+        self.write_file("/sys/module/mlx5_core/srcversion", "C6F5E2FEB3A85D8E5A4D7D1\n")
+        self.write_file("/usr/bin/ofed_info", textwrap.dedent("""\
+            #!/bin/bash
+            if [ "X$1" == "X-s" ]; then echo MLNX_OFED_LINUX-23.10-1.1.9.0:; exit; fi
+            """))
+
+        for hca in range(self.hcas):
+            self.generate_hca(hca)
+
+        self.write_file("/lspci.txt", "\n\n".join(self._lspci) + "\n")
+        self.write_stub("lspci", 'cat "$(dirname "$0")/../lspci.txt"')
+        self.write_stub("ip", 'echo "    inet 192.168.1.1/24 brd 192.168.1.255 scope global ${@: -1}"')
+        self.write_stub("mget_temp", 'echo "45 "')
+        self.write_stub("ofed_info", 'echo "MLNX_OFED_LINUX-23.10-1.1.9.0:"')
+
+        mst_header = "{:<24}{:<34}{:<10}".format("DEVICE_TYPE", "MST", "PCI")
+        self.write_file("/mst_status.txt", "\n".join(
+            ["MST modules:", "------------", "    MST PCI module is not loaded", "    MST PCI configuration module loaded",
+             "PCI devices:", "------------", mst_header] + self._mst_devices +
+            ["", "Cables:", "-------"] + self._mst_cables) + "\n")
+        self.write_stub("mst", '[ "$1" == "status" ] && cat "$(dirname "$0")/../mst_status.txt"; exit 0')
+        self.write_stub("mlxlink", textwrap.dedent("""\
+            MODULE=""
+            [[ " $* " == *" -m "* ]] && MODULE=', "Module Info": {"Vendor Part Number": "MCP1650-H003E26", "Vendor Serial Number": "MT2203VS00001", "Cable Length [m]": "3"}'
+            echo '{"result": {"output": {"Operational Info": {"Physical state": "LinkUp", "Speed": "200G"}, "Troubleshooting Info": {"Recommendation": "No issue was observed."}'"$MODULE"'}}}'"""))
+        self.write_stub("mlxcables", textwrap.dedent("""\
+            echo "Part number       : MCP1650-H003E26"
+            echo "Serial number     : MT2203VS00001"
+            echo "Length [m]        : 3 m"
+            """))
+
+    def write_stub(self, name, body):
+        # type: (str, str) -> None
+        self.write_file("/bin/" + name, "#!/bin/bash\n" + body + "\n")
+        os.chmod(self.root + "/bin/" + name, 0o755)
+
+    def port_link_layer(self, port):
+        # type: (int) -> str
+        if self.link_layer == "mixed":
+            return "InfiniBand" if port % 2 == 0 else "Ethernet"
+        return "InfiniBand" if self.link_layer == "ib" else "Ethernet"
+
+    def generate_hca(self, hca):
+        # type: (int) -> None
+        bus = 0x10 + hca * (1 + (self.ports * self.vfs) // VFS_PER_BUS + 1)
+        sn = "MT{:04d}X{:05d}".format(2000 + hca, hca)
+        sys_image_guid = "b859:9f03:00{:02x}:{:04x}".format(hca // 0x10000, hca % 0x10000)
+        bond = "bond{}".format(hca) if self.bonds and self.ports > 1 else ""
+
+        for port in range(self.ports):
+            pf_bdf = "0000:{:02x}:00.{}".format(bus, port)
+            pf_net = "ens{}f{}".format(hca, port)
+            link_layer = self.port_link_layer(port)
+
+            # With RDMA bond only first slave has infiniband device
+            has_rdma = not (bond and port > 0)
+            rdma = "mlx5_bond_{}".format(hca) if bond and has_rdma else None
+            self.generate_function(pf_bdf, pf_net, hca, sys_image_guid, link_layer, has_rdma=has_rdma, rdma=rdma)
+            self.add_lspci(pf_bdf, sn, virtual=False)
+            mst_device = "mt4123_pciconf{}".format(hca) + (".{}".format(port) if port else "")
+            self._mst_devices.append("{:<24}{:<34}{:<10}".format("ConnectX6(rev:0)", "/dev/mst/" + mst_device, pf_bdf[5:]))
+            self._mst_cables.append("mt4123_pciconf{}_cable_{}".format(hca, port))
+            hwmon_prefix = "/sys/bus/pci/devices/{}/hwmon/hwmon{}".format(pf_bdf, hca * self.ports + port)
+            self.write_file(hwmon_prefix + "/name", "mlx5\n")
+            self.write_file(hwmon_prefix + "/temp1_label", "asic\n")
+            self.write_file(hwmon_prefix + "/temp1_input", "{}\n".format(45000 + 1000 * (hca % 50)))
+            self.write_file(hwmon_prefix + "/temp1_crit", "105000\n")
+
+            if bond:
+                self.write_file("/sys/bus/pci/devices/{}/net/{}/bonding_slave/mii_status".format(pf_bdf, pf_net), "up\n")
+                self.write_file("/sys/bus/pci/devices/{}/net/{}/bonding_slave/state".format(pf_bdf, pf_net), "active\n")
+                self.symlink("/sys/bus/pci/devices/{}/net/{}/upper_{}".format(pf_bdf, pf_net, bond),
+                             "../../../../../../virtual/net/" + bond)
+
+            if self.representors:
+                self.generate_representors(pf_bdf, port)
+
+            # VFs of second slave would have no parent with RDMA data
+            for vf in range(self.vfs if has_rdma else 0):
+                vf_slot = port * self.vfs + vf
+                vf_bdf = "0000:{:02x}:{:02x}.{}".format(bus + vf_slot // VFS_PER_BUS, 1 + (vf_slot % VFS_PER_BUS) // 8, vf_slot % 8)
+                self.generate_function(vf_bdf, "{}v{}".format(pf_net, vf), hca, sys_image_guid, link_layer)
+                self.symlink("/sys/bus/pci/devices/{}/physfn".format(vf_bdf), "../" + pf_bdf)
+                self.symlink("/sys/bus/pci/devices/{}/virtfn{}".format(pf_bdf, vf), "../" + vf_bdf)
+                self.add_lspci(vf_bdf, sn, virtual=True)
+
+            for sf in range(self.sfs):
+                self.generate_sf(pf_bdf, "en{}f{}s{}".format(hca, port, sf), hca, sys_image_guid, link_layer, sf)
+
+        if bond:
+            self.generate_bond(bond, ["ens{}f{}".format(hca, port) for port in range(self.ports)])
+
+    def generate_function(self, bdf, net, hca, sys_image_guid, link_layer, has_rdma=True, rdma=None, prefix=None):
+        # type: (str, str, int, str, str, bool, str, str) -> None
+        if prefix is None:
+            prefix = "/sys/bus/pci/devices/" + bdf
+            self.symlink(prefix + "/driver", "../../../../bus/pci/drivers/mlx5_core")
+            self.write_file(prefix + "/numa_node", "{}\n".format(hca % 2))
+        self.bdf_count += 1
+
+        self.write_file(prefix + "/net/{}/dev_id".format(net), "0x0\n")
+        self.write_file(prefix + "/net/{}/dev_port".format(net), "0\n")
+        self.write_file(prefix + "/net/{}/address".format(net), "b8:59:9f:{:02x}:{:02x}:{:02x}\n".format(
+            hca % 0x100, (self.bdf_count >> 8) % 0x100, self.bdf_count % 0x100))
+        self.write_file("/sys/class/net/{}/operstate".format(net), "up\n")
+        if link_layer == "Ethernet":
+            self.write_file("/sys/class/net/{}/qos/trust".format(net), "dscp\n")
+
+        if not has_rdma:
+            return
+
+        if rdma is None:
+            rdma = "mlx5_{}".format(self._rdma_index)
+            self._rdma_index += 1
+        ib_prefix = prefix + "/infiniband/" + rdma
+        guid = "b859:9f03:{:04x}:{:04x}".format(hca, self.bdf_count % 0x10000)
+        self.write_file(ib_prefix + "/hca_type", "MT4123\n")
+        self.write_file(ib_prefix + "/fw_ver", "20.31.1014\n")
+        self.write_file(ib_prefix + "/board_id", "MT_0000000223\n")
+        self.write_file(ib_prefix + "/sys_image_guid", sys_image_guid + "\n")
+        self.write_file(ib_prefix + "/node_guid", guid + "\n")
+        self.write_file(ib_prefix + "/tc/1/traffic_class", "Global tclass=106\n")
+
+        port_prefix = ib_prefix + "/ports/1"
+        self.write_file(port_prefix + "/state", "4: ACTIVE\n")
+        self.write_file(port_prefix + "/phys_state", "5: LinkUp\n")
+        self.write_file(port_prefix + "/link_layer", link_layer + "\n")
+        self.write_file(port_prefix + "/rate", "200 Gb/sec (4X HDR)\n")
+        self.write_file(port_prefix + "/lid", "0x{:x}\n".format(self.bdf_count) if link_layer == "InfiniBand" else "0x0\n")
+        self.write_file(port_prefix + "/sm_lid", "0x1\n" if link_layer == "InfiniBand" else "0x0\n")
+        self.write_file(port_prefix + "/has_smi", "1\n")
+        self.write_file(port_prefix + "/gids/0", "fe80:0000:0000:0000:" + guid + "\n")
+        for counter in ["port_xmit_data", "port_rcv_data", "port_xmit_packets", "port_rcv_packets",
+                        "symbol_error", "port_rcv_errors", "link_downed"]:
+            self.write_file(port_prefix + "/counters/" + counter, "0\n")
+        for counter in ["packet_seq_err", "out_of_buffer", "rnr_nak_retry_err", "local_ack_timeout_err",
+                        "implied_nak_seq_err"]:
+            self.write_file(port_prefix + "/hw_counters/" + counter, "0\n")
+
+    def generate_sf(self, pf_bdf, net, hca, sys_image_guid, link_layer, sfnum):
+        # type: (str, str, int, str, str, int) -> None
+        sf_dev = "mlx5_core.sf.{}".format(self._sf_index + 2)
+        self._sf_index += 1
+        prefix = "/sys/bus/pci/devices/{}/{}".format(pf_bdf, sf_dev)
+        self.mkdir(prefix)
+        self.symlink(prefix + "/driver", "../../../../../bus/auxiliary/drivers/mlx5_core.sf")
+        self.write_file(prefix + "/sfnum", "{}\n".format(sfnum))
+        self.symlink("/sys/bus/auxiliary/devices/" + sf_dev, "../../../bus/pci/devices/{}/{}".format(pf_bdf, sf_dev))
+        self.generate_function(None, net, hca, sys_image_guid, link_layer, prefix=prefix)
+
+    def generate_representors(self, pf_bdf, port):
+        # type: (str, int) -> None
+        names = ["p{}".format(port), "pf{}hpf".format(port)] + ["pf{}vf{}".format(port, vf) for vf in range(self.vfs)]
+        phys_port_names = ["p{}".format(port), "pf{}".format(port)] + ["pf{}vf{}".format(port, vf) for vf in range(self.vfs)]
+        for name, phys_port_name in zip(names, phys_port_names):
+            prefix = "/sys/bus/pci/devices/{}/net/{}".format(pf_bdf, name)
+            self.write_file(prefix + "/dev_id", "0x0\n")
+            self.write_file(prefix + "/dev_port", "0\n")
+            self.write_file(prefix + "/phys_port_name", phys_port_name + "\n")
+            self.write_file(prefix + "/phys_switch_id", "{:016x}\n".format(0xb8599f0300000000 + port))
+            self.write_file("/sys/class/net/{}/operstate".format(name), "up\n")
+
+    def generate_bond(self, bond, slaves):
+        # type: (str, list) -> None
+        prefix = "/sys/devices/virtual/net/" + bond
+        self.write_file(prefix + "/operstate", "up\n")
+        self.write_file(prefix + "/bonding/mode", "802.3ad 4\n")
+        self.write_file(prefix + "/bonding/xmit_hash_policy", "layer3+4 1\n")
+        self.write_file(prefix + "/bonding/slaves", " ".join(slaves) + "\n")
+        self.write_file("/sys/class/net/{}/operstate".format(bond), "up\n")
+
+        proc_bonding = textwrap.dedent("""\
+            Ethernet Channel Bonding Driver: v5.15.0
+
+            Bonding Mode: IEEE 802.3ad Dynamic link aggregation
+            Transmit Hash Policy: layer3+4 (1)
+            MII Status: up
+            MII Polling Interval (ms): 100
+
+            802.3ad info
+            LACP active: on
+            LACP rate: fast
+            Aggregator selection policy (ad_select): stable
+            System priority: 65535
+            Active Aggregator Info:
+            \tAggregator ID: 1
+            \tNumber of ports: {}
+            \tActor Key: 21
+            \tPartner Key: 1
+            \tPartner Mac Address: 1c:34:da:00:00:01
+            """.format(len(slaves)))
+        for slave in slaves:
+            self.write_file(prefix + "/slave_{}/speed".format(slave), "200000\n")
+            proc_bonding += textwrap.dedent("""
+                Slave Interface: {}
+                MII Status: up
+                Speed: 200000 Mbps
+                Duplex: full
+                Link Failure Count: 0
+                Aggregator ID: 1
+                details partner lacp pdu:
+                    system priority: 32768
+                    system mac address: 1c:34:da:00:00:01
+                    oper key: 1
+                """.format(slave))
+        self.write_file("/proc/net/bonding/" + bond, proc_bonding)
+
+    def add_lspci(self, bdf, sn, virtual):
+        # type: (str, str, bool) -> None
+        if virtual:
+            title = "{} Infiniband controller [0207]: Mellanox Technologies MT28908 Family [ConnectX-6 Virtual Function] [15b3:101c]"
+        else:
+            title = "{} Infiniband controller [0207]: Mellanox Technologies MT28908 Family [ConnectX-6] [15b3:101b]"
+        self._lspci.append(title.format(bdf) + "\n" + textwrap.dedent("""\
+            \tSubsystem: Mellanox Technologies Device [15b3:0007]
+            \tCapabilities: [60] Express (v2) Endpoint, MSI 00
+            \t\tLnkCap:\tPort #0, Speed 16GT/s, Width x16, ASPM not supported
+            \t\tLnkSta:\tSpeed 16GT/s (ok), Width x16 (ok)
+            \tCapabilities: [48] Vital Product Data
+            \t\tProduct Name: ConnectX-6 VPI adapter card, HDR IB (200Gb/s) and 200GbE, dual-port QSFP56
+            \t\tRead-only fields:
+            \t\t\t[PN] Part number: MCX653106A-HDAT
+            \t\t\t[EC] Engineering changes: A6
+            \t\t\t[SN] Serial number: {}
+            \t\t\t[RV] Reserved: checksum good, 1 byte(s) reserved
+            \t\tEnd
+            \tKernel driver in use: mlx5_core""").format(sn))
+
+
+class LoopbackUmadClient(lshca.UmadClient):
+    """
+    Stand-in of umad device. Requests are answered in memory from the fabric description:
+        neighbors - {DR path: {"system_guid", "node_guid", "port_guid", "description"}}
+        sms       - {SM LID: SM port GUID}
+    Unknown DR path times out, unknown SM LID returns "no records" MAD status
+    Registered agents and the peak of requests in flight, sent and not read back yet, are kept for the checks
+    """
+    def __init__(self, neighbors, sms):
+        # type: (dict, dict) -> None
+        super(LoopbackUmadClient, self).__init__("loopback")
+        self.neighbors = neighbors
+        self.sms = sms
+        self.requests = []
+        self.registered_agents = [] # (qpn, management class, class version)
+        self.peak_in_flight = 0
+        self._responses = []
+
+    def _open(self):
+        return -1
+
+    def _close(self):
+        pass
+
+    def _ioctl(self, request, arg):
+        if request == self.IOCTL_REGISTER_AGENT:
+            fields = self.REG_REQ_STRUCT.unpack(arg)
+            self.registered_agents.append(fields[1:4])
+            return self.REG_REQ_STRUCT.pack(len(self._agents), *fields[1:])
+        return 0
+
+    def _write(self, packet):
+        hdr = bytearray(packet[:self.HDR_SIZE])
+        mad = bytearray(packet[self.HDR_SIZE:])
+        self.requests.append(bytes(packet))
+        attribute_id = self.MAD_HDR_STRUCT.unpack_from(mad)[7]
+        mad[3] |= 0x80 # GetResp
+
+        if mad[1] == self.SMI_DR_CLASS:
+            mad[4] |= 0x80 # D bit, returning direction
+            hop_count = mad[7]
+            path = ",".join(str(mad[self.SMP_INITIAL_PATH_OFFSET + i]) for i in range(hop_count + 1))
+            neighbor = self.neighbors.get(path)
+            if neighbor is None:
+                struct.pack_into("=I", hdr, 4, errno.ETIMEDOUT)
+            elif attribute_id == self.ATTRIBUTES["NodeInfo"]:
+                struct.pack_into(">BBBBQQQ", mad, self.SMP_DATA_OFFSET, 1, 1, 2, 36, int(neighbor["system_guid"], 16),
+                                 int(neighbor["node_guid"], 16), int(neighbor["port_guid"], 16))
+            else:
+                description = neighbor["description"].encode("utf-8")[:64]
+                mad[self.SMP_DATA_OFFSET:self.SMP_DATA_OFFSET + len(description)] = description
+        else:
+            lid = struct.unpack_from(">H", mad, self.SA_DATA_OFFSET)[0]
+            if lid in self.sms:
+                # priority 15, state MASTER (3)
+                struct.pack_into(">Q12xB", mad, self.SA_DATA_OFFSET + 4, int(self.sms[lid], 16), 0xf3)
+            else:
+                struct.pack_into(">H", mad, 4, 0x0400) # ERR_NO_RECORDS
+
+        self._responses.append(bytes(hdr) + bytes(mad))
+        self.peak_in_flight = max(self.peak_in_flight, len(self._responses))
+
+    def _read(self, size):
+        return self._responses.pop(0)[:size]
+
+    def _wait_readable(self, timeout):
+        return bool(self._responses)
+
+
+def umad_loopback_check():
+    # Round trip of SMP/SA encoding and parsing of lshca.UmadClient through the loopback device
+    neighbors = {"0,1": {"system_guid": "0002c90300a1b2c3", "node_guid": "0002c90300a1b2c4",
+                         "port_guid": "0002c90300a1b2c4", "description": "MF0;leaf-01:MQM8700/U1"}}
+    client = LoopbackUmadClient(neighbors, {0x1: "0002c90300ffee01"})
+    queries = [("NodeInfo", "0,1"), ("NodeDescription", "0,1"), ("SMInfoRecord", "0x1"),
+               ("SMInfoRecord", "0x2"), ("NodeInfo", "0,2")]
+    results = client.query(queries)
+    # Second batch is longer than MAX_IN_FLIGHT and reuses agents registered by the first one
+    batch_queries = [("NodeInfo", "0,{}".format(port)) for port in range(3, 3 + 2 * client.MAX_IN_FLIGHT)]
+    batch_results = client.query(batch_queries)
+    client.close()
+
+    expected = {("NodeInfo", "0,1"): "0002c90300a1b2c3", ("NodeDescription", "0,1"): "MF0;leaf-01:MQM8700/U1",
+                ("SMInfoRecord", "0x1"): "0002c90300ffee01", ("SMInfoRecord", "0x2"): None, ("NodeInfo", "0,2"): None}
+    fields = {"NodeInfo": "system_guid", "NodeDescription": "description", "SMInfoRecord": "guid"}
+    failed = False
+    for query in queries:
+        result = results[query][fields[query[0]]] if results[query] else None
+        status = "OK" if result == expected[query] else "FAILED"
+        failed = failed or status != "OK"
+        print("{:<28} {:<26} {}".format("{}:{}".format(*query), str(result), status))
+
+    # Every request of the batch is answered, while at most MAX_IN_FLIGHT of them are in flight
+    status = "OK" if len(batch_results) == len(batch_queries) and 1 < client.peak_in_flight <= client.MAX_IN_FLIGHT \
+        else "FAILED"
+    failed = failed or status != "OK"
+    print("{:<28} {:<26} {}".format("Peak in flight", "{} of {} allowed".format(client.peak_in_flight,
+                                                                             client.MAX_IN_FLIGHT), status))
+
+    # Agent of each management class is registered once per port, i.e. per client
+    agents = sorted(set(client.registered_agents))
+    status = "OK" if len(client.registered_agents) == len(agents) == 2 else "FAILED"
+    failed = failed or status != "OK"
+    print("{:<28} {:<26} {}".format("Agent registrations", "{} for {} classes".format(len(client.registered_agents),
+                                                                                 len(agents)), status))
+    print("{} requests sent".format(len(client.requests)))
+    return not failed
+
+
+class LoopbackMadDataSource(lshca.DataSource):
+    """
+    DataSource of synthetic host, umad device of every IB port is a LoopbackUmadClient
+    fabric is {rdma: neighbors of the port}, all ports share the SM. Each port query is delayed by query_delay,
+    so queries of several ports overlap. Names of the threads that queried are kept for the checks
+    """
+    SM_LID = 0x1
+    SM_GUID = "0002c90300ffee01"
+
+    def __init__(self, config, fabric, query_delay=0.05):
+        # type: (lshca.Config, dict, float) -> None
+        super(LoopbackMadDataSource, self).__init__(config)
+        self.fabric = fabric
+        self.query_delay = query_delay
+        self.umad_clients = {}
+        self.query_threads = set()
+        self._umad_lock = threading.Lock()
+
+    def get_umad_client(self, rdma, port):
+        with self._umad_lock:
+            if (rdma, str(port)) not in self.umad_clients:
+                self.umad_clients[(rdma, str(port))] = LoopbackUmadClient(self.fabric.get(rdma, {}),
+                                                                          {self.SM_LID: self.SM_GUID})
+            return self.umad_clients[(rdma, str(port))]
+
+    def exec_mad_queries(self, rdma, port, queries):
+        with self._umad_lock:
+            self.query_threads.add(threading.current_thread().name)
+        time.sleep(self.query_delay)
+        return super(LoopbackMadDataSource, self).exec_mad_queries(rdma, port, queries)
+
+    def sent_queries(self):
+        # type: () -> dict
+        # Returns {attribute: number of requests sent by all ports}
+        names = dict((attribute_id, attribute) for attribute, attribute_id in lshca.UmadClient.ATTRIBUTES.items())
+        sent = {}
+        for client in self.umad_clients.values():
+            for request in client.requests:
+                attribute = names[client.MAD_HDR_STRUCT.unpack_from(request[client.HDR_SIZE:])[7]]
+                sent[attribute] = sent.get(attribute, 0) + 1
+        return sent
+
+
+def sa_smp_batching_check():
+    # ib view of synthetic host with 8 IB ports, cabled to 2 switches, 4 ports each. Every SMInfoRecord is queried
+    # once per subnet, NodeDescription once per switch, NodeInfo per port, ports are queried concurrently
+    switches = [{"system_guid": "0002c90300a1b2c3", "node_guid": "0002c90300a1b2c4", "port_guid": "0002c90300a1b2c4",
+                 "description": "MF0;leaf-01:MQM8700/U1"},
+                {"system_guid": "0002c90300d4e5f6", "node_guid": "0002c90300d4e5f7", "port_guid": "0002c90300d4e5f7",
+                 "description": "MF0;leaf-02:MQM8700/U1"}]
+    fabric = dict(("mlx5_{}".format(rdma_index), {"0,1": switches[rdma_index // 4]}) for rdma_index in range(8))
+
+    root = tempfile.mkdtemp(prefix="lshca_synthetic_")
+    try:
+        SyntheticHost(root, hcas=2, ports=2, vfs=1, link_layer="ib").generate()
+        config = lshca.Config()
+        config.parse_arguments(["-w", "ib", "-j", "--fs-root", root])
+        config.sa_smp_query_workers = 4
+        data_source = LoopbackMadDataSource(config, fabric)
+        hca_manager = lshca.HCAManager(data_source, config)
+        hca_manager.get_data()
+        output = hca_manager.output_info()
+    finally:
+        shutil.rmtree(root)
+
+    failed = False
+    ports = 0
+    for hca in output:
+        for bdf_device in hca["bdf_devices"]:
+            ports += 1
+            switch = switches[int(bdf_device["RDMA"].split("_")[-1]) // 4]
+            result = (bdf_device.get("SMGuid"), bdf_device.get("SwGuid"), bdf_device.get("SwDescription"))
+            status = "OK" if result == (data_source.SM_GUID, switch["system_guid"], switch["description"]) else "FAILED"
+            failed = failed or status != "OK"
+            print("{:<8} {:<18} {:<18} {:<24} {}".format(bdf_device["RDMA"], *(result + (status,))))
+
+    sent = data_source.sent_queries()
+    expected = {"NodeInfo": ports, "NodeDescription": len(switches), "SMInfoRecord": 1}
+    for attribute in sorted(expected):
+        status = "OK" if ports == len(fabric) and sent.get(attribute) == expected[attribute] else "FAILED"
+        failed = failed or status != "OK"
+        print("{:<24} {:>3} sent, {:>3} expected {}".format(attribute, sent.get(attribute, 0), expected[attribute], status))
+
+    workers = [name for name in data_source.query_threads if name.startswith("sa_smp_")]
+    status = "OK" if 1 < len(workers) <= config.sa_smp_query_workers else "FAILED"
+    failed = failed or status != "OK"
+    print("{:<24} {:>3} of {} {}".format("Querying workers", len(workers), config.sa_smp_query_workers, status))
+    return not failed
+
+
+def collect_api_check():
+    # lshca.collect() on synthetic IB host with 2 HCAs, 2 ports each. IB view of reused DataSource is answered
+    # by loopback umad devices, all ports cabled to the same switch
+    switch = {"system_guid": "0002c90300a1b2c3", "node_guid": "0002c90300a1b2c4", "port_guid": "0002c90300a1b2c4",
+              "description": "MF0;leaf-01:MQM8700/U1"}
+    fabric = dict(("mlx5_{}".format(rdma_index), {"0,1": switch}) for rdma_index in range(4))
+    ib_fields = set(lshca.Config().output_order_general["ib"] + ["SMGuid", "SwGuid", "SwDescription"]) - \
+        set(["Dev", "Desc", "PN", "PSID", "SN", "FW", "Driver"])
+    results = []
+
+    root = tempfile.mkdtemp(prefix="lshca_synthetic_")
+    try:
+        SyntheticHost(root, hcas=2, ports=2, link_layer="ib").generate()
+
+        for name, kwargs in (("Unknown view", {"view": "nosuch"}),
+                             ("Illegal where regex", {"where": ["Net=["]}),
+                             ("Illegal where filter", {"where": ["Net"]})):
+            try:
+                lshca.collect(fs_root=root, **kwargs)
+                result = "no error"
+            except ValueError:
+                result = "ValueError"
+            results.append((name, result, "ValueError"))
+
+        results.append(("Fields and where",
+                        lshca.collect(fields=["PCI_addr", "Net", "SN"], where=["RDMA=mlx5_[12]$"], fs_root=root),
+                        [{"SN": "MT2000X00000", "bdf_devices": [{"PCI_addr": "0000:10:00.1", "Net": "ens0f1"}]},
+                         {"SN": "MT2001X00001", "bdf_devices": [{"PCI_addr": "0000:12:00.0", "Net": "ens1f0"}]}]))
+        results.append(("Where on HCA field", lshca.collect(fields=["RDMA"], where=["SN=MT2001"], fs_root=root),
+                        [{"bdf_devices": [{"RDMA": "mlx5_2"}, {"RDMA": "mlx5_3"}]}]))
+
+        # Filters, fields and output order of a call don't stay in reused DataSource, nor in view defaults
+        config = lshca.Config()
+        config.fs_root = root
+        data_source = LoopbackMadDataSource(config, fabric)
+        output_order = list(config.output_order)
+        first_ib = lshca.collect("ib", data_source=data_source)
+        filtered = lshca.collect("system", fields=["RDMA"], where=["RDMA=mlx5_0$"], data_source=data_source)
+        system = lshca.collect("system", data_source=data_source)
+        second_ib = lshca.collect("ib", data_source=data_source)
+    finally:
+        shutil.rmtree(root)
+
+    results.append(("Reused, filtered call", filtered, [{"bdf_devices": [{"RDMA": "mlx5_0"}]}]))
+    results.append(("Reused, next call", [len(hca["bdf_devices"]) for hca in system], [2, 2]))
+    results.append(("Reused, IB fields", [set(bdf_device) == ib_fields for hca in second_ib
+                                          for bdf_device in hca["bdf_devices"]], [True] * 4))
+    results.append(("Reused, repeated call", second_ib, first_ib))
+    results.append(("Reused, output order", (config.output_order, lshca.Config().output_order_general["ib"]),
+                    (output_order, lshca.Config().output_order_general["ib"])))
+
+    failed = False
+    for name, result, expected in results:
+        status = "OK" if result == expected else "FAILED"
+        failed = failed or status != "OK"
+        print("{:<24} {}".format(name, status))
+        if status != "OK":
+            print("    expected: {}\n    got:      {}".format(expected, result))
+    return not failed
+
+
+def render_output(function):
+    # type: (object) -> str
+    # Returns what function prints, lshca exits when there is nothing to display
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        function()
+    except SystemExit:
+        pass
+    finally:
+        output, sys.stdout = sys.stdout.getvalue(), stdout
+    return output
+
+
+def view_fields_output(output, config):
+    # type: (str, lshca.Config) -> str
+    # -j prints BDF fields beyond the view, which one of them is dropped depends on set order (see
+    # Output.apply_select_output_filters). Fields of the output order are kept, those are the view ones
+    if config.output_format != "json":
+        return output
+    hcas = json.loads(output)
+    for hca in hcas:
+        for record in [hca] + hca["bdf_devices"]:
+            for key in list(record):
+                if key not in config.output_order and key != "bdf_devices":
+                    del record[key]
+    return json.dumps(hcas, indent=4, sort_keys=True) + "\n"
+
+
+def daemon_round_trip_check():
+    # Views of synthetic IB host served by lshca daemon and rendered by the client, compared with direct runs.
+    # Fields added during collection, SMGuid/SwGuid/SwDescription of ib and MST_device of cable, have to be shown too
+    switch = {"system_guid": "0002c90300a1b2c3", "node_guid": "0002c90300a1b2c4", "port_guid": "0002c90300a1b2c4",
+              "description": "MF0;leaf-01:MQM8700/U1"}
+    fabric = dict(("mlx5_{}".format(rdma_index), {"0,1": switch}) for rdma_index in range(2))
+    runs = [["-w", "system"], ["-w", "ib"], ["-w", "ib", "-j"], ["-w", "cable"], ["-w", "all", "-j"]]
+
+    root = tempfile.mkdtemp(prefix="lshca_synthetic_")
+    socket_path = os.path.join(root, "lshca.sock")
+    try:
+        SyntheticHost(root, hcas=1, ports=2, link_layer="ib").generate()
+        lshca_args = ["--fs-root", root, "--socket", socket_path]
+
+        # Direct runs complete before the daemon starts collecting, they don't run concurrently
+        direct = []
+        for args in runs:
+            config = lshca.Config()
+            config.parse_arguments(args + lshca_args)
+            hca_manager = lshca.HCAManager(LoopbackMadDataSource(config, fabric, query_delay=0), config)
+            hca_manager.get_data()
+            direct.append(view_fields_output(render_output(hca_manager.display_hcas_info), config))
+
+        config = lshca.Config()
+        config.parse_arguments(["--daemon"] + lshca_args)
+        daemon = lshca.LshcaDaemon(config, LoopbackMadDataSource(config, fabric, query_delay=0))
+        server = threading.Thread(target=daemon.serve_forever)
+        server.daemon = True
+        server.start()
+        for _ in range(100):
+            if os.path.exists(socket_path):
+                break
+            time.sleep(0.05)
+
+        served = []
+        for args in runs:
+            config = lshca.Config()
+            config.parse_arguments(args + lshca_args)
+            data_source = lshca.DataSource(config)
+            hcas = lshca.query_daemon(config, data_source)
+            out = lshca.Output(config, data_source)
+            for output_info in hcas or []:
+                out.append(output_info)
+            served.append(view_fields_output(render_output(out.print_output), config) if hcas is not None else
+                          "no daemon response\n")
+    finally:
+        shutil.rmtree(root)
+
+    failed = False
+    for args, direct_output, served_output in zip(runs, direct, served):
+        status = "OK" if served_output == direct_output and direct_output else "FAILED"
+        failed = failed or status != "OK"
+        print("{:<24} {}".format(" ".join(args), status))
+        if status != "OK":
+            sys.stdout.writelines(difflib.unified_diff(direct_output.splitlines(True), served_output.splitlines(True),
+                                                       "direct", "daemon"))
+    return not failed
+
+
+class SampledCountersDataSource(lshca.DataSource):
+    """
+    DataSource of synthetic host, the sampling interval is stepped instead of slept.
+    time.time() returns next of timestamps, time.sleep adds increments to the counter files of the sampled ports
+        increments: {rdma: {(counter set, counter): increment}}
+    """
+    def __init__(self, config, increments, timestamps):
+        super(SampledCountersDataSource, self).__init__(config)
+        self.increments = increments
+        self.timestamps = list(timestamps)
+        self.counters_dirs = []
+
+    def exec_python_code(self, python_code, record_suffix="", use_cache=False):
+        if python_code == "time.time()":
+            return self.timestamps.pop(0)
+        if python_code.startswith("time.sleep("):
+            for counters_dir in self.counters_dirs:
+                # i.e. /sys/bus/pci/devices/0000:03:00.0/infiniband/mlx5_0/ports/1
+                rdma = counters_dir.split("/infiniband/")[1].split("/")[0]
+                for (counter_set, counter), increment in self.increments.get(rdma, {}).items():
+                    counter_path = self.fs_path(counters_dir + "/" + counter_set + "/" + counter)
+                    with open(counter_path) as f:
+                        value = int(f.read())
+                    with open(counter_path, "w") as f:
+                        f.write("{}\n".format(value + increment))
+            return None
+        return super(SampledCountersDataSource, self).exec_python_code(python_code, record_suffix, use_cache)
+
+    def read_counters(self, counters_dirs, record_suffix=""):
+        self.counters_dirs = counters_dirs
+        return super(SampledCountersDataSource, self).read_counters(counters_dirs, record_suffix)
+
+
+def counters_sampling_check():
+    # counters view of synthetic host with 2 IB ports, counters and hw_counters of a port are merged into its lines.
+    # Counters change between the samples taken 2 seconds apart, --nonzero shows only the changed ones
+    increments = {"mlx5_0": {("counters", "port_xmit_data"): 4000, ("hw_counters", "out_of_buffer"): 3},
+                  "mlx5_1": {("counters", "symbol_error"): 1}}
+    expected_nonzero = [("mlx5_0", "counters", "port_xmit_data", 5000, 4000, 2000.0),
+                        ("mlx5_0", "hw_counters", "out_of_buffer", 3, 3, 1.5),
+                        ("mlx5_1", "counters", "symbol_error", 1, 1, 0.5)]
+    failed = False
+    for nonzero in (True, False):
+        root = tempfile.mkdtemp(prefix="lshca_synthetic_")
+        try:
+            host = SyntheticHost(root, hcas=1, ports=2, link_layer="ib")
+            host.generate()
+            # Total of a counter is its value of the second sample, not the delta
+            host.write_file("/sys/bus/pci/devices/0000:10:00.0/infiniband/mlx5_0/ports/1/counters/port_xmit_data",
+                            "1000\n")
+            config = lshca.Config()
+            config.parse_arguments(["-w", "counters", "-j", "--fs-root", root] + (["--nonzero"] if nonzero else []))
+            data_source = SampledCountersDataSource(config, increments, [100.0, 102.0])
+            hca_manager = lshca.HCAManager(data_source, config)
+            hca_manager.get_data()
+            output = hca_manager.output_info()
+        finally:
+            shutil.rmtree(root)
+
+        lines = [(line["RDMA"], line["CntrSet"], line["Counter"], line["Total"], line["Delta"], line["PerSec"])
+                 for hca in output for line in hca["bdf_devices"]]
+        if nonzero:
+            status = "OK" if lines == expected_nonzero else "FAILED"
+            for line in lines:
+                print("{:<8} {:<12} {:<16} {:>6} {:>6} {:>8}".format(*line))
+        else:
+            counter_sets = set((line[0], line[1]) for line in lines)
+            zero_lines = [line for line in lines if line[4] == 0]
+            status = "OK" if [line for line in lines if line[4]] == expected_nonzero and \
+                len(counter_sets) == 4 and zero_lines and not [line for line in zero_lines if line[5]] else "FAILED"
+            print("{} lines of {} counter sets, {} unchanged".format(len(lines), len(counter_sets), len(zero_lines)))
+        failed = failed or status != "OK"
+        print("{:<10} {}".format("--nonzero" if nonzero else "all", status))
+    return not failed
+
+
+class StandInEthtoolClient(lshca.EthtoolClient):
+    """
+    ethtool client answered by stand-in SIOCETHTOOL ioctl from samples: {interface: [{statistic: value}]}
+    Every ETHTOOL_GSTATS of an interface returns its next sample, last one is repeated.
+    Statistics names are of the sample read, so sample with other statistics is a changed statistics set.
+    Interface not in samples fails the ioctl, as interface without driver statistics does
+    """
+    def __init__(self, samples):
+        # type: (dict) -> None
+        super(StandInEthtoolClient, self).__init__()
+        self.samples = samples
+        self.reads = dict((interface, 0) for interface in samples)
+
+    def _ioctl(self, sock, interface, buf):
+        if interface not in self.samples:
+            raise IOError(errno.EOPNOTSUPP, "Operation not supported")
+        sample = self.samples[interface][min(self.reads[interface], len(self.samples[interface]) - 1)]
+        names = sorted(sample)
+        command = struct.unpack_from("=I", buf.raw)[0]
+        if command == self.ETHTOOL_GSSET_INFO:
+            self.SSET_INFO_STRUCT.pack_into(buf, 0, command, 0, 1 << self.ETH_SS_STATS, len(names))
+        elif command == self.ETHTOOL_GSTRINGS:
+            self.GSTRINGS_STRUCT.pack_into(buf, 0, command, self.ETH_SS_STATS, len(names))
+            for index, name in enumerate(names):
+                struct.pack_into("{}s".format(self.ETH_GSTRING_LEN), buf,
+                                 self.GSTRINGS_STRUCT.size + index * self.ETH_GSTRING_LEN, name.encode())
+        elif command == self.ETHTOOL_GSTATS:
+            # Kernel reports its number of statistics, values are copied as many as the buffer has room for
+            self.GSTATS_STRUCT.pack_into(buf, 0, command, len(names))
+            room = (len(buf) - self.GSTATS_STRUCT.size) // self.STAT_STRUCT.size
+            for index, name in enumerate(names[:room]):
+                self.STAT_STRUCT.pack_into(buf, self.GSTATS_STRUCT.size + index * self.STAT_STRUCT.size, sample[name])
+            self.reads[interface] += 1
+
+
+class SampledEthtoolDataSource(lshca.DataSource):
+    """
+    DataSource of synthetic host with driver statistics of stand-in ethtool client and DCB of stand-in rtnetlink.
+    time.time() returns next of timestamps, the sampling interval isn't slept
+    """
+    def __init__(self, config, ethtool_client, timestamps):
+        super(SampledEthtoolDataSource, self).__init__(config)
+        self.ethtool_client = ethtool_client
+        self.timestamps = list(timestamps)
+
+    def exec_python_code(self, python_code, record_suffix="", use_cache=False):
+        if python_code == "time.time()":
+            return self.timestamps.pop(0)
+        if python_code.startswith("time.sleep("):
+            return None
+        return super(SampledEthtoolDataSource, self).exec_python_code(python_code, record_suffix, use_cache)
+
+    def get_ethtool_stats(self, interfaces, record_suffix=""):
+        # ioctl isn't skipped under fs_root, it's answered by the stand-in
+        return self.ethtool_client.query(interfaces)
+
+    def get_dcb_data(self, interfaces, use_cache=True):
+        # RoCE status of ethstats view, without falling back to mlnx_qos
+        return StandInDcbNetlinkClient(SYNTHETIC_DCB).query(interfaces)
+
+
+def ethtool_stats_check():
+    # ethstats view of synthetic Eth host with 2 ports, driver statistics sampled 2 seconds apart.
+    # ens0f0 is loaded, with per queue drops summed, pause frames and pause storm. ens0f1 is idle
+    loaded = {"rx_bytes_phy": 10 ** 9, "tx_bytes_phy": 5 * 10 ** 8, "rx_prio3_bytes": 0, "tx_prio0_bytes": 0,
+              "rx_prio3_pause": 0, "tx_prio3_pause": 0, "rx_discards_phy": 0, "rx0_xdp_drop": 0, "rx1_xdp_drop": 0,
+              "tx_pause_storm_error_events": 0}
+    loaded_second = dict(loaded, rx_bytes_phy=loaded["rx_bytes_phy"] + 25 * 10 ** 8,
+                         tx_bytes_phy=loaded["tx_bytes_phy"] + 5 * 10 ** 8, rx_prio3_bytes=2 * 10 ** 9,
+                         tx_prio0_bytes=5 * 10 ** 8, rx_prio3_pause=200, rx_discards_phy=10, rx0_xdp_drop=4,
+                         rx1_xdp_drop=6, tx_pause_storm_error_events=1)
+    idle = {"rx_bytes_phy": 7000, "tx_bytes_phy": 3000, "rx_discards_phy": 0, "rx0_xdp_drop": 0,
+            "tx_pause_storm_error_events": 0}
+    expected = {"ens0f0": {"RxBps": "10.0G", "TxBps": "2.0G", "PrioRxBps": "3:8.0G", "PrioTxBps": "0:2.0G",
+                           "PrioPause": "3:100.0/0.0*", "RxDiscPhy": "5.0*", "QDrops": "5.0*", "PauseStorm": "1 >!<"},
+                "ens0f1": {"RxBps": "0.0", "TxBps": "0.0", "PrioRxBps": "", "PrioTxBps": "", "PrioPause": "",
+                           "RxDiscPhy": "0.0", "QDrops": "0.0", "PauseStorm": "0"}}
+
+    root = tempfile.mkdtemp(prefix="lshca_synthetic_")
+    try:
+        SyntheticHost(root, hcas=1, ports=2, link_layer="eth").generate()
+        config = lshca.Config()
+        config.parse_arguments(["-w", "ethstats", "--fs-root", root])
+        ethtool_client = StandInEthtoolClient({"ens0f0": [loaded, loaded_second], "ens0f1": [idle, idle]})
+        data_source = SampledEthtoolDataSource(config, ethtool_client, [100.0, 102.0])
+        hca_manager = lshca.HCAManager(data_source, config)
+        hca_manager.get_data()
+        output = hca_manager.output_info()
+    finally:
+        shutil.rmtree(root)
+
+    failed = False
+    results = dict((bdf_device["Net"], bdf_device) for hca in output for bdf_device in hca["bdf_devices"])
+    for interface in sorted(expected):
+        result = dict((field, results.get(interface, {}).get(field)) for field in expected[interface])
+        status = "OK" if result == expected[interface] else "FAILED"
+        failed = failed or status != "OK"
+        print("{:<8} {}".format(interface, status))
+        for field in sorted(expected[interface]):
+            print("    {:<10} {:<14} {}".format(field, str(result[field]), expected[interface][field]))
+
+    # Statistics set changed between the names read and values read (i.e. channels added) gives no sample,
+    # names are read again by next query. Interface without driver statistics has none
+    client = StandInEthtoolClient({"ens1f0": [idle, dict(idle, rx2_xdp_drop=0), dict(idle, rx2_xdp_drop=1)]})
+    queries = [client.query(["ens1f0", "bond0"]) for _ in range(3)]
+    result = [query["ens1f0"] for query in queries] + [queries[0]["bond0"]]
+    status = "OK" if result == [idle, None, dict(idle, rx2_xdp_drop=1), None] else "FAILED"
+    failed = failed or status != "OK"
+    print("{:<24} {}".format("Statistics set change", status))
+    return not failed
+
+
+# Snapshots of --aggregate check, {file name: content}. ndjson lines are {"node", "hcas"} or bare lshca -j output,
+# node of the latter is named after the file and line. Tempr 9 is compared as a number, it's the minimum
+FLEET_SNAPSHOTS = {
+    "node01.json": [{"SN": "MT01", "PN": "MCX653106A", "FW": "20.31.1014", "Tempr": "45",
+                     "bdf_devices": [{"PCI_addr": "0000:10:00.0", "LnkStaWidth": "x16"},
+                                     {"PCI_addr": "0000:10:00.1", "LnkStaWidth": "x16"}]}],
+    "node02.json": [{"SN": "MT02", "PN": "MCX653106A", "FW": "20.35.1012", "Tempr": "52",
+                     "bdf_devices": [{"PCI_addr": "0000:10:00.0", "LnkStaWidth": "x8"}]}],
+    "fleet.ndjson": [{"node": "node03", "hcas": [{"SN": "MT03", "PN": "MCX623106A", "FW": "22.35.2000", "Tempr": "9",
+                                                  "bdf_devices": [{"PCI_addr": "0000:3b:00.0", "LnkStaWidth": "x16"}]}]},
+                     None,
+                     [{"SN": "MT04", "PN": "MCX653106A", "FW": "20.39.1002", "Tempr": "61",
+                       "bdf_devices": [{"PCI_addr": "0000:10:00.0", "LnkStaWidth": "x16"}]}]]}
+
+
+def fleet_field(field, values, minimum, maximum, other=0):
+    # type: (str, list, str, str, int) -> dict
+    # Expected --aggregate JSON of a field, values are (value, count) kept as distinct ones
+    return {"Field": field, "Count": sum(count for _, count in values) + other, "Distinct": len(values),
+            "Min": minimum, "Max": maximum, "Values": dict(values), "Other": other}
+
+
+def run_aggregate(snapshots_dir, args):
+    # type: (str, list) -> object
+    # Returns parsed JSON output of lshca --aggregate
+    config = lshca.Config()
+    config.parse_arguments(["--aggregate", snapshots_dir, "-j"] + args)
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        lshca.aggregate_snapshots(config, lshca.DataSource(config))
+        return json.loads(sys.stdout.getvalue())
+    finally:
+        sys.stdout = stdout
+
+
+def fleet_aggregate_check():
+    # --aggregate of json and ndjson snapshots grouped by PN, in a single process and by worker processes
+    expected = [{"PN": "MCX623106A", "Nodes": 1, "Ports": 1,
+                 "bdf_devices": [fleet_field("FW", [("22.35.2000", 1)], "22.35.2000", "22.35.2000"),
+                                 fleet_field("Tempr", [("9", 1)], "9", "9"),
+                                 fleet_field("LnkStaWidth", [("x16", 1)], "x16", "x16"),
+                                 fleet_field("Node", [("node03", 1)], "node03", "node03")]},
+                {"PN": "MCX653106A", "Nodes": 3, "Ports": 4,
+                 "bdf_devices": [fleet_field("FW", [("20.31.1014", 2), ("20.35.1012", 1), ("20.39.1002", 1)],
+                                             "20.31.1014", "20.39.1002"),
+                                 fleet_field("Tempr", [("45", 2), ("52", 1), ("61", 1)], "45", "61"),
+                                 fleet_field("LnkStaWidth", [("x16", 3), ("x8", 1)], "x16", "x8"),
+                                 fleet_field("Node", [("node01", 2), ("fleet.ndjson:3", 1), ("node02", 1)],
+                                             "fleet.ndjson:3", "node02")]}]
+    fields = ["-o", "FW,Tempr,LnkStaWidth,Node", "--group-by", "PN"]
+    # Single worker reads files in order, fleet.ndjson first. So the value kept by --max-distinct 1 is known
+    capped_fw = fleet_field("FW", [("20.39.1002", 1)], "20.31.1014", "20.39.1002", other=3)
+    # Where filter applies to rows of every snapshot before they are counted
+    filtered = [{"PN": "MCX653106A", "Nodes": 1, "Ports": 1,
+                 "bdf_devices": [fleet_field("FW", [("20.35.1012", 1)], "20.35.1012", "20.35.1012"),
+                                 fleet_field("LnkStaWidth", [("x8", 1)], "x8", "x8")]}]
+
+    snapshots_dir = tempfile.mkdtemp(prefix="lshca_fleet_")
+    try:
+        for file_name, snapshot in FLEET_SNAPSHOTS.items():
+            with open(os.path.join(snapshots_dir, file_name), "w") as f:
+                if file_name.endswith(".ndjson"):
+                    f.write("".join((json.dumps(line) if line is not None else "") + "\n" for line in snapshot))
+                else:
+                    json.dump(snapshot, f)
+
+        results = [("Aggregate, 1 worker", run_aggregate(snapshots_dir, fields + ["--aggregate-workers", "1"]),
+                    expected),
+                   ("Aggregate, 2 workers", run_aggregate(snapshots_dir, fields + ["--aggregate-workers", "2"]),
+                    expected)]
+        capped = run_aggregate(snapshots_dir, fields + ["--aggregate-workers", "1", "--max-distinct", "1"])
+        results.append(("Max distinct", capped[1]["bdf_devices"][0], capped_fw))
+        results.append(("Where filter", run_aggregate(snapshots_dir, ["-o", "FW,LnkStaWidth", "--group-by", "PN",
+                                                                      "-ow", "LnkStaWidth=x8",
+                                                                      "--aggregate-workers", "1"]), filtered))
+    finally:
+        shutil.rmtree(snapshots_dir)
+
+    failed = False
+    for name, result, expected_result in results:
+        status = "OK" if result == expected_result else "FAILED"
+        failed = failed or status != "OK"
+        print("{:<24} {}".format(name, status))
+        if status != "OK":
+            print("    expected: {}\n    got:      {}".format(json.dumps(expected_result, sort_keys=True),
+                                                            json.dumps(result, sort_keys=True)))
+    return not failed
+
+
+class StandInNetlinkSocket(object):
+    """
+    Stand-in of netlink socket. Every request sent is answered by reply_function(request message type, flags,
+    attributes payload), it returns list of (message type, flags, payload) reply messages.
+    All replies queued since last recv are returned by single recv, so messages are parsed from one buffer,
+    recv of empty queue times out, like the kernel socket with timeout does.
+    """
+    NLMSG_HDR_STRUCT = struct.Struct("=IHHII")
+
+    def __init__(self, reply_function):
+        self.reply_function = reply_function
+        self.requests = []
+        self._replies = b""
+
+    def settimeout(self, timeout):
+        pass
+
+    def bind(self, address):
+        pass
+
+    def close(self):
+        pass
+
+    def send(self, data):
+        _, msg_type, flags, seq, _ = self.NLMSG_HDR_STRUCT.unpack_from(data)
+        self.requests.append(data)
+        for reply_type, reply_flags, payload in self.reply_function(msg_type, flags,
+                                                                    data[self.NLMSG_HDR_STRUCT.size:]):
+            message = self.NLMSG_HDR_STRUCT.pack(self.NLMSG_HDR_STRUCT.size + len(payload), reply_type, reply_flags,
+                                                 seq, 0) + payload
+            self._replies += message + b"\0" * (nl_align(len(message)) - len(message))
+        return len(data)
+
+    def recv(self, size):
+        if not self._replies:
+            raise socket.timeout()
+        data, self._replies = self._replies[:size], self._replies[size:]
+        return data
+
+
+def nl_align(length):
+    # type: (int) -> int
+    return (length + 3) & ~3
+
+
+def nla(nla_type, payload, nested=False):
+    # type: (int, bytes, bool) -> bytes
+    # Netlink attribute with padding, nested ones have NLA_F_NESTED flag, as the kernel sets it
+    attribute = struct.pack("=HH", 4 + len(payload), nla_type | (0x8000 if nested else 0)) + payload
+    return attribute + b"\0" * (nl_align(len(attribute)) - len(attribute))
+
+
+def nla_attributes(data):
+    # type: (bytes) -> dict
+    attributes = {}
+    offset = 0
+    while offset + 4 <= len(data):
+        nla_len, nla_type = struct.unpack_from("=HH", data, offset)
+        attributes[nla_type & 0x3fff] = data[offset + 4:offset + nla_len]
+        offset += nl_align(nla_len)
+    return attributes
+
+
+# DCB of synthetic Eth host ports: ens0f0 with PFC on priority 3, port buffers and DSCP trust, ens0f1 with defaults
+SYNTHETIC_DCB = {"ens0f0": {"pfc_en": 0x08, "prio_tc": [0, 1, 2, 3, 4, 5, 6, 7], "tc_tsa": [2] * 8,
+                            "tc_tx_bw": [13, 13, 12, 12, 12, 12, 13, 13], "prio2buffer": [0, 0, 0, 1, 0, 0, 0, 0],
+                            "buffer_size": [130944, 130944, 0, 0, 0, 0, 0, 0], "total_size": 261888,
+                            "app": [(5, 3, 26), (5, 6, 48)]},
+                 "ens0f1": {"pfc_en": 0x00, "prio_tc": [0] * 8, "tc_tsa": [2] * 8, "tc_tx_bw": [100] + [0] * 7,
+                            "app": []}}
+
+
+class StandInDcbNetlinkClient(lshca.DcbNetlinkClient):
+    """
+    DCB netlink client answered by stand-in rtnetlink socket from interfaces description:
+        {interface: {"pfc_en": bitmask, "prio_tc": [8], "tc_tsa": [8], "tc_tx_bw": [8],
+                     "prio2buffer": [8], "buffer_size": [8], "total_size": int, "app": [(selector, priority, protocol)]}}
+    Unknown interface is answered by netlink error, as interface without DCB support is
+    """
+    NLMSG_ERROR = 2
+    IEEE_PFC_STRUCT_FULL = struct.Struct("=BBBxH2x8Q8Q") # struct ieee_pfc, lshca reads first 3 fields only
+
+    def __init__(self, interfaces):
+        # type: (dict) -> None
+        self.interfaces = interfaces
+        self.sock = StandInNetlinkSocket(self._reply)
+
+    def _socket(self):
+        return self.sock
+
+    def _reply(self, msg_type, flags, payload):
+        interface = nla_attributes(payload[self.DCBMSG_STRUCT.size:]).get(self.DCB_ATTR_IFNAME, b"").split(b"\0")[0]
+        dcb = self.interfaces.get(interface.decode())
+        if msg_type != self.RTM_GETDCB or dcb is None:
+            return [(self.NLMSG_ERROR, 0, struct.pack("=i", -errno.EOPNOTSUPP) + b"\0" * 16)]
+
+        app_table = b"".join(nla(1, self.DCB_APP_STRUCT.pack(*app)) for app in dcb["app"]) # DCB_ATTR_IEEE_APP
+        ieee = nla(self.DCB_ATTR_IEEE_ETS, self.IEEE_ETS_STRUCT.pack(0, 8, 0, bytes(bytearray(dcb["tc_tx_bw"])),
+                                                                     bytes(bytearray(dcb["tc_tx_bw"])),
+                                                                     bytes(bytearray(dcb["tc_tsa"])),
+                                                                     bytes(bytearray(dcb["prio_tc"])),
+                                                                     b"\0" * 8, b"\0" * 8, b"\0" * 8)) + \
+            nla(self.DCB_ATTR_IEEE_PFC, self.IEEE_PFC_STRUCT_FULL.pack(8, dcb["pfc_en"], 0, 0, *([0] * 16))) + \
+            nla(self.DCB_ATTR_IEEE_APP_TABLE, app_table, nested=True)
+        if "prio2buffer" in dcb:
+            ieee += nla(self.DCB_ATTR_DCB_BUFFER, self.DCB_BUFFER_STRUCT.pack(bytes(bytearray(dcb["prio2buffer"])),
+                                                                           *(dcb["buffer_size"] + [dcb["total_size"]])))
+        reply = self.DCBMSG_STRUCT.pack(socket.AF_UNSPEC, self.DCB_CMD_IEEE_GET, 0) + \
+            nla(self.DCB_ATTR_IFNAME, interface + b"\0") + nla(self.DCB_ATTR_IEEE, ieee, nested=True)
+        return [(self.RTM_GETDCB, 0, reply)]
+
+
+def dcb_netlink_check():
+    # Round trip of lshca.DcbNetlinkClient requests and reply parsing through stand-in rtnetlink socket
+    client = StandInDcbNetlinkClient(SYNTHETIC_DCB)
+    results = client.query(["ens0f0", "ens0f1", "bond0"])
+
+    expected = {"ens0f0": {"pfc_cap": 8, "pfc": "00010000", "prio_tc": [0, 1, 2, 3, 4, 5, 6, 7], "tc_tsa": [2] * 8,
+                           "tc_tx_bw": [13, 13, 12, 12, 12, 12, 13, 13], "prio2buffer": [0, 0, 0, 1, 0, 0, 0, 0],
+                           "buffer_size": [130944, 130944, 0, 0, 0, 0, 0, 0], "total_size": 261888,
+                           "app": [(5, 3, 26), (5, 6, 48)], "trust": "dscp"},
+                "ens0f1": {"pfc_cap": 8, "pfc": "00000000", "prio_tc": [0] * 8, "tc_tsa": [2] * 8,
+                           "tc_tx_bw": [100] + [0] * 7, "app": [], "trust": "pcp"},
+                "bond0": None}
+    failed = False
+    for interface in sorted(expected):
+        status = "OK" if results.get(interface) == expected[interface] else "FAILED"
+        failed = failed or status != "OK"
+        print("{:<8} {}".format(interface, status))
+        if status != "OK":
+            print("    expected: {}\n    got:      {}".format(expected[interface], results.get(interface)))
+    print("{} request(s) sent".format(len(client.sock.requests)))
+    return not failed
+
+
+class StandInRdmaNetlinkClient(lshca.RdmaNetlinkClient):
+    """
+    RDMA netlink client answered by stand-in nldev socket from devices description:
+        {rdma: {"index": int, "fw_ver": str, "node_guid": int, "sys_image_guid": int, "protocol": "ib"/"roce",
+                "ports": [{"state": int, "phys_state": int, "lid": int, "sm_lid": int, "subnet_prefix": int,
+                           "netdev": str}]}}
+    Port attributes missing in the description aren't sent, as the kernel doesn't send them for Eth ports
+    and netdevs of other network namespaces
+    """
+    def __init__(self, devices):
+        # type: (dict) -> None
+        self.devices = devices
+        self.sock = StandInNetlinkSocket(self._reply)
+
+    def _socket(self):
+        return self.sock
+
+    def _reply(self, msg_type, flags, payload):
+        u32 = self.U32_STRUCT.pack
+        u64 = self.U64_STRUCT.pack
+        command = msg_type & 0x3ff
+        if command == self.RDMA_NLDEV_CMD_GET and flags & self.NLM_F_DUMP == self.NLM_F_DUMP:
+            replies = []
+            for rdma, device in sorted(self.devices.items()):
+                replies.append((msg_type, 0x2, # NLM_F_MULTI
+                                nla(self.RDMA_NLDEV_ATTR_DEV_INDEX, u32(device["index"])) +
+                                nla(self.RDMA_NLDEV_ATTR_DEV_NAME, rdma.encode() + b"\0") +
+                                nla(self.RDMA_NLDEV_ATTR_PORT_INDEX, u32(len(device["ports"]))) +
+                                nla(self.RDMA_NLDEV_ATTR_FW_VERSION, device["fw_ver"].encode() + b"\0") +
+                                nla(self.RDMA_NLDEV_ATTR_NODE_GUID, u64(device["node_guid"])) +
+                                nla(self.RDMA_NLDEV_ATTR_SYS_IMAGE_GUID, u64(device["sys_image_guid"])) +
+                                nla(self.RDMA_NLDEV_ATTR_DEV_PROTOCOL, device["protocol"].encode() + b"\0")))
+            return replies + [(self.NLMSG_DONE, 0x2, u32(0))]
+
+        attributes = nla_attributes(payload)
+        if command == self.RDMA_NLDEV_CMD_PORT_GET and self.RDMA_NLDEV_ATTR_DEV_INDEX in attributes:
+            index = self.U32_STRUCT.unpack(attributes[self.RDMA_NLDEV_ATTR_DEV_INDEX])[0]
+            port_index = self.U32_STRUCT.unpack(attributes[self.RDMA_NLDEV_ATTR_PORT_INDEX])[0]
+            for rdma, device in self.devices.items():
+                if device["index"] == index and 0 < port_index <= len(device["ports"]):
+                    port = device["ports"][port_index - 1]
+                    reply = nla(self.RDMA_NLDEV_ATTR_DEV_INDEX, u32(index)) + \
+                        nla(self.RDMA_NLDEV_ATTR_PORT_INDEX, u32(port_index)) + \
+                        nla(self.RDMA_NLDEV_ATTR_PORT_STATE, self.U8_STRUCT.pack(port["state"])) + \
+                        nla(self.RDMA_NLDEV_ATTR_PORT_PHYS_STATE, self.U8_STRUCT.pack(port["phys_state"]))
+                    for key, nla_type, pack in (("lid", self.RDMA_NLDEV_ATTR_LID, u32),
+                                                ("sm_lid", self.RDMA_NLDEV_ATTR_SM_LID, u32),
+                                                ("subnet_prefix", self.RDMA_NLDEV_ATTR_SUBNET_PREFIX, u64),
+                                                ("netdev", self.RDMA_NLDEV_ATTR_NDEV_NAME,
+                                                 lambda name: name.encode() + b"\0")):
+                        if key in port:
+                            reply += nla(nla_type, pack(port[key]))
+                    return [(msg_type, 0, reply)]
+        return [(self.NLMSG_ERROR, 0, struct.pack("=i", -errno.ENODEV) + b"\0" * 16)]
+
+
+def rdma_netlink_check():
+    # Devices dump and per port requests of lshca.RdmaNetlinkClient through stand-in nldev socket.
+    # IB device, RoCE device and 2 port IB device with second port down and its netdev in other namespace
+    devices = {"mlx5_0": {"index": 0, "fw_ver": "20.31.1014", "node_guid": 0xb8599f0300000001,
+                          "sys_image_guid": 0xb8599f0300000000, "protocol": "ib",
+                          "ports": [{"state": 4, "phys_state": 5, "lid": 0x5, "sm_lid": 0x1,
+                                     "subnet_prefix": 0xfe80000000000000, "netdev": "ib0"}]},
+               "mlx5_1": {"index": 1, "fw_ver": "22.35.2000", "node_guid": 0xb8599f0300010002,
+                          "sys_image_guid": 0xb8599f0300010000, "protocol": "roce",
+                          "ports": [{"state": 1, "phys_state": 3, "netdev": "ens1f0np0"}]},
+               "mlx4_0": {"index": 2, "fw_ver": "2.42.5000", "node_guid": 0x0002c90300a1b2c1,
+                          "sys_image_guid": 0x0002c90300a1b2c0, "protocol": "ib",
+                          "ports": [{"state": 4, "phys_state": 5, "lid": 0x7, "sm_lid": 0x1,
+                                     "subnet_prefix": 0xfe80000000000000, "netdev": "ib1"},
+                                    {"state": 1, "phys_state": 2, "lid": 0x0, "sm_lid": 0x0,
+                                     "subnet_prefix": 0xfe80000000000000}]}}
+    expected = {"devices": {"mlx5_0": {"index": 0, "port_count": 1, "fw_ver": "20.31.1014", "link_layer": "InfiniBand",
+                                       "node_guid": "b859:9f03:0000:0001", "sys_image_guid": "b859:9f03:0000:0000"},
+                            "mlx5_1": {"index": 1, "port_count": 1, "fw_ver": "22.35.2000", "link_layer": "Ethernet",
+                                       "node_guid": "b859:9f03:0001:0002", "sys_image_guid": "b859:9f03:0001:0000"},
+                            "mlx4_0": {"index": 2, "port_count": 2, "fw_ver": "2.42.5000", "link_layer": "InfiniBand",
+                                       "node_guid": "0002:c903:00a1:b2c1", "sys_image_guid": "0002:c903:00a1:b2c0"}},
+                "ports": {"mlx5_0/1": {"link_layer": "InfiniBand", "netdev": "ib0", "state": "ACTIVE",
+                                       "phys_state": "LinkUp", "lid": 5, "sm_lid": 1,
+                                       "subnet_prefix": "fe80:0000:0000:0000"},
+                          "mlx5_1/1": {"link_layer": "Ethernet", "netdev": "ens1f0np0", "state": "DOWN",
+                                       "phys_state": "Disabled", "lid": 0, "sm_lid": 0},
+                          "mlx4_0/1": {"link_layer": "InfiniBand", "netdev": "ib1", "state": "ACTIVE",
+                                       "phys_state": "LinkUp", "lid": 7, "sm_lid": 1,
+                                       "subnet_prefix": "fe80:0000:0000:0000"},
+                          "mlx4_0/2": {"link_layer": "InfiniBand", "netdev": "", "state": "DOWN",
+                                       "phys_state": "Polling", "lid": 0, "sm_lid": 0,
+                                       "subnet_prefix": "fe80:0000:0000:0000"}}}
+    client = StandInRdmaNetlinkClient(devices)
+    result = client.query()
+
+    failed = False
+    for kind in ("devices", "ports"):
+        for name in sorted(set(expected[kind]) | set(result[kind])):
+            status = "OK" if result[kind].get(name) == expected[kind].get(name) else "FAILED"
+            failed = failed or status != "OK"
+            print("{:<8} {:<10} {}".format(kind[:-1], name, status))
+            if status != "OK":
+                print("    expected: {}\n    got:      {}".format(expected[kind].get(name), result[kind].get(name)))
+    # Dump request and a request per port
+    status = "OK" if len(client.sock.requests) == 1 + len(expected["ports"]) else "FAILED"
+    failed = failed or status != "OK"
+    print("{} request(s) sent {}".format(len(client.sock.requests), status))
+    return not failed
+
+
+class StandInOvsdbServer(object):
+    """
+    Stand-in of ovsdb-server unix socket, answers "transact" of Bridge/Port/Interface select operations
+    from bridges description: {bridge: {port: (ofport, admin_state)}}
+    Replies are sent in small chunks and single element sets are encoded as the element, like ovsdb-server does
+    """
+    def __init__(self, socket_path, bridges):
+        # type: (str, dict) -> None
+        self.socket_path = socket_path
+        self.bridges = bridges
+        self.requests = []
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(socket_path)
+        self._sock.listen(1)
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._sock.close()
+        os.remove(self.socket_path)
+
+    @staticmethod
+    def _set(values):
+        return values[0] if len(values) == 1 else ["set", values]
+
+    def _tables(self):
+        rows = {"Bridge": [], "Port": [], "Interface": []}
+        for bridge, ports in sorted(self.bridges.items()):
+            port_uuids = []
+            for port, (ofport, admin_state) in sorted(ports.items()):
+                port_uuid = ["uuid", str(uuid.uuid4())]
+                interface_uuid = ["uuid", str(uuid.uuid4())]
+                port_uuids.append(port_uuid)
+                rows["Port"].append({"_uuid": port_uuid, "name": port, "interfaces": interface_uuid})
+                rows["Interface"].append({"_uuid": interface_uuid, "name": port,
+                                          "ofport": ofport if ofport is not None else ["set", []],
+                                          "admin_state": admin_state if admin_state else ["set", []]})
+            rows["Bridge"].append({"name": bridge, "ports": self._set(port_uuids)})
+        return rows
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self._sock.accept()
+            except (socket.error, OSError):
+                return
+            data = b""
+            while True:
+                data += connection.recv(4096)
+                try:
+                    request = json.loads(data.decode())
+                    break
+                except ValueError:
+                    continue
+            self.requests.append(request)
+            tables = self._tables()
+            result = [{"rows": tables[operation["table"]]} for operation in request["params"][1:]]
+            reply = json.dumps({"id": request["id"], "result": result, "error": None}).encode()
+            for offset in range(0, len(reply), 100):
+                connection.sendall(reply[offset:offset + 100])
+            connection.close()
+
+
+def ovsdb_stand_in_check():
+    # Round trip of lshca.OvsdbClient transaction and port index through the stand-in ovsdb-server
+    bridges = {"ovsbr1": {"p0": (1, "up"), "pf0hpf": (2, "up"), "pf0vf0": (3, "down")},
+               "ovsbr2": {"p1": (None, None)}}
+    socket_dir = tempfile.mkdtemp()
+    server = StandInOvsdbServer(os.path.join(socket_dir, "db.sock"), bridges)
+    try:
+        index = lshca.OvsdbClient(server.socket_path).get_ports_index()
+    finally:
+        server.close()
+        shutil.rmtree(socket_dir)
+
+    failed = False
+    for bridge, ports in sorted(bridges.items()):
+        for port, (ofport, admin_state) in sorted(ports.items()):
+            expected = {"bridge": bridge, "ofport": str(ofport) if ofport is not None else "",
+                        "admin_state": admin_state or ""}
+            status = "OK" if index.get(port) == expected else "FAILED"
+            failed = failed or status != "OK"
+            print("{:<10} {:<50} {}".format(port, str(index.get(port)), status))
+    print("{} transaction(s) sent".format(len(server.requests)))
+    return not failed
+
+
+class StandInClock(object):
+    # Time stands still till it's moved by advance
+    def __init__(self, now=1000.0):
+        # type: (float) -> None
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        # type: (float) -> None
+        self.now += seconds
+
+
+def cache_expiry_check():
+    # Entries of every cache class through lshca.DataSourceCache expire and LRU eviction, ages set by stand-in clock
+    clock = StandInClock()
+    cache = lshca.DataSourceCache({"static": None, "slow": 600, "volatile": 30}, 4, clock)
+    entries = [("shell.cmd", "lspci -vvvDnnd 15b3:", "static"),
+               ("file", "/sys/module/mlx5_core/version", "static"),
+               ("shell.cmd", "mlxconfig -d /dev/mst/mt4123_pciconf0 q", "slow"),
+               ("file", "/sys/class/net/ens0f0/operstate", "volatile")]
+    for source, key, _ in entries:
+        cache.set(source, key, key)
+
+    def cached():
+        return [key for source, key, _ in entries if (source, key) in cache]
+
+    steps = []
+    steps.append(("classes", [cache.classify(source, key) for source, key, _ in entries],
+                  [cache_class for _, _, cache_class in entries]))
+
+    clock.advance(31)
+    # Within a run nothing expires, only expire drops entries
+    steps.append(("31s, before expire", cached(), [key for _, key, _ in entries]))
+    cache.expire()
+    steps.append(("31s, volatile expired", cached(), [key for _, key, _ in entries[:3]]))
+
+    clock.advance(570)
+    cache.expire()
+    steps.append(("601s, slow expired", cached(), [key for _, key, _ in entries[:2]]))
+
+    # volatile entries set now are fresh, 4 of 6 entries are kept, least recently used are evicted
+    carriers = [("file", "/sys/class/net/ens0f{}/carrier".format(index), "volatile") for index in range(4)]
+    for source, key, _ in carriers:
+        cache.set(source, key, key)
+    entries.extend(carriers)
+    cache.get("shell.cmd", "lspci -vvvDnnd 15b3:")
+    cache.expire()
+    steps.append(("LRU eviction", cached(), [entries[0][1]] + [key for _, key, _ in carriers[1:]]))
+
+    steps.append(("stats", [(cache_class, cache.stats[cache_class]["expired"], cache.stats[cache_class]["evictions"])
+                            for cache_class in lshca.DataSourceCache.CLASSES],
+                  [("static", 0, 1), ("slow", 1, 0), ("volatile", 1, 1)]))
+
+    failed = False
+    for name, result, expected in steps:
+        status = "OK" if result == expected else "FAILED"
+        failed = failed or status != "OK"
+        print("{:<24} {}".format(name, status))
+        if status != "OK":
+            print("    expected: {}\n    got:      {}".format(expected, result))
+    return not failed
+
+
+# The measured lshca process reports its own counters, syscalls of the forked utilities are counted only with strace
+def measure_lshca(root, lshca_args):
+    # type: (str, list) -> dict
+    report_file = os.path.join(root, "measure.json")
+    wrapper = textwrap.dedent("""\
+        import json, resource, sys
+        sys.path.insert(0, {lshca_home!r})
+        import lshca
+        sys.argv = ["lshca"] + {lshca_args!r}
+        try:
+            lshca.main()
+        finally:
+            io = dict(l.split(": ") for l in open("/proc/self/io").read().splitlines())
+            json.dump({{"rw_syscalls": int(io["syscr"]) + int(io["syscw"]),
+                       "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}},
+                      open({report_file!r}, "w"))
+        """).format(lshca_home=LSHCA_HOME, lshca_args=["--fs-root", root] + lshca_args, report_file=report_file)
+
+    cmd = [sys.executable, "-c", wrapper]
+    strace_file = os.path.join(root, "strace.txt")
+    use_strace = find_executable("strace") is not None
+    if use_strace:
+        cmd = ["strace", "-f", "-c", "-o", strace_file] + cmd
+
+    devnull = open(os.devnull, "w")
+    start = time.time()
+    subprocess.call(cmd, stdout=devnull, stderr=devnull)
+    wall_time = time.time() - start
+    devnull.close()
+
+    with open(report_file) as f:
+        result = json.load(f)
+    result["wall_time"] = wall_time
+    result["syscalls"] = None
+    if use_strace:
+        for line in open(strace_file).read().splitlines():
+            if line.strip().endswith("total"):
+                result["syscalls"] = int(line.split()[2])
+    return result
+
+
+def find_executable(name):
+    # type: (str) -> str
+    for path in os.environ.get("PATH", "").split(os.pathsep):
+        if os.access(os.path.join(path, name), os.X_OK):
+            return os.path.join(path, name)
+    return None
+
+
+def scale(args):
+    results = []
+    for hcas in args.hca_counts:
+        root = tempfile.mkdtemp(prefix="lshca_synthetic_")
+        try:
+            host = SyntheticHost(root, hcas, args.ports, args.vfs, args.sfs, args.link_layer, args.bonds, args.representors)
+            host.generate()
+            result = measure_lshca(root, args.lshca_args)
+            result["hcas"] = hcas
+            result["bdf_devices"] = host.bdf_count
+            results.append(result)
+        finally:
+            shutil.rmtree(root)
+
+    print("{0:>6} | {1:>11} | {2:>10} | {3:>10} | {4:>11} | {5:>8}".format(
+        "HCAs", "BDF devices", "Wall, ms", "Syscalls", "RW syscalls", "RSS, MB"))
+    print('-' * 71)
+    for result in results:
+        syscalls = result["syscalls"] if result["syscalls"] is not None else "N/A"
+        print("{0:>6} | {1:>11} | {2:>10.1f} | {3:>10} | {4:>11} | {5:>8.1f}".format(
+            result["hcas"], result["bdf_devices"], result["wall_time"] * 1000, syscalls,
+            result["rw_syscalls"], result["maxrss_kb"] / 1024.0))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+
+    generate_parser = subparsers.add_parser("generate", help="generate synthetic host in to a directory")
+    generate_parser.add_argument("root", help="destination directory, pass it to lshca --fs-root")
+    generate_parser.add_argument("-n", dest="hcas", type=int, default=1, help="number of HCAs (default: %(default)s)")
+
+    scale_parser = subparsers.add_parser("scale", help="measure lshca against growing synthetic hosts")
+    scale_parser.add_argument("-n", dest="hca_counts", type=int, nargs="+", default=[1, 2, 4, 8, 16],
+                              help="HCA counts to measure (default: %(default)s)")
+    scale_parser.add_argument("--json", help="save results to JSON file")
+    scale_parser.add_argument("--lshca-args", nargs=argparse.REMAINDER, default=["-j"],
+                              help="lshca arguments, HAS to be the LAST parameter (default: -j)")
+
+    for sub_parser in (generate_parser, scale_parser):
+        sub_parser.add_argument("-p", dest="ports", type=int, default=2, help="ports (PFs) per HCA (default: %(default)s)")
+        sub_parser.add_argument("-v", dest="vfs", type=int, default=0, help="VFs per PF (default: %(default)s)")
+        sub_parser.add_argument("-s", dest="sfs", type=int, default=0, help="SFs per PF (default: %(default)s)")
+        sub_parser.add_argument("--link", dest="link_layer", choices=["ib", "eth", "mixed"], default="ib",
+                                help="ports link layer (default: %(default)s)")
+        sub_parser.add_argument("--bonds", action="store_true", help="bond all PFs of each HCA, RDMA bond")
+        sub_parser.add_argument("--representors", action="store_true", help="add uplink, PF and VF representors")
+
+    subparsers.add_parser("umad-loopback", help="check native MAD client of lshca against in memory umad device")
+    subparsers.add_parser("ovsdb-stand-in", help="check OVSDB client of lshca against stand-in ovsdb-server socket")
+    subparsers.add_parser("cache-expiry", help="check expiry and eviction of lshca DataSourceCache by stand-in clock")
+    subparsers.add_parser("sa-smp-batching", help="check SA/SMP query deduplication and fan-out against loopback umad devices")
+    subparsers.add_parser("dcb-netlink", help="check DCB netlink client of lshca against stand-in rtnetlink socket")
+    subparsers.add_parser("counters-sampling", help="check counters view rates and --nonzero with counters changing between samples")
+    subparsers.add_parser("rdma-netlink", help="check RDMA netlink (nldev) client of lshca against stand-in netlink socket")
+    subparsers.add_parser("ethtool-stats", help="check ethtool statistics client and ethstats view rates against stand-in ethtool ioctl")
+    subparsers.add_parser("fleet-aggregate", help="check --aggregate on json and ndjson snapshots with expected output")
+    subparsers.add_parser("collect-api", help="check lshca.collect() library API: errors, fields and where, reused DataSource")
+    subparsers.add_parser("daemon-round-trip", help="check lshca daemon served output against direct output of the same views")
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        host = SyntheticHost(args.root, args.hcas, args.ports, args.vfs, args.sfs, args.link_layer, args.bonds, args.representors)
+        host.generate()
+        print("Synthetic host with {} BDF devices written to {}".format(host.bdf_count, args.root))
+        print("Run: lshca --fs-root " + args.root)
+    elif args.command == "scale":
+        scale(args)
+    elif args.command == "umad-loopback":
+        sys.exit(0 if umad_loopback_check() else 1)
+    elif args.command == "ovsdb-stand-in":
+        sys.exit(0 if ovsdb_stand_in_check() else 1)
+    elif args.command == "cache-expiry":
+        sys.exit(0 if cache_expiry_check() else 1)
+    elif args.command == "sa-smp-batching":
+        sys.exit(0 if sa_smp_batching_check() else 1)
+    elif args.command == "dcb-netlink":
+        sys.exit(0 if dcb_netlink_check() else 1)
+    elif args.command == "counters-sampling":
+        sys.exit(0 if counters_sampling_check() else 1)
+    elif args.command == "rdma-netlink":
+        sys.exit(0 if rdma_netlink_check() else 1)
+    elif args.command == "ethtool-stats":
+        sys.exit(0 if ethtool_stats_check() else 1)
+    elif args.command == "fleet-aggregate":
+        sys.exit(0 if fleet_aggregate_check() else 1)
+    elif args.command == "collect-api":
+        sys.exit(0 if collect_api_check() else 1)
+    elif args.command == "daemon-round-trip":
+        sys.exit(0 if daemon_round_trip_check() else 1)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()